@@ -95,7 +95,7 @@ class Game(object):
                                   (0,0,0), True)
         
         #Create the scene, and apply the light to it.
-        self.scene = pyggel.scene.Scene()
+        self.scene = pyggel.scene.CellScene()
         self.scene.add_light(light)
 
         #Keep the mouse in the window, and make it disssssappear! Mwahahaha!
@@ -135,7 +135,9 @@ class Game(object):
         
         #parse ze level
         static, self.walls._objects = level_parse(self, self.scene)
-        self.scene.add_3d(pyggel.misc.StaticObjectGroup(static))
+        self.scene.add_3d(pyggel.misc.StaticObjectGroup(static, merge=True)) #one draw per texture for the whole level
+        self.scene.occlude = True #the walls hide most of the robots
+        self.scene.build_from_grid(GRID, 5, (0, 0), (-2.5, 2.5)) #and only the rooms in view are drawn
 
         self.event_handler = pyggel.event.Handler()
         
@@ -77,7 +77,9 @@ def main():
 
     while 1:
         clock.tick(60) #limit FPS
-        pyggel.view.set_title("FPS: %s"%int(clock.get_fps()))
+        #FPS only tells you something is slow - pyggel.view.get_stats tells you what was rendered last frame,
+        #how many texture binds/display lists/etc. it took and how long each part of the scene took to render
+        pyggel.view.set_title("FPS: %s - %s"%(int(clock.get_fps()), pyggel.view.get_stats()))
 
         event_handler.update() #get the events!
 
@@ -8,7 +8,7 @@ from include import *
 
 import mesh, view, image, camera, math3d, light
 import scene, font, geometry, misc, data
-import particle, event, gui
+import particle, event, gui, octree, occlusion, snapshot, loop, scenefile
 
 def quit():
     """Deinitialize PYGGEL..."""
@@ -9,6 +9,7 @@ and the LookAtCamera - which is basically a third-person camera
 from include import *
 import numpy
 from math import sqrt
+import math3d, view
 
 class Base(object):
     """camera.Base camera object all other inherit from..."""
@@ -22,6 +23,7 @@ class Base(object):
     def push(self):
         """Activate the camera - anything rendered after this uses the cameras transformations."""
         glPushMatrix()
+        view.stats.matrix_pushes += 1
 
     def pop(self):
         """Deactivate the camera - must be called after push or will raise an OpenGL error"""
@@ -47,6 +49,17 @@ class Base(object):
         """Transforms the view only for a skybox, ie only rotation is taken into account, not position"""
         pass
 
+    def get_matrix(self):
+        """Return a 4x4 numpy matrix of the transformation push applies - used for culling and picking without touching OpenGL"""
+        return math3d.identity_matrix()
+
+    def get_eye_pos(self):
+        """Return the (x,y,z) position the camera is looking from, worked out from get_matrix
+           For a LookAtCamera this is not get_pos (what it looks at), but where it sits, distance away from that"""
+        m = self.get_matrix()
+        x, y, z = -numpy.dot(m[:3,:3].T, m[:3,3])
+        return float(x), float(y), -float(z) #objects at (x,y,z) are rendered at (x,y,-z)
+
 class LookFromCamera(Base):
     """camera.LookFromCamera is a FPS camera"""
     def __init__(self, pos=(0,0,0), rotation=(0,0,0)):
@@ -55,6 +68,7 @@ class LookFromCamera(Base):
 
     def push(self):
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glRotatef(self.rotx, 1, 0, 0)
         glRotatef(self.roty, 0, 1, 0)
         glRotatef(self.rotz, 0, 0, 1)
@@ -85,6 +99,13 @@ class LookFromCamera(Base):
         glRotatef(self.rotz, 0, 0, 1)
     set_skybox_data.__doc__ = Base.set_skybox_data.__doc__
 
+    def get_matrix(self):
+        return numpy.dot(numpy.dot(numpy.dot(math3d.rotate_matrix(self.rotx, 1, 0, 0),
+                                             math3d.rotate_matrix(self.roty, 0, 1, 0)),
+                                   math3d.rotate_matrix(self.rotz, 0, 0, 1)),
+                         math3d.translate_matrix(-self.posx, -self.posy, self.posz))
+    get_matrix.__doc__ = Base.get_matrix.__doc__
+
 class LookAtCamera(Base):
     """camera.LookAtCamera is a third-person camera"""
     def __init__(self, pos=[0,0,0], rotation=[0,0,0],
@@ -98,6 +119,7 @@ class LookAtCamera(Base):
 
     def push(self):
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glTranslatef(0, 0, -self.distance)
         glRotatef(-self.rotx, 1, 0, 0)
         glRotatef(-self.roty, 0, 1, 0)
@@ -116,3 +138,11 @@ class LookAtCamera(Base):
         glRotatef(-self.roty, 0, 1, 0)
         glRotatef(self.rotz, 0, 0, 1)
     set_skybox_data.__doc__ = Base.set_skybox_data.__doc__
+
+    def get_matrix(self):
+        m = numpy.dot(math3d.translate_matrix(0, 0, -self.distance),
+                      math3d.rotate_matrix(-self.rotx, 1, 0, 0))
+        m = numpy.dot(numpy.dot(m, math3d.rotate_matrix(-self.roty, 0, 1, 0)),
+                      math3d.rotate_matrix(self.rotz, 0, 0, 1))
+        return numpy.dot(m, math3d.translate_matrix(-self.posx, -self.posy, self.posz))
+    get_matrix.__doc__ = Base.get_matrix.__doc__
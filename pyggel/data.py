@@ -65,6 +65,7 @@ class Texture(object):
         tdata = pygame.image.tostring(image, "RGBA", 1)
         
         glBindTexture(GL_TEXTURE_2D, self.gl_tex)
+        Texture.bound = self
 
         xx, xy = size
         self.size = size
@@ -84,8 +85,10 @@ class Texture(object):
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
 
     def bind(self):
-        """Binds the texture for usage"""
-        if not Texture.bound == self:
+        """Binds the texture for usage
+           Textures loaded from the same file share the OpenGL texture, so only bind if that changes -
+           which means anything that changes the wrap or filter mode of a texture must set it back after (see geometry.Plane)"""
+        if Texture.bound is None or not Texture.bound.gl_tex == self.gl_tex:
             glBindTexture(GL_TEXTURE_2D, self.gl_tex)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
@@ -93,6 +96,7 @@ class Texture(object):
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
             glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
             Texture.bound = self
+            view.stats.texture_binds += 1
 
     def __del__(self):
         """Clear the texture data"""
@@ -110,14 +114,18 @@ class Texture(object):
 class BlankTexture(Texture):
     """A cached, blank texture."""
     _all_loaded = {}
-    def __init__(self, size=(1,1), color=(1,1,1,1)):
+    def __init__(self, size=(1,1), color=(1,1,1,1), shared=True):
         """Create an empty data.Texture
            size must be a two part tuple representing the pixel size of the texture
-           color must be a four-part tuple representing the (RGBA 0-1) color of the texture"""
+           color must be a four-part tuple representing the (RGBA 0-1) color of the texture
+           shared is whether to use the same OpenGL texture as every other BlankTexture of this size and color -
+               should be False if the texture will be drawn into (like the texture of a FrameBuffer)"""
         view.require_init() # It seems to need init on python2.6
         
         self.size = size
         self.filename = repr(size)+repr(color)
+        if not shared:
+            self.filename += "#%x" % id(self) #a name no other BlankTexture has
         self.gl_tex = None
         if self.filename in self._all_loaded:
             tex = self._all_loaded[self.filename][0]
@@ -160,6 +168,7 @@ class DisplayList(object):
     def render(self):
         """Render the display list"""
         glCallList(self.gl_list)
+        view.stats.display_lists += 1
 
     def __del__(self):
         """Clear the display list data"""
@@ -203,6 +212,104 @@ class VertexArray(object):
         glDisableClientState(GL_COLOR_ARRAY)
         glDisableClientState(GL_TEXTURE_COORD_ARRAY)
 
+def vbo_available():
+    """Return whether VertexBuffers can be used (they need OpenGL 1.5) - only call after view.init"""
+    try:
+        return bool(glGenBuffers) and bool(glBufferData)
+    except:
+        return False
+
+class VertexBuffer(object):
+    """An object to store and render an OpenGL vertex buffer object of interleaved float32 vertices,
+       and optionally an index buffer of which vertices make up each triangle (or whatever render_type is).
+       Unlike a DisplayList, the vertices can be changed afterwards (see update),
+       and the numpy arrays are kept (vertices and indices) for picking, collision or anything else that needs them."""
+    def __init__(self, vertices, format=GL_T2F_N3F_V3F, indices=None,
+                 render_type=GL_TRIANGLES, usage=GL_STATIC_DRAW):
+        """Create the buffer
+           vertices must be an (n,k) numpy array (or list) of the interleaved vertices, in the layout of format
+           format is the OpenGL constant for the layout of the vertices, as for glInterleavedArrays, ie GL_T2F_N3F_V3F
+           indices can be None (draw the vertices in order) or an array of the index of each vertex to draw -
+               it is stored as 16 bit if every index fits, otherwise 32 bit
+           render_type is the OpenGL constant used in rendering, ie GL_TRIANGLES, GL_QUADS, etc.
+           usage is the OpenGL hint of how often the vertices will change - GL_STATIC_DRAW, GL_DYNAMIC_DRAW or GL_STREAM_DRAW"""
+        view.require_init()
+        if not vbo_available():
+            raise AttributeError("Vertex buffer objects not available!")
+
+        self.vertices = numpy.ascontiguousarray(vertices, dtype=numpy.float32)
+        self.format = format
+        self.render_type = render_type
+        self.usage = usage
+
+        self.gl_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.gl_buffer)
+        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes, self.vertices, usage)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+        self.indices = None
+        self.gl_index_buffer = None
+        if indices is not None:
+            self.set_indices(indices)
+
+    def set_indices(self, indices):
+        """Replace the index buffer with the array indices, or remove it if indices is None."""
+        if indices is None:
+            self.indices = None
+            return None
+        indices = numpy.asarray(indices)
+        if not indices.dtype in (numpy.uint16, numpy.uint32):
+            if len(indices) and indices.max() > 65535:
+                indices = indices.astype(numpy.uint32)
+            else:
+                indices = indices.astype(numpy.uint16)
+        self.indices = numpy.ascontiguousarray(indices.ravel())
+        if self.gl_index_buffer is None:
+            self.gl_index_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.gl_index_buffer)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indices.nbytes, self.indices, self.usage)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+    def update(self, vertices, start=0):
+        """Replace the vertices from start on with the array vertices - only that part of the buffer is sent to the video card."""
+        vertices = numpy.ascontiguousarray(vertices, dtype=numpy.float32)
+        if not self.vertices.flags.writeable:
+            self.vertices = self.vertices.copy() #memory mapped from a file, most likely
+        self.vertices[start:start+len(vertices)] = vertices
+        row = self.vertices.strides[0]
+        glBindBuffer(GL_ARRAY_BUFFER, self.gl_buffer)
+        glBufferSubData(GL_ARRAY_BUFFER, start * row, len(vertices) * row, vertices)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def render(self):
+        """Render the buffer"""
+        glBindBuffer(GL_ARRAY_BUFFER, self.gl_buffer)
+        glInterleavedArrays(self.format, 0, None)
+        if self.indices is None:
+            glDrawArrays(self.render_type, 0, len(self.vertices))
+        else:
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.gl_index_buffer)
+            if self.indices.dtype == numpy.uint16:
+                glDrawElements(self.render_type, len(self.indices), GL_UNSIGNED_SHORT, None)
+            else:
+                glDrawElements(self.render_type, len(self.indices), GL_UNSIGNED_INT, None)
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+        view.stats.draw_arrays += 1
+
+    def __del__(self):
+        """Clear the buffer data"""
+        try:
+            glDeleteBuffers(1, [self.gl_buffer])
+            if self.gl_index_buffer is not None:
+                glDeleteBuffers(1, [self.gl_index_buffer])
+        except:
+            pass #already cleared!
+
 class FrameBuffer(object):
     """An object contains functions to render to a texture instead of to the main display.
        This object renders using FBO's, which are not available to everyone, but they are far faster and more versatile."""
@@ -225,7 +332,7 @@ class FrameBuffer(object):
         self.size = size
         self.clear_color = clear_color
 
-        self.texture = BlankTexture(self.size, self.clear_color)
+        self.texture = BlankTexture(self.size, self.clear_color, False)
 
         if not bool(glGenRenderbuffersEXT):
             print("glGenRenderbuffersEXT doesn't exist")
@@ -315,7 +422,7 @@ class TextureBuffer(object):
         self.size = size
         self.clear_color = clear_color
 
-        self.texture = BlankTexture(self.size, self.clear_color)
+        self.texture = BlankTexture(self.size, self.clear_color, False)
         self.worked = True
 
     def enable(self):
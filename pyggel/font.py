@@ -361,6 +361,7 @@ class FontImage(BaseSceneObject):
     def render(self, camera=None):
         """Render the image."""
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glTranslatef(self.pos[0], self.pos[1], 0)
         a, b, c = self.rotation
         glRotatef(a, 1, 0, 0)
@@ -567,6 +568,7 @@ class MEFontImage(BaseSceneObject):
         """Render the image."""
         fo = self.font
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glTranslatef(self.pos[0], self.pos[1], 0)
         a, b, c = self.rotation
         glRotatef(a, 1, 0, 0)
@@ -12,6 +12,17 @@ import view, data, misc, math3d
 from data import Texture, BlankTexture
 from scene import BaseSceneObject
 
+def _render_faces(faces):
+    """Render a list of (normal, ((texcoord, vertex),)*4) quads, like Cube._get_faces returns."""
+    for normal, points in faces:
+        glBegin(GL_QUADS)
+        glNormal3f(*normal)
+        for coord, vert in points:
+            glTexCoord2fv(coord)
+            a, b, c = vert
+            glVertex3f(a,b,c)
+        glEnd()
+
 class Cube(BaseSceneObject):
     """A geometric cube that can be colored and textured"""
     def __init__(self, size, pos=(0,0,0), rotation=(0,0,0),
@@ -96,22 +107,32 @@ class Cube(BaseSceneObject):
         self._compile()
 
     def get_dimensions(self):
-        """Return a tuple of the size of the cube - to be used by the quad tree and collision testing"""
+        """Return a tuple of the size of the cube - to be used by the octree and collision testing"""
         return self.size, self.size, self.size
 
+    def get_occluder_box(self):
+        """Return the bounding box of the cube if it is solid (no hidden faces, not rotated, opaque), otherwise None
+           Used by Scene.occlude for cubes in a misc.StaticObjectGroup, or any cube with occluder set to True"""
+        if self.hide_faces or self.colorize[3] < 1:
+            return None
+        return self.get_bounding_box()
+
     def get_pos(self):
         """Return the position of the quad"""
         return self.pos
 
-    def _compile(self):
-        """Compile the cube's rendering into a data.DisplayList"""
-        self.display_list.begin()
+    def _get_transform(self):
+        """Return the (pos, rotation, scale) tuples get_matrix is built from - the cube is scaled by its size too."""
+        pos, rot, (sx, sy, sz) = BaseSceneObject._get_transform(self)
+        s = .5*self.size
+        return pos, rot, (sx*s, sy*s, sz*s)
 
+    def _get_faces(self):
+        """Return a list of (normal, ((texcoord, vertex),)*4) of every quad of the cube."""
         ox = .25
         oy = .33
-        last_tex = None
+        faces = []
         for i in self.sides:
-            ix = 0
             x, y = self.split_coords[i[5]]
             x *= ox
             y *= oy
@@ -119,36 +140,37 @@ class Cube(BaseSceneObject):
                 coords = ((1,1), (1,0), (0,0), (0,1))
             else:
                 coords = ((x+ox, y+oy), (x+ox, y), (x, y), (x, y+oy))
+            faces.append((self.normals[i[6]], zip(coords, [self.corners[x] for x in i[:4]])))
+        return faces
 
-            glBegin(GL_QUADS)
-
-            glNormal3f(*self.normals[i[6]])
-
-            for x in i[:4]:
-                glTexCoord2fv(coords[ix])
-                a, b, c = self.corners[x]
-                glVertex3f(a,b,c)
-                ix += 1
-            glEnd()
+    def _compile(self):
+        """Compile the cube's rendering into a data.DisplayList"""
+        self.display_list.begin()
+        _render_faces(self._get_faces())
         self.display_list.end()
 
+    def get_geometry(self):
+        verts, norms, texcs = [], [], []
+        for normal, points in self._get_faces():
+            for i in (0, 1, 2, 0, 2, 3):
+                coord, vert = points[i]
+                verts.append(vert)
+                norms.append(normal)
+                texcs.append(coord)
+        if not verts:
+            return []
+        return [(self.texture, self.colorize,
+                 numpy.array(verts, dtype=numpy.float32),
+                 numpy.array(norms, dtype=numpy.float32),
+                 numpy.array(texcs, dtype=numpy.float32))]
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
+
     def render(self, camera=None):
         """Render the cube
            camera is None or the camera object the scene is using to render this object"""
         glPushMatrix()
-        x, y, z = self.pos
-        glTranslatef(x, y, -z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        glScalef(.5*self.size,.5*self.size,.5*self.size)
-        try:
-            if not self.scale==(1,1,1):
-                glScalef(*self.scale)
-        except:
-            if not self.scale==1:
-                glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
         self.texture.bind()
         if self.outline:
@@ -198,32 +220,20 @@ class Quad(Cube, BaseSceneObject):
 
         self._compile()
 
-    def _compile(self):
-        """Compile the Quad into a data.DisplayList"""
-        self.display_list.begin()
+    def _get_faces(self):
+        """Return a list of (normal, ((texcoord, vertex),)*4) of the front and back of the Quad."""
+        return self._get_tiled_faces(1)
 
-        glBegin(GL_QUADS)
-        glNormal3f(0,1,0)
+    def _get_tiled_faces(self, tile):
+        """Return _get_faces with the texture repeated tile times across the face."""
+        faces = []
         if not "back" in self.hide_faces:
-            glTexCoord2f(1,1)
-            glVertex3f(-1,1,0)
-            glTexCoord2f(0,1)
-            glVertex3f(1, 1, 0)
-            glTexCoord2f(0,0)
-            glVertex3f(1, -1, 0)
-            glTexCoord2f(1,0)
-            glVertex3f(-1, -1, 0)
+            faces.append(((0,1,0), (((tile,tile), (-1,1,0)), ((0,tile), (1,1,0)),
+                                    ((0,0), (1,-1,0)), ((tile,0), (-1,-1,0)))))
         if not "front" in self.hide_faces:
-            glTexCoord2f(1,0)
-            glVertex3f(-1, -1, 0)
-            glTexCoord2f(0,0)
-            glVertex3f(1, -1, 0)
-            glTexCoord2f(0,1)
-            glVertex3f(1, 1, 0)
-            glTexCoord2f(1,1)
-            glVertex3f(-1, 1, 0)
-        glEnd()
-        self.display_list.end()
+            faces.append(((0,1,0), (((tile,0), (-1,-1,0)), ((0,0), (1,-1,0)),
+                                    ((0,tile), (1,1,0)), ((tile,tile), (-1,1,0)))))
+        return faces
 
     def copy(self):
         """Return a copy of the Quad, sharing the same display list"""
@@ -237,6 +247,10 @@ class Quad(Cube, BaseSceneObject):
            camera is None or the camera object the scene is using to render this object"""
         Cube.render(self, camera)
 
+    def get_occluder_box(self):
+        """Return None - a Quad is flat, so it never fills its bounding box."""
+        return None
+
 class Plane(Quad):
     """Like a Quad, except the texture is tiled on the face, which increases performance over a lot of quads tiled"""
     def __init__(self, size, pos=(0,0,0), rotation=(0,0,0),
@@ -254,6 +268,10 @@ class Plane(Quad):
 
         Quad.__init__(self, size, pos, rotation, colorize, texture, hide_faces)
 
+    def _get_faces(self):
+        """Return a list of (normal, ((texcoord, vertex),)*4) of the front and back of the Plane."""
+        return self._get_tiled_faces(self.tile)
+
     def _compile(self):
         """Compile Plane into a data.DisplayList"""
         self.display_list.begin()
@@ -262,47 +280,20 @@ class Plane(Quad):
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_R, GL_REPEAT)
 
-        glBegin(GL_QUADS)
-        glNormal3f(0,1,0)
-        if not "back" in self.hide_faces:
-            glTexCoord2f(self.tile,self.tile)
-            glVertex3f(-1,1,0)
-            glTexCoord2f(0,self.tile)
-            glVertex3f(1, 1, 0)
-            glTexCoord2f(0,0)
-            glVertex3f(1, -1, 0)
-            glTexCoord2f(self.tile,0)
-            glVertex3f(-1, -1, 0)
-        if not "front" in self.hide_faces:
-            glTexCoord2f(self.tile,0)
-            glVertex3f(-1, -1, 0)
-            glTexCoord2f(0,0)
-            glVertex3f(1, -1, 0)
-            glTexCoord2f(0,self.tile)
-            glVertex3f(1, 1, 0)
-            glTexCoord2f(self.tile,self.tile)
-            glVertex3f(-1, 1, 0)
-        glEnd()
+        _render_faces(self._get_faces())
+
+        #put the texture back how data.Texture.bind leaves it, other objects using it may not bind it again
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
         self.display_list.end()
 
     def render(self, camera=None):
         """Render the Plane
            camera is None or the camera object the scene is using to render this object"""
         glPushMatrix()
-        x, y, z = self.pos
-        glTranslatef(x, y, -z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        s = self.size / self.tile if (self.size and self.tile) else self.size
-        glScalef(.5*self.size,.5*self.size,.5*self.size)
-        try:
-            if not self.scale == (1,1,1):
-                glScalef(*self.scale)
-        except:
-            if not self.scale == 1:
-                glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
         self.texture.bind()
         self.display_list.render()
@@ -334,6 +325,7 @@ class Skybox(Cube):
         glDisable(GL_CULL_FACE)
 
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         camera.set_skybox_data()
         Cube.render(self)
         glPopMatrix()
@@ -381,16 +373,21 @@ class Sphere(BaseSceneObject):
         self._compile()
 
     def get_dimensions(self):
-        """Return a three part tuple of the radius of the sphere - used in teh quadtree and collision testing"""
-        return self.size, self.size, self.size
+        """Return a three part tuple of the width of the sphere (twice the radius) - used in the octree and collision testing"""
+        return self.size*2, self.size*2, self.size*2
 
     def get_pos(self):
         """Return the position of the sphere"""
         return self.pos
 
-    def _compile(self):
-        """Compile the Sphere into a data.DisplayList"""
-        self.display_list.begin()
+    def _get_transform(self):
+        """Return the (pos, rotation, scale) tuples get_matrix is built from - the sphere is scaled by its size too."""
+        pos, rot, (sx, sy, sz) = BaseSceneObject._get_transform(self)
+        s = self.size
+        return pos, rot, (sx*s, sy*s, sz*s)
+
+    def _get_triangles(self):
+        """Return the vertices, normals and texcoords lists of every triangle of the Sphere."""
         verts = []
         texcs = []
         norms = []
@@ -423,6 +420,12 @@ class Sphere(BaseSceneObject):
                     texcs.extend(reversed(texcs[-6::]))
                     norms.extend([math3d.calcTriNormal(*verts[-6:-3])]*3)
                     norms.extend([math3d.calcTriNormal(*verts[-3::])]*3)
+        return verts, norms, texcs
+
+    def _compile(self):
+        """Compile the Sphere into a data.DisplayList"""
+        self.display_list.begin()
+        verts, norms, texcs = self._get_triangles()
         glBegin(GL_TRIANGLES)
         for i in xrange(len(verts)):
             u,v = texcs[i]
@@ -433,23 +436,20 @@ class Sphere(BaseSceneObject):
         glEnd()
         self.display_list.end()
 
+    def get_geometry(self):
+        verts, norms, texcs = self._get_triangles()
+        return [(self.texture, self.colorize,
+                 numpy.array(verts, dtype=numpy.float32),
+                 numpy.array(norms, dtype=numpy.float32),
+                 numpy.array(texcs, dtype=numpy.float32))]
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
+
     def render(self, camera=None):
         """Render the Sphere
            camera can be None or the camera object the scene is using"""
         glPushMatrix()
-        x, y, z = self.pos
-        glTranslatef(x, y, -z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        glScalef(self.size, self.size, self.size)
-        try:
-            if not self.scale == (1,1,1):
-                glScalef(*self.scale)
-        except:
-            if not self.scale == 1:
-                glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
         self.texture.bind()
         if self.outline:
@@ -486,6 +486,7 @@ class Skyball(Sphere):
         glDisable(GL_CULL_FACE)
 
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         camera.set_skybox_data()
         glRotatef(-90, 1, 0, 0)
         Sphere.render(self)
@@ -4,13 +4,14 @@ This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contr
 
 The image module contains classes to load and render both 2d and 3d (billboarded) images.
 """
-import time
 
 from include import *
 
-import view, data, misc
+import view, data, misc, math3d
+import numpy
 
 from scene import BaseSceneObject
+from loop import get_time
 
 class Image(BaseSceneObject):
     """A 2d image object"""
@@ -173,6 +174,7 @@ class Image(BaseSceneObject):
         pos = self.pos
 
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glTranslatef(pos[0]+ox, pos[1]+oy, 0)
 
         glRotatef(self.rotation[0], 1, 0, 0)
@@ -251,8 +253,8 @@ class Image3D(Image):
                        scale, colorize)
 
     def get_dimensions(self):
-        """Return a tuple of (1,1,1) signifying the 3d dimensions of teh image - used by the quad tree"""
-        return 1, 1, 1
+        """Return a tuple of (2,2,2) signifying the 3d dimensions of the image (which spans -1 to 1) - used by the octree"""
+        return 2, 2, 2
 
     def get_pos(self):
         """Return the position of the Image3D"""
@@ -271,6 +273,7 @@ class Image3D(Image):
         pos = self.pos
 
         glPushMatrix()
+        view.stats.matrix_pushes += 1
         glTranslatef(pos[0], pos[1], -pos[2])
         if camera:
             camera.set_facing_matrix()
@@ -385,6 +388,115 @@ class Image3D(Image):
         image = self._pimage.subsurface(topleft, size)
         return Image3D(image, self.pos, self.rotation, self.scale, self.colorize)
 
+class SpriteBatch(object):
+    """Collects 2d textured quads (sprites), and draws every run of sprites that share a texture
+       with a single glDrawArrays call, from float32 vertex arrays - instead of one display list call each."""
+    def __init__(self, keep_order=True):
+        """Create the batch
+           keep_order is whether sprites must be drawn in the order they were added (so overlapping ones stay correct),
+               if False all sprites with the same texture are drawn together, which is faster when they don't overlap"""
+        self.keep_order = keep_order
+        self.clear()
+
+    def __len__(self):
+        """Return the number of sprites waiting to be drawn."""
+        return len(self._textures)
+
+    def clear(self):
+        """Remove all sprites without drawing them."""
+        self._textures = []
+        self._rows = [] #x, y, half width, half height, rotation x/y/z, scale x/y, r, g, b, a, u0, v0, u1, v1
+
+    def accepts(self, obj):
+        """Return whether obj can be drawn by the batch - plain Images without outlines or blits."""
+        return type(obj) is Image and not obj.outline and not obj.to_be_blitted
+
+    def add(self, texture, pos, size, rotation=(0,0,0), scale=1, color=(1,1,1,1), uv=(0,0,1,1)):
+        """Add a sprite
+           texture is the data.Texture to draw with
+           pos is the (x,y) top left of the sprite
+           size is the (width, height) of the sprite
+           rotation is the (x,y,z) rotation of the sprite, around its center
+           scale is a number or (x,y) scale of the sprite, around its center
+           color is the (r,g,b) or (r,g,b,a) color of the sprite
+           uv is the (left, top, right, bottom) area of the texture to use"""
+        try: sx, sy = scale[0], scale[1]
+        except: sx = sy = scale
+        if len(color) == 3:
+            color = tuple(color) + (1,)
+        w, h = size
+        self._textures.append(texture)
+        self._rows.append((pos[0] + w*0.5, pos[1] + h*0.5, w*0.5, h*0.5,
+                           rotation[0], rotation[1], rotation[2], sx, sy) + tuple(color) + tuple(uv))
+
+    def add_image(self, image):
+        """Add an Image, drawn the same way Image.render would."""
+        w, h = image.get_size()
+        aw, ah = image._altered_image_size
+        ox, oy = image.offset
+        self.add(image.texture, image.pos, (ox*2, oy*2), image.rotation, image.scale,
+                 image.colorize, (0, 0, 1.0*w/aw, 1.0*h/ah))
+
+    def draw(self):
+        """Draw all sprites that are on screen, and clear the batch."""
+        if not self._rows:
+            return None
+        textures = self._textures
+        rows = numpy.array(self._rows, dtype=numpy.float64)
+        self.clear()
+
+        #same as Image.test_on_screen, for all sprites at once
+        sw, sh = view.screen.screen_size_2d
+        x0 = rows[:,0] - rows[:,2]
+        y0 = rows[:,1] - rows[:,3]
+        keep = numpy.flatnonzero((x0 < sw) & (y0 < sh) & (x0 + rows[:,2]*2 > 0) & (y0 + rows[:,3]*2 > 0))
+        if not len(keep):
+            return None
+        rows = rows[keep]
+        keys = numpy.array([textures[i].gl_tex for i in keep])
+        if not self.keep_order:
+            order = numpy.argsort(keys, kind="mergesort")
+            rows = rows[order]
+            keep = keep[order]
+            keys = keys[order]
+        n = len(rows)
+
+        scale = numpy.ones((n, 3), dtype=numpy.float64)
+        scale[:,0:2] = rows[:,7:9]
+        pos = numpy.zeros((n, 3), dtype=numpy.float64)
+        pos[:,0:2] = rows[:,0:2]
+        m = math3d.transform_matrices(pos, rows[:,4:7], scale)
+
+        #corners, in the same order as Image._compile - top left, bottom left, bottom right, top right
+        corners = numpy.zeros((n, 4, 3), dtype=numpy.float64)
+        corners[:,:,0] = rows[:,2:3] * (-1, -1, 1, 1)
+        corners[:,:,1] = rows[:,3:4] * (-1, 1, 1, -1)
+        verts = numpy.empty((n, 4, 3), dtype=numpy.float32)
+        for i in xrange(3):
+            verts[:,:,i] = (corners * m[:,i:i+1,0:3]).sum(2) + m[:,i:i+1,3]
+        colors = numpy.repeat(rows[:,9:13], 4, 0).astype(numpy.float32)
+        texcs = numpy.empty((n, 4, 2), dtype=numpy.float32)
+        texcs[:,:,0] = rows[:,(13, 13, 15, 15)]
+        texcs[:,:,1] = rows[:,(14, 16, 16, 14)]
+
+        #runs of sprites that share a texture
+        starts = [0] + (numpy.flatnonzero(keys[1:] != keys[:-1]) + 1).tolist() + [n]
+
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, verts.reshape(n*4, 3))
+        glColorPointer(4, GL_FLOAT, 0, colors)
+        glTexCoordPointer(2, GL_FLOAT, 0, texcs.reshape(n*4, 2))
+        for i in xrange(len(starts)-1):
+            start = starts[i]
+            textures[keep[start]].bind()
+            glDrawArrays(GL_QUADS, start*4, (starts[i+1]-start)*4)
+            view.stats.draw_arrays += 1
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+
 def create_empty_image(size=(2,2), color=(1,1,1,1)):
     """Same as create_empty_texture, except returns an image.Image instead"""
     view.require_init()
@@ -424,7 +536,7 @@ class Animation(BaseSceneObject):
         self.colorize = colorize
 
         self.cur = 0
-        self.ptime = time.time()
+        self.ptime = get_time()
         self.running = True
         self.breakpoint = len(self.frames)-1
         self.startpoint = 0
@@ -437,7 +549,7 @@ class Animation(BaseSceneObject):
         """Render the animation - this also keeps track of swapping frames when they have run for their duration.
            camera must be None or the camera.Camera object used to render the scene."""
         if self.running:
-            if time.time() - self.ptime > self.frames[self.cur][1]:
+            if get_time() - self.ptime > self.frames[self.cur][1]:
                 if self.reversed:
                     self.cur -= 1
                     if self.cur < self.startpoint:
@@ -453,7 +565,7 @@ class Animation(BaseSceneObject):
                         else:
                             self.cur -= 1
 
-                self.ptime = time.time()
+                self.ptime = get_time()
 
         frame = self.current()
         frame.pos = self.pos
@@ -474,7 +586,7 @@ class Animation(BaseSceneObject):
         if self.cur >= len(self.frames):
             self.cur = len(self.frames)-1
 
-        self.ptime = time.time()
+        self.ptime = get_time()
 
     def set_bounds(self, start, end):
         """Set the start/end 'bounds' for playback, ie which range of frames to play."""
@@ -498,7 +610,7 @@ class Animation(BaseSceneObject):
     def play(self):
         """Play the animation - only needed if pause has been called."""
         self.running = True
-        self.ptime = time.time()
+        self.ptime = get_time()
 
     def rewind(self):
         """Rewind the playback to first frame."""
@@ -531,13 +643,13 @@ class Animation(BaseSceneObject):
     def reset(self):
         """Reset the image playback."""
         self.cur = 0
-        self.ptime = time.time()
+        self.ptime = get_time()
         self.reversed = False
 
     def loop(self, boolean=True):
         """Set looping of playback on/off - if looping is off animation will continue until the last frame and freeze."""
         self.looping = boolean
-        self.ptime = time.time()
+        self.ptime = get_time()
 
     def copy(self):
         """Return a copy of this Animation. Frames are shared..."""
@@ -614,8 +726,8 @@ class Animation3D(Animation):
     test_on_screen = blit
 
     def get_dimensions(self):
-        """Return a tuple of (1,1,1) signifying the 3d dimensions of teh image - used by the quad tree"""
-        return 1, 1, 1
+        """Return a tuple of (2,2,2) signifying the 3d dimensions of the image (which spans -1 to 1) - used by the octree"""
+        return 2, 2, 2
 
     def get_pos(self):
         """Return the position of the Image3D"""
@@ -2,11 +2,13 @@
 pyggel.light
 This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
 
-The light module contains a basic light class that interfaces with the OpenGL Light(s).
+The light module contains a basic light class that interfaces with the OpenGL Light(s),
+and a manager that shares the OpenGL Lights between any number of lights.
 """
 
 from include import *
-import math3d, camera
+import math3d, camera, octree
+import math
 
 all_lights = []
 for i in xrange(8):
@@ -14,24 +16,62 @@ for i in xrange(8):
 
 class Light(object):
     """A simple 3d light"""
+    _watchers = ()
     def __init__(self, pos=(0,0,0), ambient=(0,0,0,0),
                  diffuse=(1,1,1,1), specular=(1,1,1,1),
-                 spot_direction=(0,0,0), directional=True):
+                 spot_direction=(0,0,0), directional=True,
+                 range=None, attenuation=(1,0,0)):
         """Create the light
            pos it the position of the light
            ambient is the ambient color of the light
            diffuse is the diffuse color of the light
            specular is how much objects mirror the light, ie how shiny they are
            spot_direction is the 3d direction the light will be facing if it is directional
-           directional is whether the light is directional or global"""
+           directional is whether the light is directional or global
+           range is None (light everything) or how far a non-directional light reaches,
+               objects further away than this are not lit by it when a scene has more lights than OpenGL does
+           attenuation is the (constant, linear, quadratic) fade of a non-directional light over distance"""
         self.pos = pos
         self.directional = directional
         self.ambient = ambient
         self.diffuse = diffuse
         self.specular = specular
         self.spot_direction = spot_direction
+        self.range = range
+        self.attenuation = attenuation
         self.gl_light = GL_LIGHT0
 
+    def getpos(self):
+        """Return the pos of the light."""
+        return self._pos
+    def setpos(self, pos):
+        """Set the pos of the light - tells anything watching the light that it moved."""
+        self._pos = pos
+        for i in self._watchers:
+            i.object_moved(self)
+    pos = property(getpos, setpos)
+
+    def add_watcher(self, watcher):
+        """Add an object (like an octree.Octree) that is told when pos is set.
+           watcher must have an object_moved(obj) method"""
+        if not self._watchers:
+            self._watchers = []
+        if not watcher in self._watchers:
+            self._watchers.append(watcher)
+
+    def remove_watcher(self, watcher):
+        """Remove a watcher from the light."""
+        if watcher in self._watchers:
+            self._watchers.remove(watcher)
+
+    def is_global(self):
+        """Return whether the light reaches everything - ie it is directional or has no range."""
+        return self.directional or self.range is None
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere of everywhere the light reaches."""
+        return math3d.Sphere(self.pos, self.range or 0)
+
     def shine(self):
         """Resets the position and enables the light, called after a camera is pushed to ensure it remains in the right place"""
         if not self.gl_light == None:
@@ -41,9 +81,130 @@ class Light(object):
             glLightfv(gl_light, GL_SPECULAR, self.specular)
             glLightfv(gl_light, GL_POSITION, (self.pos[0], self.pos[1], -self.pos[2], int(not self.directional)))
             glLightfv(gl_light, GL_SPOT_DIRECTION, self.spot_direction+(0,))
+            if not self.directional:
+                a, b, c = self.attenuation
+                glLightf(gl_light, GL_CONSTANT_ATTENUATION, a)
+                glLightf(gl_light, GL_LINEAR_ATTENUATION, b)
+                glLightf(gl_light, GL_QUADRATIC_ATTENUATION, c)
             glEnable(gl_light)
 
     def hide(self):
         """Disables the light"""
         if self.gl_light:
             glDisable(self.gl_light)
+
+class LightManager(object):
+    """Shares the OpenGL Lights between any number of Lights.
+       Global lights (see Light.is_global) always shine, the rest are kept in an octree.Octree by their range.
+       If more lights can be seen than OpenGL has, each object gets only the ones most influential to it."""
+    def __init__(self, max_lights=8, center=(0,0,0), size=512, max_depth=5):
+        """Create the LightManager
+           max_lights is how many OpenGL Lights to use, at most 8
+           center/size/max_depth are the settings for the octree.Octree the lights are sorted into"""
+        self.max_lights = min(max_lights, len(all_lights))
+        self.lights = []
+        self.global_lights = []
+        self.tree = octree.Octree(center, size, max_depth)
+
+        self.per_object = False #whether lights are being picked for each object this frame
+        self._visible = set()
+        self._slots = {} #gl_light: Light shining with it
+        self._current = None #the lights picked for the last object
+
+    def add(self, light):
+        """Add a Light to the manager."""
+        if light in self.lights:
+            return
+        self.lights.append(light)
+        if light.is_global():
+            self.global_lights.append(light)
+        else:
+            self.tree.add(light)
+
+    def remove(self, light):
+        """Remove a Light from the manager."""
+        if not light in self.lights:
+            return
+        self.lights.remove(light)
+        if light in self.global_lights:
+            self.global_lights.remove(light)
+        self.tree.remove(light)
+
+    def update(self, light):
+        """Update the manager after changing the range or directional attributes of light.
+           Setting the pos of a light does this automatically."""
+        self.remove(light)
+        self.add(light)
+
+    def begin(self, frustum=None):
+        """Start lighting a frame - must be called after the camera is pushed.
+           frustum is None or the planes (like Scene.get_frustum returns) the camera can see, lights out of view are skipped
+           Returns whether apply must be called for each object before rendering it."""
+        if frustum is None:
+            visible = self.tree.get_all()
+        else:
+            visible = self.tree.get_in_frustum(frustum)
+        self._current = None
+        if len(self.global_lights) + len(visible) <= self.max_lights:
+            self.per_object = False
+            self._set_lights(self.global_lights + visible)
+        else:
+            self.per_object = True
+            self._visible = set(visible)
+        return self.per_object
+
+    def get_lights(self, obj):
+        """Return the lights that most influence obj, at most max_lights of them
+           obj must have a get_bounding_sphere method (like scene.BaseSceneObject)"""
+        lights = self.global_lights[:self.max_lights]
+        left = self.max_lights - len(lights)
+        if left > 0:
+            sphere = obj.get_bounding_sphere()
+            x, y, z = sphere.x, sphere.y, sphere.z
+            near = []
+            for i in self.tree.get_colliding((x, y, z), sphere.radius):
+                if i in self._visible:
+                    lx, ly, lz = i.pos
+                    dist = math.sqrt((lx-x)**2 + (ly-y)**2 + (lz-z)**2) - sphere.radius
+                    near.append((max(dist, 0) / (i.range or 1), i))
+            near.sort(key=lambda x: x[0])
+            lights = lights + [i[1] for i in near[:left]]
+        return lights
+
+    def apply(self, obj):
+        """Shine the lights that most influence obj, only changes the OpenGL Lights that need it
+           must be called with the camera pushed, before obj is rendered"""
+        if self.per_object:
+            self._set_lights(self.get_lights(obj))
+
+    def _set_lights(self, lights):
+        """Make the OpenGL Lights shine lights, keeping lights that are already on where they are."""
+        if lights == self._current:
+            return
+        self._current = lights
+        slots = self._slots
+        keep = set(lights)
+        free = []
+        for gl_light in all_lights[:self.max_lights]:
+            light = slots.get(gl_light)
+            if light is None or not light in keep:
+                free.append(gl_light)
+            else:
+                keep.remove(light)
+        for light in lights:
+            if light in keep:
+                gl_light = free.pop()
+                light.gl_light = gl_light
+                light.shine()
+                slots[gl_light] = light
+        for gl_light in free:
+            if gl_light in slots:
+                glDisable(gl_light)
+                del slots[gl_light]
+
+    def end(self):
+        """Turn off all the lights at the end of a frame."""
+        for gl_light in self._slots:
+            glDisable(gl_light)
+        self._slots = {}
+        self._current = None
@@ -0,0 +1,121 @@
+"""
+pyggel.loop
+This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
+
+The loop module contains the clock all timed things in PYGGEL (like animations) read,
+and a game loop that updates at a fixed rate no matter how fast it renders.
+"""
+
+import time
+
+class Clock(object):
+    """A source of time, in seconds.
+       By default it follows the real time, but it can be frozen and moved by hand,
+       so tests and benchmarks get the same results every run."""
+    def __init__(self, source=time.time):
+        """Create the clock
+           source is the function that returns the real time, in seconds"""
+        self.source = source
+        self.frozen = None #the time the clock is stuck at, or None if it follows source
+
+    def get_time(self):
+        """Return the current time."""
+        if self.frozen is None:
+            return self.source()
+        return self.frozen
+
+    def set_time(self, seconds):
+        """Freeze the clock at seconds - it will only change by calling set_time or advance again."""
+        self.frozen = seconds
+
+    def advance(self, seconds):
+        """Freeze the clock, seconds later than it is now."""
+        self.frozen = self.get_time() + seconds
+
+    def unfreeze(self):
+        """Make the clock follow the real time again."""
+        self.frozen = None
+
+clock = Clock() #the clock used by get_time
+
+def get_time():
+    """Return the current time, in seconds, from the clock - use this instead of time.time for anything that animates."""
+    return clock.get_time()
+
+def set_clock(new):
+    """Replace the clock get_time reads with new, and return the old one."""
+    global clock
+    old = clock
+    clock = new
+    return old
+
+class FixedStepLoop(object):
+    """A game loop that calls update a fixed number of times per second,
+       and render as often as it can, with how far it is between two updates.
+       So the game runs at the same speed (and the same way every time) whatever the frame rate."""
+    def __init__(self, update, render, rate=60, max_steps=5, clock=None):
+        """Create the loop
+           update is called as update(seconds) each step - seconds is always 1.0/rate
+           render is called as render(alpha) each frame - alpha is 0-1, how far time is from the last update
+               to the next one, to blend between the previous and current state of moving things
+           rate is the number of updates per second
+           max_steps is the most updates done before a render, so a slow frame doesn't snowball
+               - any time left over past that is dropped
+           clock is None (use the loop module clock) or a Clock object"""
+        self.update = update
+        self.render = render
+        self.step = 1.0 / rate
+        self.max_steps = max_steps
+        self.clock = clock
+
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.last_time = None
+        self.running = False
+
+        self.steps = 0 #total number of updates done
+        self.frames = 0 #total number of renders done
+
+    def get_time(self):
+        """Return the time from the loop's clock."""
+        if self.clock:
+            return self.clock.get_time()
+        return get_time()
+
+    def reset(self):
+        """Forget any time that has built up - call after a long pause, like loading."""
+        self.accumulator = 0.0
+        self.last_time = None
+
+    def tick(self):
+        """Do one frame - as many updates as time has passed for, then a render.
+           Returns the number of updates done."""
+        now = self.get_time()
+        if self.last_time is None:
+            self.last_time = now
+        self.accumulator += max(now - self.last_time, 0)
+        self.last_time = now
+
+        steps = 0
+        while self.accumulator >= self.step and steps < self.max_steps:
+            self.update(self.step)
+            self.accumulator -= self.step
+            steps += 1
+        if steps == self.max_steps and self.accumulator >= self.step:
+            self.accumulator = self.accumulator % self.step
+        self.steps += steps
+
+        self.alpha = self.accumulator / self.step
+        self.render(self.alpha)
+        self.frames += 1
+        return steps
+
+    def run(self):
+        """Call tick until stop is called."""
+        self.running = True
+        while self.running:
+            self.tick()
+
+    def stop(self):
+        """Stop run after the current frame."""
+        self.running = False
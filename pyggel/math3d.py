@@ -6,6 +6,7 @@ The math3d module contains general 3d math functions, as well as collision detec
 """
 
 import math
+import numpy
 
 def move_with_rotation(pos, rot, amount):
     """Returns a new position that is calculated based on
@@ -343,6 +344,74 @@ class AABox(Vector):
         else:
             return other.collide(self)
 
+class Ray(Vector):
+    """A simple Ray object - same as Vector (the origin of the Ray) except it also has a direction it travels in"""
+    ctype = "Ray"
+    def __init__(self, pos, direction):
+        """Create the Ray
+           pos must be a three part tuple of the origin of the Ray
+           direction must be a three part tuple of the direction the Ray travels in - will be normalized"""
+        Vector.__init__(self, pos)
+        self.direction = Vector(direction).normalize()
+
+    def get_point(self, distance):
+        """Return a Vector of the point distance along the Ray"""
+        d = self.direction
+        return Vector((self.x + d.x*distance,
+                       self.y + d.y*distance,
+                       self.z + d.z*distance))
+
+    def hit_distance(self, other):
+        """Return the distance along the Ray to where it first touches other, or None if it misses
+           returns 0 if the Ray starts inside other
+           other must be a Sphere or AABox"""
+        d = self.direction
+        if other.ctype == "Sphere":
+            r = other.radius * other.scale
+            lx = other.x - self.x
+            ly = other.y - self.y
+            lz = other.z - self.z
+            c = lx*lx + ly*ly + lz*lz - r*r
+            if c <= 0:
+                return 0
+            b = lx*d.x + ly*d.y + lz*d.z
+            if b < 0:
+                return None
+            disc = b*b - c
+            if disc < 0:
+                return None
+            return b - math.sqrt(disc)
+        elif other.ctype == "AABox":
+            near = 0
+            far = None
+            for o, v, c, s in ((self.x, d.x, other.x, other.width * other.scale[0]),
+                               (self.y, d.y, other.y, other.height * other.scale[1]),
+                               (self.z, d.z, other.z, other.depth * other.scale[2])):
+                s = s * 0.5
+                lo = c - s
+                hi = c + s
+                if v == 0:
+                    if o < lo or o > hi:
+                        return None
+                    continue
+                t1 = (lo - o) / v
+                t2 = (hi - o) / v
+                if t1 > t2:
+                    t1, t2 = t2, t1
+                near = max(near, t1)
+                if far is None:
+                    far = t2
+                else:
+                    far = min(far, t2)
+                if near > far:
+                    return None
+            return near
+        return None
+
+    def collide(self, other):
+        """Return whether this Ray touches another Sphere or AABox"""
+        return self.hit_distance(other) is not None
+
 def calcTriNormal(t1, t2, t3, flip=False):
     """Return a normal for lighting based on 3 points.
        Code provided by Ian Mallet."""
@@ -356,3 +425,135 @@ def calcTriNormal(t1, t2, t3, flip=False):
         vy = -vy
         vz = -vz
     return (vx, vy, vz)
+
+def identity_matrix():
+    """Return a 4x4 numpy identity matrix"""
+    return numpy.identity(4, dtype=numpy.float64)
+
+def translate_matrix(x, y, z):
+    """Return a 4x4 numpy matrix that does the same as glTranslatef(x, y, z)"""
+    m = numpy.identity(4, dtype=numpy.float64)
+    m[0:3, 3] = x, y, z
+    return m
+
+def rotate_matrix(angle, x, y, z):
+    """Return a 4x4 numpy matrix that does the same as glRotatef(angle, x, y, z)
+       angle is in degrees, x, y, z is the axis to rotate around"""
+    l = math.sqrt(x*x + y*y + z*z)
+    if not (l and angle):
+        return numpy.identity(4, dtype=numpy.float64)
+    x, y, z = x/l, y/l, z/l
+    r = math.radians(angle)
+    c = math.cos(r)
+    s = math.sin(r)
+    t = 1 - c
+    return numpy.array(((x*x*t + c,   x*y*t - z*s, x*z*t + y*s, 0),
+                        (y*x*t + z*s, y*y*t + c,   y*z*t - x*s, 0),
+                        (z*x*t - y*s, z*y*t + x*s, z*z*t + c,   0),
+                        (0,           0,           0,           1)), dtype=numpy.float64)
+
+def scale_matrix(x, y, z):
+    """Return a 4x4 numpy matrix that does the same as glScalef(x, y, z)"""
+    return numpy.diag((x, y, z, 1.0))
+
+def transform_matrix(pos, rotation, scale):
+    """Return a 4x4 numpy matrix that does the same as glTranslatef(*pos),
+       glRotatef around the x, y and then z axis by rotation, and then glScalef(*scale)
+       pos, rotation and scale must be (x,y,z) tuples - rotation is in degrees"""
+    a, b, c = [math.radians(i) for i in rotation]
+    ca, sa = math.cos(a), math.sin(a)
+    cb, sb = math.cos(b), math.sin(b)
+    cc, sc = math.cos(c), math.sin(c)
+    sx, sy, sz = scale
+    x, y, z = pos
+    #Rx * Ry * Rz, with each column scaled
+    return numpy.array(((cb*cc*sx,              -cb*sc*sy,             sb*sz,     x),
+                        ((sa*sb*cc + ca*sc)*sx, (ca*cc - sa*sb*sc)*sy, -sa*cb*sz, y),
+                        ((sa*sc - ca*sb*cc)*sx, (ca*sb*sc + sa*cc)*sy, ca*cb*sz,  z),
+                        (0,                     0,                     0,         1)), dtype=numpy.float64)
+
+def transform_matrices(pos, rotation, scale):
+    """Return an (n,4,4) numpy array of transform_matrix for every row of pos, rotation and scale
+       pos, rotation and scale must be (n,3) arrays - rotation is in degrees"""
+    pos = numpy.asarray(pos, dtype=numpy.float64)
+    a, b, c = numpy.radians(numpy.asarray(rotation, dtype=numpy.float64)).T
+    sx, sy, sz = numpy.asarray(scale, dtype=numpy.float64).T
+    ca, sa = numpy.cos(a), numpy.sin(a)
+    cb, sb = numpy.cos(b), numpy.sin(b)
+    cc, sc = numpy.cos(c), numpy.sin(c)
+    m = numpy.zeros((len(pos), 4, 4), dtype=numpy.float64)
+    m[:,0,0] = cb*cc*sx
+    m[:,0,1] = -cb*sc*sy
+    m[:,0,2] = sb*sz
+    m[:,1,0] = (sa*sb*cc + ca*sc)*sx
+    m[:,1,1] = (ca*cc - sa*sb*sc)*sy
+    m[:,1,2] = -sa*cb*sz
+    m[:,2,0] = (sa*sc - ca*sb*cc)*sx
+    m[:,2,1] = (ca*sb*sc + sa*cc)*sy
+    m[:,2,2] = ca*cb*sz
+    m[:,0:3,3] = pos
+    m[:,3,3] = 1
+    return m
+
+def transform_geometry(matrix, vertices, normals):
+    """Return the (vertices, normals) float32 numpy arrays moved by 4x4 numpy matrix, like OpenGL would render them
+       vertices and normals must be (n,3) arrays - the normals are renormalized"""
+    m = numpy.asarray(matrix, dtype=numpy.float64)
+    verts = numpy.dot(vertices, m[:3,:3].T) + m[:3,3]
+    try:
+        inv = numpy.linalg.inv(m[:3,:3]).T
+    except numpy.linalg.LinAlgError:
+        inv = m[:3,:3] #flattened by a zero scale, so the normals don't matter
+    norms = numpy.dot(normals, inv.T)
+    length = numpy.sqrt((norms**2).sum(1))
+    norms /= numpy.where(length > 0, length, 1)[:,numpy.newaxis]
+    return verts.astype(numpy.float32), norms.astype(numpy.float32)
+
+def transform_sphere(matrix, sphere):
+    """Return a new Sphere that encloses sphere after it is transformed by 4x4 numpy matrix
+       sphere and the result are in PYGGEL coordinates (where objects at pos (x,y,z) are rendered at (x,y,-z))"""
+    m = numpy.asarray(matrix)
+    x, y, z = numpy.dot(m, (sphere.x, sphere.y, -sphere.z, 1))[:3]
+    scale = math.sqrt(max((m[:3,:3]**2).sum(0)))
+    return Sphere((float(x), float(y), -float(z)), sphere.radius * sphere.scale * scale)
+
+def perspective_matrix(fovy, aspect, near, far):
+    """Return a 4x4 numpy matrix that does the same as gluPerspective(fovy, aspect, near, far)"""
+    f = 1.0 / math.tan(math.radians(fovy) / 2.0)
+    m = numpy.zeros((4, 4), dtype=numpy.float64)
+    m[0, 0] = f / aspect
+    m[1, 1] = f
+    m[2, 2] = (far + near) / (near - far)
+    m[2, 3] = 2.0 * far * near / (near - far)
+    m[3, 2] = -1
+    return m
+
+def unproject(matrix, screen_pos, viewport):
+    """Return a Ray going from the near plane through screen_pos, the same as two gluUnProject calls.
+       matrix must be the 4x4 numpy projection matrix multiplied by the camera (modelview) matrix
+       screen_pos must be the (x,y) GL window coordinates (0,0 is the bottom left)
+       viewport must be the (width, height) of the viewport
+       The Ray is in PYGGEL coordinates (where objects at pos (x,y,z) are rendered at (x,y,-z))"""
+    inv = numpy.linalg.inv(numpy.asarray(matrix, dtype=numpy.float64))
+    x = 2.0 * screen_pos[0] / viewport[0] - 1
+    y = 2.0 * screen_pos[1] / viewport[1] - 1
+    near = numpy.dot(inv, (x, y, -1, 1))
+    far = numpy.dot(inv, (x, y, 1, 1))
+    near = near[:3] / near[3]
+    far = far[:3] / far[3]
+    return Ray((near[0], near[1], -near[2]),
+               (far[0]-near[0], far[1]-near[1], near[2]-far[2]))
+
+def get_frustum(matrix):
+    """Return the six (a,b,c,d) planes of the view frustum, with normals pointing inward, ready for in_frustum.
+       matrix must be the 4x4 numpy projection matrix multiplied by the camera (modelview) matrix.
+       The planes are in PYGGEL coordinates (where objects at pos (x,y,z) are rendered at (x,y,-z))"""
+    m = numpy.asarray(matrix, dtype=numpy.float64)
+    planes = []
+    for row, sign in ((0, 1), (0, -1), (1, 1), (1, -1), (2, 1), (2, -1)): #left, right, bottom, top, near, far
+        p = m[3] + m[row] * sign
+        l = math.sqrt(p[0]**2 + p[1]**2 + p[2]**2)
+        if l:
+            p = p / l
+        planes.append((float(p[0]), float(p[1]), -float(p[2]), float(p[3])))
+    return planes
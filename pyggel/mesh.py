@@ -7,43 +7,101 @@ The mesh module contains mesh classes for different kinds of meshes, as well as
 
 from include import *
 import os
-import image, view, data, misc, math3d
+import image, view, data, misc, math3d, scenefile
 from scene import BaseSceneObject
-import time
+from loop import get_time
 import random
 import math
+import zlib
 
-def OBJ(filename, pos=(0,0,0), rotation=(0,0,0), colorize=(1,1,1,1)):
+CACHE_VERSION = 2 #changes whenever what the cache files hold does, so old ones are parsed again
+cache_dir = None #the directory OBJ caches are written to, or None to write them next to each OBJ file
+vertex_buffers = True #whether groups render from a data.VertexBuffer where OpenGL supports them, instead of a display list
+CACHE_SIZE = 32 #vertices in the post transform vertex cache get_acmr simulates and optimize_triangles orders for
+
+#weights of the vertex scores optimize_triangles picks triangles by, from Tom Forsyth's
+#"Linear-Speed Vertex Cache Optimisation"
+CACHE_DECAY_POWER = 1.5
+LAST_TRIANGLE_SCORE = 0.75
+VALENCE_BOOST_SCALE = 2.0
+VALENCE_BOOST_POWER = 0.5
+
+def OBJ(filename, pos=(0,0,0), rotation=(0,0,0), colorize=(1,1,1,1), cache=True, optimize=False):
     """Load a WaveFront OBJ mesh.
        filename must be the filename of the mesh to load
-       pos/rotation/colorize are the starting attributes of the mesh object."""
+       pos/rotation/colorize are the starting attributes of the mesh object
+       cache is whether to keep the loaded mesh in a binary file (see get_cache_filename),
+           which is loaded instead until the OBJ or its mtl files change
+       optimize is whether to reorder the mesh for the vertex cache (see optimize_group) when the OBJ is parsed -
+           a loaded cache is used as it was written, see optimize_obj"""
     view.require_init()
 
+    objs = None
+    if cache:
+        objs = load_cache(filename)
+    if objs is None:
+        objs, sources = _parse_obj(filename)
+        if optimize:
+            for i in objs:
+                optimize_group(i)
+        if cache:
+            save_cache(filename, objs, sources)
+
+    return BasicMesh(objs, pos, rotation, 1, colorize)
+
+def optimize_obj(filename, cache_size=CACHE_SIZE):
+    """Parse the OBJ filename, reorder every group for the vertex cache (see optimize_group) and write its cache,
+       so OBJ loads the optimized mesh from then on (until the OBJ or its mtl files change) -
+       meant to be run over a game's models once, ahead of time.
+       Returns the (before, after) VertexStats of the mesh."""
+    view.require_init()
+    objs, sources = _parse_obj(filename)
+    mesh = BasicMesh(objs)
+    before, after = optimize_mesh(mesh, cache_size)
+    save_cache(filename, objs, sources)
+    return before, after
+
+def _parse_obj(filename):
+    """Parse the OBJ filename, and return a list of its CompiledGroups and a list of the files read (the OBJ and mtl's)."""
+    sources = [filename]
     objs = []
     mtls = {}
 
+    #the text after the keyword of every v, vn and vt line, parsed all at once afterwards
     vertices = []
     normals = []
     texcoords = []
 
     for line in open(filename, "r"):
-        if line.startswith('#'): continue
-        values = line.split()
-        if not values: continue
-        if values[0] in ("o", "g"):
+        key, rest = line[:2], line[2:]
+        if not key in ("v ", "vn", "vt", "f "):
+            if line.startswith('#'): continue
+            values = line.split()
+            if not values: continue
+            key, rest = values[0], " ".join(values[1:])
+        if key in ("v ", "v"):
+            vertices.append(rest)
+        elif key in ("f ", "f"):
+            if "-" in rest: #relative indices, make them absolute while we know how many came before
+                rest = _absolute_face(rest, len(vertices), len(texcoords), len(normals))
+            if not objs:
+                objs.append(ObjGroup("default"))
+            objs[-1].faces.append(rest)
+        elif key == "vn":
+            normals.append(rest)
+        elif key == "vt":
+            texcoords.append(rest)
+        elif key in ("o", "g"):
             objs.append(ObjGroup(values[1]))
-        elif values[0] == 'v':
-            vertices.append(map(float, values[1:4]))
-        elif values[0] == 'vn':
-            normals.append(map(float, values[1:4]))
-        elif values[0] == 'vt':
-            texcoords.append(map(float, values[1:3]))
-        elif values[0] in ('usemtl', 'usemat'):
+        elif key in ('usemtl', 'usemat'):
+            if not objs:
+                objs.append(ObjGroup("default"))
             objs[-1].material = mtls[values[1]]
-        elif values[0] == 'mtllib':
+        elif key == 'mtllib':
             path = os.path.split(filename)[0]
             cur_mtl = None
-            for line in open(os.path.join(path, values[1]), "r"):
+            sources.append(os.path.join(path, values[1]))
+            for line in open(sources[-1], "r"):
                 if line.startswith('#'): continue
                 values = line.split()
                 if not values: continue
@@ -56,131 +114,467 @@ def OBJ(filename, pos=(0,0,0), rotation=(0,0,0), colorize=(1,1,1,1)):
                     cur_mtl.texture = data.Texture(os.path.join(path, values[1]))
                 elif values[0]=="Kd":
                     cur_mtl.set_color(map(float, values[1:]))
-        elif values[0] == 'f':
-            face = []
-            texcoords = []
-            norms = []
-            for v in values[1:]:
-                w = v.split('/')
-                face.append(int(w[0]))
-                if len(w) >= 2 and len(w[1]) > 0:
-                    texcoords.append(int(w[1]))
-                else:
-                    texcoords.append(0)
-                if len(w) >= 3 and len(w[2]) > 0:
-                    norms.append(int(w[2]))
-                else:
-                    norms.append(0)
-            objs[-1].faces.append((face, norms, texcoords))
+
+    vertices = _parse_floats(vertices, 3)
+    normals = _parse_floats(normals, 3)
+    texcoords = _parse_floats(texcoords, 2)
 
     fin = []
     for i in objs:
         fin.append(i.compile(vertices, normals, texcoords))
 
-    return BasicMesh(fin, pos, rotation, 1, colorize)
- 
+    return fin, sources
+
+def get_cache_filename(filename):
+    """Return the filename the cache of the OBJ filename is kept in -
+       next to it, or in cache_dir (named after the full path of the OBJ, so ones with the same name don't clash)."""
+    if cache_dir is None:
+        return os.path.splitext(filename)[0] + ".objcache"
+    name = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(cache_dir, "%s-%08x.objcache" % (name, zlib.crc32(os.path.abspath(filename)) & 0xffffffff))
+
+def _get_source_stats(sources):
+    """Return a list of the (filename, mtime, size) of each file in sources."""
+    stats = []
+    for i in sources:
+        st = os.stat(i)
+        stats.append((i, st.st_mtime, st.st_size))
+    return stats
+
+def _string_array(strings):
+    """Return a numpy string array wide enough for every string in strings."""
+    return numpy.array(strings, dtype="S%d" % max([1] + [len(i) for i in strings]))
+
+def save_cache(filename, objs, sources):
+    """Write the CompiledGroups objs, loaded from the OBJ filename, to its cache file (see get_cache_filename).
+       sources are the files they were loaded from (the OBJ and mtl's) - the cache is only used while none change.
+       Returns whether the cache could be written."""
+    materials = []
+    groups = []
+    arrays = []
+    index_arrays = []
+    start = 0
+    index_start = 0
+    for obj in objs:
+        if not obj.material in materials:
+            materials.append(obj.material)
+        verts, norms, texcs = obj.triangles
+        arrays.append(_interleave(verts, norms, texcs))
+        indices = obj.indices
+        if indices is None:
+            indices = numpy.arange(len(verts))
+        index_arrays.append(indices)
+        groups.append((obj.name, materials.index(obj.material), obj.dimensions, obj.base_pos,
+                       start, len(verts), index_start, len(indices)))
+        start += len(verts)
+        index_start += len(indices)
+
+    names = _string_array([i.name for i in materials])
+    textures = []
+    for i in materials:
+        if isinstance(i.texture, data.BlankTexture):
+            textures.append("")
+        else:
+            textures.append(i.texture.filename)
+    textures = _string_array(textures)
+    colors = numpy.array([tuple(i.color) for i in materials], dtype=numpy.float64).reshape((-1, 4))
+
+    try:
+        stats = _get_source_stats(sources)
+        source_names = _string_array([i[0] for i in stats])
+        stats = numpy.array([i[1:] for i in stats], dtype=numpy.float64)
+
+        group_names = _string_array([i[0] for i in groups])
+        groups = numpy.array([(i[1],) + tuple(i[2]) + tuple(i[3]) + i[4:] for i in groups],
+                             dtype=numpy.float64).reshape((-1, 14))
+        if arrays:
+            vertices = numpy.concatenate(arrays)
+            indices = numpy.concatenate(index_arrays).astype(numpy.uint32)
+        else:
+            vertices = numpy.zeros((0, 8), dtype=numpy.float32)
+            indices = numpy.zeros(0, dtype=numpy.uint32)
+        scenefile.write_file(get_cache_filename(filename), "PYGGEL-OBJ", CACHE_VERSION,
+                             (source_names, stats, names, colors, textures, group_names, groups,
+                              indices, vertices))
+    except (IOError, OSError):
+        return False
+    return True
+
+def load_cache(filename, mmap=True):
+    """Return the list of CompiledGroups in the cache of the OBJ filename,
+       or None if there isn't one, or the OBJ or its mtl files changed since it was written.
+       mmap is whether to memory map the vertices from the cache instead of reading them into memory"""
+    try:
+        (source_names, stats, names, colors, textures,
+         group_names, groups, indices, vertices) = scenefile.read_file(get_cache_filename(filename),
+                                                                        "PYGGEL-OBJ", CACHE_VERSION, 9, mmap)
+        if not _get_source_stats(source_names.tolist()) == zip(source_names.tolist(), *stats.T.tolist()):
+            return None
+    except (IOError, OSError, ValueError):
+        return None
+
+    materials = []
+    for name, color, texture in zip(names.tolist(), colors.tolist(), textures.tolist()):
+        material = data.Material(name)
+        material.color = tuple(color)
+        if texture:
+            material.texture = data.Texture(texture)
+        materials.append(material)
+
+    objs = []
+    for name, row in zip(group_names.tolist(), groups.tolist()):
+        material, dimensions, pos = row[0], row[1:7], row[7:10]
+        start, count, index_start, index_count = map(int, row[10:14])
+        array = vertices[start:start+count]
+        index = _index_array(indices[index_start:index_start+index_count], count)
+        objs.append(CompiledGroup(name, materials[int(material)], _compile_array(array, index),
+                                  tuple(dimensions), tuple(pos),
+                                  (array[:,5:8], array[:,2:5], array[:,0:2]), index))
+    return objs
+
+def _interleave(vertices, normals, texcoords):
+    """Return the (n,8) float32 numpy array of interleaved GL_T2F_N3F_V3F vertices _compile_array draws."""
+    array = numpy.empty((len(vertices), 8), dtype=numpy.float32)
+    array[:,0:2] = texcoords
+    array[:,2:5] = normals
+    array[:,5:8] = vertices
+    return array
+
+def _index_array(indices, count):
+    """Return indices as a 16 bit numpy array if count vertices can be indexed with 16 bits, otherwise as 32 bit."""
+    if count <= 65536:
+        return numpy.asarray(indices, dtype=numpy.uint16)
+    return numpy.asarray(indices, dtype=numpy.uint32)
+
+def _weld(array):
+    """Return the unique rows of the vertex array (from _interleave), in the order they are first used,
+       and the index array of which unique row each row of array is (see _index_array)."""
+    array = numpy.ascontiguousarray(array + numpy.float32(0)) #so -0.0 and 0.0 weld together
+    if not len(array):
+        return array, _index_array([], 0)
+    rows = array.view(numpy.dtype((numpy.void, array.dtype.itemsize * array.shape[1]))).ravel()
+    unused, first, inverse = numpy.unique(rows, return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    new = numpy.empty(len(order), dtype=numpy.int64)
+    new[order] = numpy.arange(len(order))
+    return array[first[order]], _index_array(new[inverse], len(order))
+
+def _count_misses(indices, cache_size):
+    """Return how many of indices miss a first in first out cache of cache_size vertices."""
+    added = {} #vertex: misses when it was put in the cache
+    misses = 0
+    for i in numpy.asarray(indices).tolist():
+        if i in added and misses - added[i] < cache_size:
+            continue
+        added[i] = misses
+        misses += 1
+    return misses
+
+def get_acmr(indices, cache_size=CACHE_SIZE):
+    """Return the average cache miss ratio of drawing the triangles in indices -
+       the vertices the video card has to transform per triangle, with a first in first out cache of cache_size vertices.
+       3.0 is the worst (no vertex reused), about 0.5 is the best a large mesh can do."""
+    return math3d.safe_div(_count_misses(indices, cache_size) * 3.0, len(indices))
+
+def optimize_triangles(indices, cache_size=CACHE_SIZE):
+    """Return a copy of indices with its triangles reordered so the vertices they use are still in the vertex cache,
+       with Tom Forsyth's linear speed vertex cache optimisation - each triangle drawn is the one
+       with the best scoring vertices, which are ones recently used and ones with few triangles left to draw.
+       This runs in python, so is slow on big meshes (seconds) - see optimize_obj to only do it once."""
+    indices = numpy.asarray(indices)
+    tris = indices.reshape((-1, 3)).tolist()
+    if not tris:
+        return indices.copy()
+
+    num_verts = int(indices.max()) + 1
+    vert_tris = [[] for i in xrange(num_verts)] #vertex: triangles using it that aren't drawn yet
+    for t in xrange(len(tris)):
+        for v in tris[t]:
+            vert_tris[v].append(t)
+
+    cache_scores = [LAST_TRIANGLE_SCORE] * 3 #the last triangle drawn's vertices
+    for i in xrange(3, cache_size):
+        cache_scores.append((1.0 - (i - 3) / float(cache_size - 3)) ** CACHE_DECAY_POWER)
+    cache_scores.append(0.0) #not in the cache
+    valence_scores = [0.0]
+    for i in xrange(1, max([len(i) for i in vert_tris]) + 1):
+        valence_scores.append(VALENCE_BOOST_SCALE * i ** -VALENCE_BOOST_POWER)
+
+    vert_scores = [valence_scores[len(i)] for i in vert_tris]
+    tri_scores = [vert_scores[a] + vert_scores[b] + vert_scores[c] for a, b, c in tris]
+    drawn = [False] * len(tris)
+    cache = []
+    new = []
+    best = tri_scores.index(max(tri_scores))
+    first_left = 0 #no triangle before this is left to draw
+    for n in xrange(len(tris)):
+        if best < 0: #nothing left touching the cache, start again from the first triangle left
+            while drawn[first_left]:
+                first_left += 1
+            best = first_left
+        tri = tris[best]
+        drawn[best] = True
+        new.extend(tri)
+        for v in tri:
+            vert_tris[v].remove(best)
+
+        front = []
+        for v in tri:
+            if not v in front:
+                front.append(v)
+        cache = front + [v for v in cache if not v in front]
+        for v in cache[cache_size:]:
+            vert_scores[v] = valence_scores[len(vert_tris[v])]
+        for i in xrange(min(len(cache), cache_size)):
+            v = cache[i]
+            if vert_tris[v]:
+                vert_scores[v] = cache_scores[i] + valence_scores[len(vert_tris[v])]
+
+        best = -1
+        best_score = -1.0
+        for v in cache:
+            for t in vert_tris[v]:
+                a, b, c = tris[t]
+                score = vert_scores[a] + vert_scores[b] + vert_scores[c]
+                tri_scores[t] = score
+                if score > best_score:
+                    best = t
+                    best_score = score
+        del cache[cache_size:]
+
+    return numpy.array(new, dtype=indices.dtype)
+
+def _reorder_vertices(array, indices):
+    """Return the rows of the vertex array that indices uses, in the order they are first used (so vertices are
+       fetched from memory in order), and indices changed to match (see _index_array)."""
+    if not len(indices):
+        return array[:0], _index_array([], 0)
+    used, first = numpy.unique(indices, return_index=True)
+    order = used[numpy.argsort(first)]
+    new = numpy.zeros(len(array), dtype=numpy.int64)
+    new[order] = numpy.arange(len(order))
+    return array[order], _index_array(new[indices], len(order))
+
+def optimize_group(group, cache_size=CACHE_SIZE):
+    """Reorder the triangles of the CompiledGroup group for the vertex cache (see optimize_triangles),
+       then its vertices in the order the triangles use them, and rebuild its display list (or vertex buffer).
+       The vertices are welded into an index array first if group doesn't have one.
+       Does nothing if the group has no triangles arrays."""
+    if group.triangles is None:
+        return None
+    array = _interleave(*group.triangles)
+    indices = group.indices
+    if indices is None:
+        array, indices = _weld(array)
+    array, indices = _reorder_vertices(array, optimize_triangles(indices, cache_size))
+    group.display_list = _compile_array(array, indices)
+    group.triangles = (array[:,5:8], array[:,2:5], array[:,0:2])
+    group.indices = indices
+
+def optimize_mesh(mesh, cache_size=CACHE_SIZE):
+    """Reorder every group of the BasicMesh mesh for the vertex cache (see optimize_group),
+       and return the (before, after) VertexStats of the mesh - None if it has groups without triangles arrays."""
+    before = mesh.get_vertex_stats(cache_size)
+    for i in mesh.objs:
+        optimize_group(i, cache_size)
+    return before, mesh.get_vertex_stats(cache_size)
+
+def _compile_array(array, indices=None):
+    """Return a data.VertexBuffer (or data.DisplayList if vertex_buffers is False or they aren't available)
+       that draws the triangles in an array from _interleave - every 3 rows, or every 3 of indices if it isn't None."""
+    if vertex_buffers and data.vbo_available():
+        return data.VertexBuffer(array, GL_T2F_N3F_V3F, indices)
+
+    dlist = data.DisplayList()
+    dlist.begin()
+    if len(array):
+        glInterleavedArrays(GL_T2F_N3F_V3F, 0, array)
+        if indices is None:
+            glDrawArrays(GL_TRIANGLES, 0, len(array))
+        else:
+            glDrawElements(GL_TRIANGLES, len(indices), GL_UNSIGNED_INT, numpy.asarray(indices, dtype=numpy.uint32))
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+    dlist.end()
+    return dlist
+
+def _parse_floats(lines, width):
+    """Return an (n,width) numpy array of the first width numbers on each of lines."""
+    if not lines:
+        return numpy.zeros((0, width))
+    flat = numpy.fromstring(" ".join(lines), dtype=numpy.float64, sep=" ")
+    if len(flat) == len(lines) * width:
+        return flat.reshape((-1, width))
+    #some lines have more (or less) numbers, like vt's with a w
+    return numpy.array([(i.split() + ["0"]*width)[:width] for i in lines], dtype=numpy.float64)
+
+def _absolute_face(face, num_v, num_t, num_n):
+    """Return the corners of an OBJ face with negative (relative) indices made absolute
+       num_v/num_t/num_n are the number of vertices, texcoords and normals before the face"""
+    corners = []
+    for corner in face.split():
+        w = corner.split('/')
+        for i, num in zip(xrange(len(w)), (num_v, num_t, num_n)):
+            if w[i].startswith("-"):
+                w[i] = str(num + 1 + int(w[i]))
+        corners.append("/".join(w))
+    return " ".join(corners)
+
+def _parse_faces(faces):
+    """Return an (n,3) int numpy array of the (vertex, texcoord, normal) indices of every corner of faces
+       (0 where one is missing), and an array of the number of corners of each face
+       faces must be a list of the text after the f of each face line"""
+    sizes = numpy.array([len(i.split()) for i in faces], dtype=numpy.int32)
+    corners = numpy.zeros((sizes.sum(), 3), dtype=numpy.int32)
+    if not len(corners):
+        return corners, sizes
+    text = " ".join(faces)
+    first = faces[0].split()[0]
+    if "//" in first:
+        columns = (0, 2)
+        text = text.replace("//", " ")
+    else:
+        columns = (0, 1, 2)[:first.count("/")+1]
+        text = text.replace("/", " ")
+    flat = numpy.fromstring(text, dtype=numpy.int32, sep=" ")
+    if len(flat) == len(corners) * len(columns):
+        corners[:,columns] = flat.reshape((-1, len(columns)))
+    else:
+        #the corners aren't all written the same way, so do them one at a time
+        for i, corner in enumerate(" ".join(faces).split()):
+            w = corner.split('/')
+            for j in xrange(min(len(w), 3)):
+                if w[j]:
+                    corners[i,j] = int(w[j])
+    return corners, sizes
+
 class ObjGroup(object):
     """Class to keep track of an objects verts and such while being loaded."""
     def __init__(self, name):
         """name is the name of the object."""
         self.name = name
-        self.faces = []
+        self.faces = [] #the text after the f of each face line
         self.material = None
 
         self.dlist = None
 
     def compile(self, vertices, normals, texcoords):
         """Compile the ObjGroup into a CompiledGroup for rendering/using.
-           vertices/normals/texcoords are a list of all attributes in the mesh file, fo reference"""
-        faces = []
-        for face in self.faces:
-            v,n,t = face
-            uv, un, ut = [], [], []
-            for i in xrange(len(v)):
-                if n[i] > 0:
-                    un.append(normals[n[i]-1])
-                else:
-                    un.append(None)
-
-                if t[i] > 0:
-                    ut.append(texcoords[t[i]-1])
-                else:
-                    ut.append(None)
-                uv.append(vertices[v[i]-1])
-            faces.append((uv, un, ut))
-
-        final = []
-        for face in faces:
-            v,n,t = face
-            nv = []
-            for i in v:
-                a,b,c = i
-                nv.append((a,b,c))
-            final.append((nv,n,t))
-
-        #now build our display list!
-        dlist = data.DisplayList()
-        dlist.begin()
+           vertices/normals/texcoords are numpy arrays of all attributes in the mesh file, for reference"""
+        corners, sizes = _parse_faces(self.faces)
+
+        used = vertices[corners[:,0]-1] if len(corners) else numpy.zeros((0, 3))
+        if len(used):
+            avgx, avgy, avgz = used.mean(0)
+            minx, miny, minz = numpy.minimum(used.min(0), 0)
+            maxx, maxy, maxz = numpy.maximum(used.max(0), 0)
+        else:
+            avgx = avgy = avgz = 0
+            minx = miny = minz = maxx = maxy = maxz = 0
 
-        minx = miny = minz = 0
-        maxx = maxy = maxz = 0
+        verts, norms, texcs = self._get_triangles(corners, sizes, vertices, normals, texcoords,
+                                                  (avgx, avgy, avgz))
 
-        avgx, avgy, avgz = 0,0,0
-        num = 0
-
-        for face in final:
-            v = face[0]
-            for i in xrange(len(v)):
-                num += 1
-                x, y, z = v[i]
-                avgx += x
-                avgy += y
-                avgz += z
-
-        avgx = math3d.safe_div(float(avgx), num)
-        avgy = math3d.safe_div(float(avgy), num)
-        avgz = math3d.safe_div(float(avgz), num)
-
-        for face in final:
-            v, n, t = face
-            glBegin(GL_POLYGON)
-            for i in xrange(len(v)):
-                if n[i]:
-                    glNormal3fv(n[i])
-                if t[i]:
-                    glTexCoord2fv(t[i])
-                x, y, z = v[i]
-                glVertex3f(x-avgx, y-avgy, z-avgz)
-                minx = min((minx, x))
-                maxx = max((maxx, x))
-                miny = min((miny, y))
-                maxy = max((maxy, y))
-                minz = min((minz, z))
-                maxz = max((maxz, z))
-            glEnd()
-
-        dlist.end()
+        #weld the corners that are the same vertex, and build our display list (or vertex buffer)!
+        array, indices = _weld(_interleave(verts, norms, texcs))
+        dlist = _compile_array(array, indices)
 
         if self.material == None:
             self.material = data.Material("null")
 
-        return CompiledGroup(self.name, self.material, dlist, (minx,miny,minz, maxx, maxy, maxz),
-                             (avgx, avgy, avgz))
+        return CompiledGroup(self.name, self.material, dlist,
+                             tuple(map(float, (minx,miny,minz, maxx, maxy, maxz))),
+                             tuple(map(float, (avgx, avgy, avgz))),
+                             (array[:,5:8], array[:,2:5], array[:,0:2]), indices)
+
+    def _get_triangles(self, corners, sizes, vertices, normals, texcoords, center):
+        """Return the (vertices, normals, texcoords) float32 numpy arrays of the faces split into triangles (fans),
+           with the vertices moved by -center - missing normals are filled in from the triangle
+           corners and sizes are what _parse_faces returns"""
+        counts = numpy.maximum(sizes - 2, 0)
+        starts = numpy.cumsum(sizes) - sizes #first corner of each face
+        first = numpy.cumsum(counts) - counts #first triangle of each face
+        face = numpy.repeat(numpy.arange(len(sizes)), counts)
+        j = numpy.arange(counts.sum()) - first[face] #which triangle of its face each triangle is
+        tris = numpy.empty((len(face), 3), dtype=numpy.int32)
+        tris[:,0] = starts[face]
+        tris[:,1] = tris[:,0] + j + 1
+        tris[:,2] = tris[:,0] + j + 2
+        tris = corners[tris.ravel()]
+
+        verts = numpy.zeros((len(tris), 3), dtype=numpy.float32)
+        norms = numpy.zeros((len(tris), 3), dtype=numpy.float32)
+        texcs = numpy.zeros((len(tris), 2), dtype=numpy.float32)
+        if not len(tris):
+            return verts, norms, texcs
+        verts[:] = vertices[tris[:,0]-1]
+
+        has = tris[:,1] > 0
+        texcs[has] = texcoords[tris[has,1]-1]
+
+        has = tris[:,2] > 0
+        norms[has] = normals[tris[has,2]-1]
+        if not has.all():
+            v = verts.reshape((-1, 3, 3))
+            flat = numpy.cross(v[:,1] - v[:,0], v[:,2] - v[:,0])
+            flat = numpy.repeat(flat, 3, 0)
+            norms[~has] = flat[~has]
+
+        verts -= center
+        return verts, norms, texcs
+
+class VertexStats(object):
+    """How much memory the vertices of a mesh (or CompiledGroup) use, and how well its triangles use the vertex cache."""
+    def __init__(self):
+        """Create the stats, with nothing counted."""
+        self.triangles = 0
+        self.vertices = 0 #unique vertices, after welding
+        self.vertex_bytes = 0 #vertices and indices
+        self.unwelded_bytes = 0 #what the vertices would take with every triangle corner stored on its own
+        self.misses = 0 #vertices transformed, with the cache get_acmr simulates
+
+    def add(self, other):
+        """Add the counts of the VertexStats other to these."""
+        self.triangles += other.triangles
+        self.vertices += other.vertices
+        self.vertex_bytes += other.vertex_bytes
+        self.unwelded_bytes += other.unwelded_bytes
+        self.misses += other.misses
+
+    def get_acmr(self):
+        """Return the average vertices transformed per triangle - see get_acmr."""
+        return math3d.safe_div(float(self.misses), self.triangles)
+
+    def get_atvr(self):
+        """Return the average times each vertex is transformed - 1.0 is the best possible."""
+        return math3d.safe_div(float(self.misses), self.vertices)
+
+    def __str__(self):
+        """Return a short summary of the stats."""
+        return "triangles: %s vertices: %s memory: %s bytes (%.1fx less) acmr: %.3f atvr: %.3f"%(
+            self.triangles, self.vertices, self.vertex_bytes,
+            math3d.safe_div(float(self.unwelded_bytes), self.vertex_bytes),
+            self.get_acmr(), self.get_atvr())
 
 class CompiledGroup(BaseSceneObject):
     """The core object in a mesh, each mesh object (head, torso, w/e) has one of these.
        It has it's own attributes for pos/rotation/etc. and also is affected by the parent mesh's."""
-    def __init__(self, name, material, dlist, dimensions, pos):
+    def __init__(self, name, material, dlist, dimensions, pos, triangles=None, indices=None):
         """Create the Group
            name is the name of the object
            material is the data.Material object the group uses
-           dlist is the display list of the object
-           dimensions/pos are the size/center of the vertices in the object."""
+           dlist is the data.DisplayList or data.VertexBuffer that draws the object
+           dimensions/pos are the size/center of the vertices in the object
+           triangles is None or the (vertices, normals, texcoords) numpy arrays of the vertices in dlist
+           indices is None if every 3 vertices are a triangle, otherwise the numpy array of the vertex index of each triangle corner"""
         BaseSceneObject.__init__(self)
         self.name = name
         self.material = material
         self.display_list = dlist
         self.dimensions = dimensions
+        self.triangles = triangles
+        self.indices = indices
 
         self.base_pos = pos
         self.pos = pos
@@ -190,6 +584,12 @@ class CompiledGroup(BaseSceneObject):
         d = self.dimensions
         return abs(d[0]-d[3]), abs(d[1]-d[4]), abs(d[2]-d[5])
 
+    def _get_transform(self):
+        """Return the (pos, rotation, scale) tuples get_matrix is built from - group pos is already in mesh (OpenGL) coords."""
+        x, y, z = self.pos
+        a, b, c = self.rotation
+        return (x, y, z), (a, b, c), self.get_scale()
+
     def side(self, name):
         if type(name) is type(""):
             names = ["left", "top", "front",
@@ -202,25 +602,46 @@ class CompiledGroup(BaseSceneObject):
         elif type(name) is type(1):
             return self.dimensions[name]
 
+    def get_geometry(self):
+        if self.triangles is None:
+            return None
+        verts, norms, texcs = self.triangles
+        if self.indices is not None:
+            verts = verts[self.indices]
+            norms = norms[self.indices]
+            texcs = texcs[self.indices]
+        return [(self.material.texture, self.material.color, verts, norms, texcs)]
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
+
+    def get_vertex_stats(self, cache_size=CACHE_SIZE):
+        """Return the VertexStats of the group - or None if it has no triangles arrays.
+           cache_size is the vertices in the cache the misses are counted with"""
+        if self.triangles is None:
+            return None
+        stats = VertexStats()
+        verts = self.triangles[0]
+        row = 32 #bytes of each GL_T2F_N3F_V3F vertex
+        if self.indices is None:
+            stats.triangles = len(verts) // 3
+            stats.vertex_bytes = stats.unwelded_bytes = len(verts) * row
+            stats.vertices = stats.misses = len(verts)
+        else:
+            stats.triangles = len(self.indices) // 3
+            stats.vertices = len(verts)
+            stats.vertex_bytes = len(verts) * row + self.indices.nbytes
+            stats.unwelded_bytes = len(self.indices) * row
+            stats.misses = _count_misses(self.indices, cache_size)
+        return stats
+
     def render(self, camera=None):
         """Render the object.
            camera must be None of the camera object the scene is using to render."""
         glPushMatrix()
-
-        x,y,z = self.pos
-        glTranslatef(x,y,z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-
-        try:
-            glScalef(*self.scale)
-        except:
-            glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
 
         if self.outline:
-            misc.outline(self.dlist, self.outline_color, self.outline_size)
+            misc.outline(self.display_list, self.outline_color, self.outline_size)
         glColor4f(*self.material.color)
         self.material.texture.bind()
         self.display_list.render()
@@ -232,7 +653,9 @@ class CompiledGroup(BaseSceneObject):
                              self.material.copy(),
                              self.display_list,
                              self.dimensions,
-                            self.base_pos)
+                            self.base_pos,
+                            self.triangles,
+                            self.indices)
         new.pos = self.pos
         new.rotation = self.rotation
         new.scale = self.scale
@@ -268,13 +691,38 @@ class BasicMesh(BaseSceneObject):
             d = i.dimensions
             minx = min(minx, d[0])
             maxx = max(maxx, d[3])
-            miny = min(minx, d[1])
-            maxy = max(maxx, d[4])
-            minz = min(minx, d[2])
-            maxz = max(maxx, d[5])
+            miny = min(miny, d[1])
+            maxy = max(maxy, d[4])
+            minz = min(minz, d[2])
+            maxz = max(maxz, d[5])
 
         return abs(minx-maxx), abs(miny-maxy), abs(minz-maxz)
 
+    def get_extents(self):
+        """Return the furthest x, y and z distances any vertex of the mesh is from the mesh origin."""
+        x = y = z = 0
+        for i in self.objs:
+            d = i.dimensions
+            x = max(x, abs(d[0]), abs(d[3]))
+            y = max(y, abs(d[1]), abs(d[4]))
+            z = max(z, abs(d[2]), abs(d[5]))
+        return x, y, z
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere that fully encloses the mesh - used by the octree and picking.
+           The mesh vertices are not centered on pos, so this uses the furthest extents from it."""
+        x, y, z = self.get_extents()
+        sx, sy, sz = self.get_scale()
+        return math3d.Sphere(self.get_pos(), math.sqrt((x*sx)**2 + (y*sy)**2 + (z*sz)**2))
+
+    def get_bounding_box(self):
+        """Return a math3d.AABox that fully encloses the mesh, or None if the mesh is rotated - used by picking."""
+        if self.rotation[0] or self.rotation[1] or self.rotation[2]:
+            return None
+        x, y, z = self.get_extents()
+        sx, sy, sz = self.get_scale()
+        return math3d.AABox(self.get_pos(), (x*abs(sx)*2, y*abs(sy)*2, z*abs(sz)*2))
+
     def copy(self):
         """Return a copy of the mesh, sharing the same data.DisplayList"""
         new_objs = []
@@ -283,6 +731,32 @@ class BasicMesh(BaseSceneObject):
         new = BasicMesh(new_objs, self.pos, self.rotation, self.scale, self.colorize)
         return new
 
+    def get_geometry(self):
+        geometry = []
+        r2,g2,b2,a2 = self.colorize
+        for i in self.objs:
+            parts = i.get_geometry()
+            if parts is None:
+                return None
+            matrix = i.get_matrix()
+            for texture, color, verts, norms, texcs in parts:
+                r,g,b = tuple(color)[:3]
+                verts, norms = math3d.transform_geometry(matrix, verts, norms)
+                geometry.append((texture, (r*r2, g*g2, b*b2, a2), verts, norms, texcs))
+        return geometry
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
+
+    def get_vertex_stats(self, cache_size=CACHE_SIZE):
+        """Return the VertexStats of all the objects in the mesh (added together) - or None if one has no triangles arrays.
+           cache_size is the vertices in the cache the misses are counted with"""
+        stats = VertexStats()
+        for i in self.objs:
+            other = i.get_vertex_stats(cache_size)
+            if other is None:
+                return None
+            stats.add(other)
+        return stats
+
     def get_names(self):
         """Return the names of all the objects in the mesh."""
         return [i.name for i in self.objs]
@@ -298,16 +772,8 @@ class BasicMesh(BaseSceneObject):
         """Render the mesh
            camera must be None of the camera the scene is using"""
         glPushMatrix()
-        x,y,z = self.pos
-        glTranslatef(x,y,-z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        try:
-            glScalef(*self.scale)
-        except:
-            glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
 
         if self.outline:
@@ -378,6 +844,18 @@ class Exploder(BaseSceneObject):
         self.dead = False
         self.down_delta = 0
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing everywhere the pieces can fly to during the explosion."""
+        sphere = self.root_mesh.get_bounding_sphere()
+        #pieces move at most ~5.3 units per frame (times speed), plus the pull of down_delta
+        fd = self.frame_duration
+        sphere.radius += self.speed * fd * 5.3 + self.speed**2 * len(self.root_mesh.objs) * fd**2 / 4.0
+        return sphere
+
+    def get_bounding_box(self):
+        """Return None - the pieces fly in every direction, so only the bounding sphere is used."""
+        return None
+
     def reset(self):
         """Reset he explosion to run again!"""
         self.angles = {}
@@ -641,13 +1119,13 @@ class Action(object):
 
     def start(self):
         """Reset animation."""
-        self.tstamp_start = time.time()
-        self.tstamp_last = time.time()
+        self.tstamp_start = get_time()
+        self.tstamp_last = get_time()
         self.finished_frame = False
 
     def update(self, skeleton):
         """Update timestamps and execute commands relavent."""
-        age = time.time() - self.tstamp_start
+        age = get_time() - self.tstamp_start
         if age >= self.duration:
             age = self.duration
         for i in self.commands:
@@ -709,6 +1187,16 @@ class Animation(BaseSceneObject):
         self.scale = (1,1,1)
         self.colorize=(1,1,1,1)
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere that fully encloses the animated mesh - used by the octree and picking."""
+        x, y, z = self.mesh.get_extents()
+        sx, sy, sz = self.get_scale()
+        return math3d.Sphere(self.get_pos(), math.sqrt((x*sx)**2 + (y*sy)**2 + (z*sz)**2))
+
+    def get_bounding_box(self):
+        """Return None - the animation moves parts of the mesh, so only the bounding sphere is used."""
+        return None
+
     def do(self, action=None, loop=True):
         """Start an animation action
            action is the name of the action in the commands list
@@ -755,16 +1243,8 @@ class Animation(BaseSceneObject):
         self.skeleton.push()
 
         glPushMatrix()
-        x,y,z = self.pos
-        glTranslatef(x,y,-z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        try:
-            glScalef(*self.scale)
-        except:
-            glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
 
         #TODO: add outlining to active models?
@@ -8,7 +8,7 @@ The misc module contains various functions and classes that don't fit anywhere e
 from include import *
 import view, math3d, data
 
-import random
+import random, math
 from scene import BaseSceneObject
 
 class OutlineGroup(object):
@@ -181,17 +181,27 @@ class ObjectInstance(object):
 class StaticObjectGroup(BaseSceneObject):
     """A class that takes a list of renderable objects (that won't ever change position, rotation, etc.
            This includes Image3D's - as they require a dynamic look-up of the camera to billboard correctly)
-       and compiles them into a single data.DisplayList so that rendering is much faster."""
-    def __init__(self, objects=[]):
+       and compiles them into a single data.DisplayList so that rendering is much faster.
+       With merge, the triangles of every object that has them (see BaseSceneObject.get_geometry) are moved into place
+       and merged into one vertex array per texture instead - so the group costs a draw call per texture, not per object."""
+    def __init__(self, objects=[], merge=False):
         """Create the group.
-           objects must be a list of renderable objects"""
+           objects must be a list of renderable objects
+           merge is whether to merge the objects' triangles into one vertex array per texture"""
         BaseSceneObject.__init__(self)
 
         if not hasattr(objects, "__iter__"):
             objects = [objects]
         self.objects = objects
+        self.merge = merge
         self.gl_list = data.DisplayList()
         self.pickable = False
+        self._sphere = math3d.Sphere((0,0,0), 0)
+        self._occluders = []
+
+        self.merged = [] #list of [texture, tiled, array] for render_interleaved
+        self._list_used = False #whether gl_list has anything in it
+        self._list_bound = None #the last texture gl_list binds
 
         self.compile()
 
@@ -199,23 +209,598 @@ class StaticObjectGroup(BaseSceneObject):
         """Add an object to the group - if called then group.compile() must be called afterwards, to recreate the display list"""
         self.objects.append(obj)
 
+    def _get_parts(self, objects):
+        """Return a list of the get_geometry parts of objects, moved into place,
+           and a list of the objects that have none."""
+        parts = []
+        left = []
+        for obj in objects:
+            geometry = obj.get_geometry()
+            if geometry is None:
+                left.append(obj)
+                continue
+            matrix = obj.get_matrix()
+            for texture, color, verts, norms, texcs in geometry:
+                if not len(verts):
+                    continue
+                verts, norms = math3d.transform_geometry(matrix, verts, norms)
+                parts.append((texture, color, verts, norms, texcs))
+        return parts, left
+
+    def _merge(self, objects):
+        """Merge the geometry of objects into self.merged, and return the objects that have none."""
+        textures = {}
+        arrays = {}
+        order = []
+        parts, left = self._get_parts(objects)
+        for texture, color, verts, norms, texcs in parts:
+            #tiled textures are drawn apart, so the rest keep clamped edges
+            key = texture.gl_tex, is_tiled(texcs)
+            if not key in arrays:
+                textures[key] = texture
+                arrays[key] = []
+                order.append(key)
+            arrays[key].append(interleave_geometry(color, verts, norms, texcs))
+
+        self.merged = []
+        for key in order:
+            self.merged.append([textures[key], key[1], numpy.concatenate(arrays[key])])
+        return left
+
     def compile(self):
-        """Compile everything into a data.DisplayList"""
+        """Compile everything into a data.DisplayList, or merge it, if merge is set"""
+        if self.merge:
+            left = self._merge(self.objects)
+        else:
+            self.merged = []
+            left = self.objects
+
+        #textures bound in the list aren't known to data.Texture until it is rendered
+        data.Texture.bound = None
         self.gl_list.begin()
-        for i in self.objects:
+        for i in left:
             i.render()
         self.gl_list.end()
+        self._list_used = bool(left)
+        self._list_bound = data.Texture.bound
+        data.Texture.bound = None
+
+        spheres = [i.get_bounding_sphere() for i in self.objects if hasattr(i, "get_bounding_sphere")]
+        self._sphere = merge_spheres(spheres)
+        self._occluders = [i.get_occluder_box() for i in self.objects if hasattr(i, "get_occluder_box")]
+        self._occluders = [i for i in self._occluders if i]
+        if self._watchers:
+            self._moved()
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing every object in the group."""
+        return math3d.Sphere(self._sphere.get_pos(), self._sphere.radius)
+
+    def get_bounding_box(self):
+        """Return None - the group is picked by its bounding sphere."""
+        return None
+
+    def get_occluders(self):
+        """Return a list of the math3d.AABox of every solid object in the group, for Scene.occlude."""
+        return self._occluders
+
+    def get_geometry(self):
+        parts, left = self._get_parts(self.objects)
+        if left:
+            return None
+        return parts
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
 
     def render(self, camera=None):
         """Render the group.
            camera should be None or the camera the scene is using - only here for compatability"""
-        self.gl_list.render()
-        data.Texture.bound = None
+        render_interleaved(self.merged)
+        if self._list_used:
+            self.gl_list.render()
+            if self._list_bound is not None:
+                #the list leaves the last texture it binds bound, so there's no need to forget which it is
+                data.Texture.bound = self._list_bound
 
     def get_pos(self):
         """Return the position of the mesh"""
         return self.pos
 
+class BakedObject(BaseSceneObject):
+    """An object that renders triangles that were already built - like the objects scenefile.load creates.
+       It can be moved, rotated and scaled like anything else, but its colors are part of the triangles."""
+    def __init__(self, parts, extents=(1,1,1), size=(1,1,1), pos=(0,0,0), rotation=(0,0,0), scale=1, name="BakedObject"):
+        """Create the object
+           parts must be a list of (texture, tiled, array) triangles, like render_interleaved takes
+           extents are the furthest x, y and z distances any vertex is from the center of the object
+           size is how much the vertices are scaled before scale (like a Cube's size) - extents includes it
+           pos/rotation/scale are the attributes of the object
+           name is the name of the type of object that was baked"""
+        BaseSceneObject.__init__(self)
+        self.parts = parts
+        self.extents = extents
+        self.size = size
+        self.pos = pos
+        self.rotation = rotation
+        self.scale = scale
+        self.name = name
+        if parts:
+            self.texture = parts[0][0]
+
+    def get_dimensions(self):
+        """Return the width, height and depth of the object."""
+        x, y, z = self.extents
+        return x*2, y*2, z*2
+
+    def _get_transform(self):
+        """Return the (pos, rotation, scale) tuples get_matrix is built from - scale includes size."""
+        pos, rot, (sx, sy, sz) = BaseSceneObject._get_transform(self)
+        a, b, c = self.size
+        return pos, rot, (sx*a, sy*b, sz*c)
+
+    def get_geometry(self):
+        geometry = []
+        for texture, tiled, array in self.parts:
+            geometry.append((texture, array[:,2:6], array[:,9:12], array[:,6:9], array[:,0:2]))
+        return geometry
+    get_geometry.__doc__ = BaseSceneObject.get_geometry.__doc__
+
+    def render(self, camera=None):
+        """Render the object
+           camera should be None or the camera the scene is using - only here for compatability"""
+        glPushMatrix()
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
+        render_interleaved(self.parts)
+        glPopMatrix()
+
+    def copy(self):
+        """Return a copy of the object - sharing the same triangles."""
+        n = BakedObject(self.parts, self.extents, self.size, self.pos, self.rotation, self.scale, self.name)
+        n.visible = self.visible
+        n.pickable = self.pickable
+        n.occluder = self.occluder
+        return n
+
+class ChunkedStaticGroup(BaseSceneObject):
+    """Like a StaticObjectGroup, except space is split into cubes (chunks), and each chunk is compiled into its own
+       data.DisplayList - so adding, removing or moving an object only recompiles the chunk(s) it was and is in.
+       Objects are watched, so setting their pos or scale moves them to the right chunk by itself."""
+    def __init__(self, objects=[], chunk_size=16):
+        """Create the group.
+           objects must be a list of renderable objects
+           chunk_size is the width of each chunk - objects go in the chunk their pos is in"""
+        BaseSceneObject.__init__(self)
+        self.chunk_size = chunk_size
+        self.pickable = False
+
+        self.chunks = {} #(x,y,z) chunk index: [objects, data.DisplayList or None, dirty]
+        self._where = {} #obj: chunk index
+        self._sphere = None
+        self.num_compiled = 0 #number of chunks compiled the last time any were
+
+        if not hasattr(objects, "__iter__"):
+            objects = [objects]
+        for i in objects:
+            self.add_object(i)
+
+    def _get_key(self, obj):
+        """Return the index of the chunk obj belongs in."""
+        x, y, z = obj.get_pos()
+        s = self.chunk_size
+        return int(math.floor(x / s)), int(math.floor(y / s)), int(math.floor(z / s))
+
+    def _dirty(self, key):
+        """Mark chunk key to be recompiled."""
+        self.chunks[key][2] = True
+        self._sphere = None
+
+    def add_object(self, obj):
+        """Add an object to the group - only its chunk is recompiled, the next time the group renders."""
+        if obj in self._where:
+            return None
+        key = self._get_key(obj)
+        if not key in self.chunks:
+            self.chunks[key] = [[], None, True]
+        self.chunks[key][0].append(obj)
+        self._where[obj] = key
+        self._dirty(key)
+        if hasattr(obj, "add_watcher"):
+            obj.add_watcher(self)
+        if self._watchers:
+            self._moved()
+
+    def remove_object(self, obj):
+        """Remove an object from the group - only its chunk is recompiled."""
+        key = self._where.pop(obj, None)
+        if key is None:
+            return None
+        self.chunks[key][0].remove(obj)
+        self._dirty(key)
+        if hasattr(obj, "remove_watcher"):
+            obj.remove_watcher(self)
+        if self._watchers:
+            self._moved()
+
+    def update_object(self, obj):
+        """Recompile the chunk obj is in (moving it to another chunk if it has left its own)
+           - call this after changing an object any way other than setting pos or scale, ie its rotation or texture."""
+        key = self._where.get(obj)
+        if key is None:
+            return None
+        new = self._get_key(obj)
+        if new == key:
+            self._dirty(key)
+        else:
+            self.chunks[key][0].remove(obj)
+            self._dirty(key)
+            if not new in self.chunks:
+                self.chunks[new] = [[], None, True]
+            self.chunks[new][0].append(obj)
+            self._where[obj] = new
+            self._dirty(new)
+        if self._watchers:
+            self._moved()
+
+    object_moved = update_object
+
+    def compile(self):
+        """Mark every chunk to be recompiled."""
+        for key in self.chunks:
+            self._dirty(key)
+
+    def _compile_dirty(self):
+        """Recompile every chunk that has changed, and drop empty ones."""
+        count = 0
+        for key in list(self.chunks):
+            chunk = self.chunks[key]
+            if not chunk[2]:
+                continue
+            if not chunk[0]:
+                del self.chunks[key]
+                continue
+            if chunk[1] is None:
+                chunk[1] = data.DisplayList()
+            data.Texture.bound = None #so the binds are recorded
+            chunk[1].begin()
+            for i in chunk[0]:
+                i.render()
+            chunk[1].end()
+            chunk[2] = False
+            count += 1
+        if count:
+            data.Texture.bound = None #what compiling left bound isn't bound on the card
+            self.num_compiled = count
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing every object in the group."""
+        if self._sphere is None:
+            self._sphere = merge_spheres([i.get_bounding_sphere() for i in self._where])
+        return math3d.Sphere(self._sphere.get_pos(), self._sphere.radius)
+
+    def get_bounding_box(self):
+        """Return None - the group is picked by its bounding sphere."""
+        return None
+
+    def get_occluders(self):
+        """Return a list of the math3d.AABox of every solid object in the group, for Scene.occlude."""
+        boxes = [i.get_occluder_box() for i in self._where if hasattr(i, "get_occluder_box")]
+        return [i for i in boxes if i]
+
+    def render(self, camera=None):
+        """Recompile any changed chunks, and render the group.
+           camera should be None or the camera the scene is using - only here for compatability"""
+        self._compile_dirty()
+        for i in self.chunks.itervalues():
+            i[1].render()
+        data.Texture.bound = None
+
+class InstancedGroup(BaseSceneObject):
+    """Renders many copies (instances) of one object, each with its own pos, rotation, scale and color.
+       The instances are a numpy structured array (see InstancedGroup.dtype), so they are changed by assigning to it,
+       ie group.instances["pos"][:10] = new_positions - no per-instance python objects are involved.
+       While the instances don't change they are all drawn with a single cached display list call."""
+    dtype = numpy.dtype([("pos", numpy.float32, 3),
+                         ("rotation", numpy.float32, 3),
+                         ("scale", numpy.float32, 3),
+                         ("color", numpy.float32, 4),
+                         ("visible", numpy.bool_)])
+    def __init__(self, source, instances=0, pos=(0,0,0), rotation=(0,0,0), scale=1):
+        """Create the group
+           source is the object to instance - a mesh.BasicMesh or any object with a display_list and texture, like a geometry.Cube
+               each instance is drawn like source, moved/rotated/scaled/colored by the instance
+           instances must be the number of instances to create (at (0,0,0) and white),
+               or an array of InstancedGroup.dtype
+           pos/rotation/scale are the transform of the whole group"""
+        BaseSceneObject.__init__(self)
+        self.pos = pos
+        self.rotation = rotation
+        self.scale = scale
+
+        self.source = source
+        self._parts = self._get_parts(source)
+        sphere = source.get_bounding_sphere()
+        self._radius = sphere.radius + math.sqrt(sphere.x**2 + sphere.y**2 + sphere.z**2) #how far from an instance's pos it reaches
+
+        if type(instances) is type(1):
+            self.instances = self.new_instances(instances)
+        else:
+            self.instances = instances
+
+        self.display_list = data.DisplayList()
+        self._compiled = None #copy of the instances last drawn
+        self._list_ready = False
+        self._sphere = None
+
+    def new_instances(self, count):
+        """Return a new array of count instances, at (0,0,0), not rotated, scale 1 and white."""
+        instances = numpy.zeros(count, dtype=self.dtype)
+        instances["scale"] = 1
+        instances["color"] = 1
+        instances["visible"] = True
+        return instances
+
+    def _get_parts(self, source):
+        """Return a list of (texture, color, matrix, display_list) for every piece of source."""
+        base = source.get_matrix()
+        if hasattr(source, "objs"): #a mesh
+            r2, g2, b2, a2 = source.colorize
+            parts = []
+            for i in source.objs:
+                r, g, b, a = i.material.color
+                parts.append((i.material.texture, (r*r2, g*g2, b*b2, a2),
+                              numpy.dot(base, i.get_matrix()), i.display_list))
+            return parts
+        if getattr(source, "display_list", None):
+            return [(source.texture, getattr(source, "colorize", (1,1,1,1)), base, source.display_list)]
+        raise TypeError("InstancedGroup can only instance meshes, or objects with a display_list")
+
+    def changed(self):
+        """Return whether the instances have changed since they were last drawn."""
+        last = self._compiled
+        return last is None or not len(last) == len(self.instances) or\
+               not numpy.array_equal(last.view(numpy.uint8), self.instances.view(numpy.uint8))
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing every visible instance."""
+        if self._sphere is None or self.changed():
+            inst = self.instances[self.instances["visible"]]
+            if not len(inst):
+                sphere = math3d.Sphere((0,0,0), 0)
+            else:
+                pos = inst["pos"].astype(numpy.float64)
+                radius = numpy.abs(inst["scale"]).max(1) * self._radius
+                low = (pos - radius[:,None]).min(0)
+                high = (pos + radius[:,None]).max(0)
+                center = (low + high) * 0.5
+                r = (numpy.sqrt(((pos - center)**2).sum(1)) + radius).max()
+                sphere = math3d.Sphere(tuple(center), float(r))
+            self._sphere = sphere
+        return math3d.transform_sphere(self.get_matrix(), self._sphere)
+
+    def get_bounding_box(self):
+        """Return None - the group is picked by its bounding sphere."""
+        return None
+
+    def _draw(self):
+        """Draw every visible instance."""
+        inst = self.instances[self.instances["visible"]]
+        if not len(inst):
+            return
+        pos = inst["pos"].astype(numpy.float64)
+        pos[:,2] *= -1
+        matrices = math3d.transform_matrices(pos, inst["rotation"], inst["scale"])
+        for texture, color, matrix, dlist in self._parts:
+            #column major, for glMultMatrixd
+            gl_matrices = numpy.dot(matrices, matrix).transpose((0, 2, 1)).copy()
+            colors = inst["color"] * color
+            texture.bind()
+            for i in xrange(len(inst)):
+                glPushMatrix()
+                glMultMatrixd(gl_matrices[i])
+                glColor4fv(colors[i])
+                dlist.render()
+                glPopMatrix()
+            view.stats.matrix_pushes += len(inst)
+
+    def render(self, camera=None):
+        """Render all instances
+           camera should be None or the camera the scene is using - only here for compatability"""
+        glPushMatrix()
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
+        data.Texture.bound = None #so the binds are recorded
+        if self.changed():
+            #instances are moving, draw directly - they are compiled once they stay put for a frame
+            self._draw()
+            self._compiled = self.instances.copy()
+            self._list_ready = False
+            self._sphere = None
+            if self._watchers:
+                self._moved()
+        elif not self._list_ready:
+            self.display_list.begin()
+            self._draw()
+            self.display_list.end()
+            self._list_ready = True
+            self.display_list.render()
+        else:
+            self.display_list.render()
+        data.Texture.bound = None
+        glPopMatrix()
+
+    def copy(self):
+        """Return a copy of the group, with a copy of the instances."""
+        return InstancedGroup(self.source, self.instances.copy(), self.pos, self.rotation, self.scale)
+
+class LODGroup(BaseSceneObject):
+    """Holds several versions (levels of detail) of one object, most detailed first,
+       and each frame renders the one that suits how far away and how large on screen it is.
+       Levels are positioned relative to the group, like SceneNode children - so they can be shared between copies."""
+    def __init__(self, levels, distances=None, sizes=None, pos=(0,0,0), rotation=(0,0,0), scale=1, hysteresis=0.1):
+        """Create the group
+           levels must be a list of renderable objects, from most to least detailed,
+               ie [geometry.Sphere(1, detail=30), geometry.Sphere(1, detail=15), geometry.Sphere(1, detail=8)]
+           distances is None or a list of camera distances - past distances[i] level i+1 is used
+           sizes is None or a list of screen heights (in pixels), largest first - below sizes[i] level i+1 is used
+               if both are given the less detailed choice wins
+           pos/rotation/scale are the transform of the group, applied to all levels
+           hysteresis is how far (as a fraction of the threshold) the distance or size must pass a threshold
+               to change back from the current level, so objects sitting right on one don't flicker between levels"""
+        BaseSceneObject.__init__(self)
+        self.levels = list(levels)
+        self.distances = distances
+        self.sizes = sizes
+        self.pos = pos
+        self.rotation = rotation
+        self.scale = scale
+        self.hysteresis = hysteresis
+
+        self.level = 0 #the level picked last render
+
+    def _pick(self, value, thresholds, current):
+        """Return the level for value, where value rising past thresholds[i] means level i+1,
+           staying at current while value is within hysteresis of its range"""
+        h = self.hysteresis
+        last = len(self.levels) - 1
+        current = min(current, last)
+        low = high = None
+        if current > 0 and current-1 < len(thresholds):
+            low = thresholds[current-1] * (1 - h)
+        if current < len(thresholds):
+            high = thresholds[current] * (1 + h)
+        if (low is None or value >= low) and (high is None or value < high):
+            return current
+        level = 0
+        for i in thresholds:
+            if value < i:
+                break
+            level += 1
+        return min(level, last)
+
+    def get_distance(self, camera=None):
+        """Return the distance from camera (None or the camera object) to the group."""
+        m = self.get_world_matrix()
+        x, y, z = m[0,3], m[1,3], -m[2,3]
+        if camera:
+            cx, cy, cz = camera.get_eye_pos()
+        else:
+            cx = cy = cz = 0
+        return math.sqrt((x-cx)**2 + (y-cy)**2 + (z-cz)**2)
+
+    def get_screen_size(self, distance):
+        """Return roughly how many pixels high the group is on screen, distance away from the camera."""
+        if not self.levels:
+            return 0
+        radius = self.levels[0].get_bounding_sphere().radius * max([abs(i) for i in self.get_scale()])
+        if distance <= radius:
+            return view.screen.screen_size[1]
+        f = view.get_projection_matrix()[1,1]
+        return radius / distance * f * view.screen.screen_size[1]
+
+    def update_level(self, camera=None):
+        """Pick the level to render for camera (None or the camera object), and return it."""
+        level = 0
+        if self.distances or self.sizes:
+            distance = self.get_distance(camera)
+            if self.distances:
+                level = self._pick(distance, self.distances, self.level)
+            if self.sizes:
+                #smaller is less detailed, so pick by the inverse of the size
+                size = self.get_screen_size(distance)
+                level = max(level, self._pick(1.0 / max(size, 0.0001),
+                                              [1.0 / i for i in self.sizes], self.level))
+        self.level = level
+        return level
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing the most detailed level."""
+        if not self.levels:
+            return math3d.Sphere(self.get_pos(), 0)
+        return math3d.transform_sphere(self.get_matrix(), self.levels[0].get_bounding_sphere())
+
+    def get_bounding_box(self):
+        """Return None - the group is picked by its bounding sphere."""
+        return None
+
+    def get_render_state(self):
+        """Return the render state of the current level."""
+        if not self.levels:
+            return BaseSceneObject.get_render_state(self)
+        return self.levels[min(self.level, len(self.levels)-1)].get_render_state()
+
+    def render(self, camera=None):
+        """Pick a level and render it, relative to the group.
+           camera should be None or the camera the scene is using"""
+        if not self.levels:
+            return None
+        level = self.update_level(camera)
+        lods = view.stats.lod_levels
+        lods[level] = lods.get(level, 0) + 1
+        glPushMatrix()
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
+        self.levels[level].render(camera)
+        glPopMatrix()
+
+    def copy(self):
+        """Return a copy of the group, sharing the same levels."""
+        return LODGroup(self.levels, self.distances, self.sizes, self.pos, self.rotation, self.scale, self.hysteresis)
+
+def is_tiled(texcoords):
+    """Return whether any of the (n,2) numpy array texcoords is outside 0-1, so the texture must repeat."""
+    return bool(len(texcoords) and (texcoords.min() < 0 or texcoords.max() > 1))
+
+def interleave_geometry(color, vertices, normals, texcoords):
+    """Return an (n,12) float32 numpy array of the interleaved GL_T2F_C4F_N3F_V3F vertices render_interleaved draws
+       color is an (r,g,b[,a]) tuple or an (n,4) array, the rest are (n,3), (n,3) and (n,2) arrays like get_geometry returns"""
+    array = numpy.empty((len(vertices), 12), dtype=numpy.float32)
+    array[:,0:2] = texcoords
+    if numpy.shape(color) == (3,):
+        color = tuple(color) + (1,)
+    array[:,2:6] = color
+    array[:,6:9] = normals
+    array[:,9:12] = vertices
+    return array
+
+def render_interleaved(parts):
+    """Draw a list of (texture, tiled, array) triangles - array from interleave_geometry - with one glDrawArrays each
+       tiled is whether the texture must repeat, see is_tiled"""
+    if not len(parts):
+        return None
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+    glEnableClientState(GL_NORMAL_ARRAY)
+    glEnableClientState(GL_TEXTURE_COORD_ARRAY)
+    for texture, tiled, array in parts:
+        texture.bind()
+        if tiled:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glInterleavedArrays(GL_T2F_C4F_N3F_V3F, 0, array)
+        glDrawArrays(GL_TRIANGLES, 0, len(array))
+        view.stats.draw_arrays += 1
+        if tiled:
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+    glDisableClientState(GL_VERTEX_ARRAY)
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_NORMAL_ARRAY)
+    glDisableClientState(GL_TEXTURE_COORD_ARRAY)
+
+def merge_spheres(spheres):
+    """Return a math3d.Sphere that encloses all of spheres (a list of math3d.Sphere's)."""
+    if not spheres:
+        return math3d.Sphere((0,0,0), 0)
+    minx = min([i.x - i.radius for i in spheres])
+    maxx = max([i.x + i.radius for i in spheres])
+    miny = min([i.y - i.radius for i in spheres])
+    maxy = max([i.y + i.radius for i in spheres])
+    minz = min([i.z - i.radius for i in spheres])
+    maxz = max([i.z + i.radius for i in spheres])
+    center = math3d.Vector(((minx+maxx)*0.5, (miny+maxy)*0.5, (minz+maxz)*0.5))
+    radius = max([center.distance(i) + i.radius for i in spheres])
+    return math3d.Sphere(center.get_pos(), radius)
+
 def save_screenshot(filename):
     """Save a screenshot to filename"""
     pygame.image.save(pygame.display.get_surface(), filename)
@@ -265,6 +850,17 @@ class BatchVertObject(BaseSceneObject):
         self.display_list = data.DisplayList()
         self._compile(fix_order)
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere that fully encloses the verts - used by the octree and picking."""
+        radius = 0
+        for x, y, z in self.verts:
+            radius = max(radius, x*x + y*y + z*z)
+        return math3d.Sphere(self.get_pos(), math.sqrt(radius) * max([abs(i) for i in self.get_scale()]))
+
+    def get_bounding_box(self):
+        """Return None - the verts are picked by their bounding sphere."""
+        return None
+
     def _compile(self, fix_order):
         if not self.verts:
             return
@@ -308,16 +904,8 @@ class BatchVertObject(BaseSceneObject):
 
     def render(self, camera=None):
         glPushMatrix()
-        x, y, z = self.pos
-        glTranslatef(x, y, -z)
-        a, b, c = self.rotation
-        glRotatef(a, 1, 0, 0)
-        glRotatef(b, 0, 1, 0)
-        glRotatef(c, 0, 0, 1)
-        try:
-            glScalef(*self.scale)
-        except:
-            glScalef(self.scale, self.scale, self.scale)
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
         glColor(*self.colorize)
         self.texture.bind()
         if self.outline:
@@ -0,0 +1,158 @@
+"""
+pyggel.occlusion
+This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
+
+The occlusion module contains a small software depth buffer, used by the scene to skip objects
+hidden behind large occluders (like walls) without asking the video card.
+"""
+
+import numpy
+
+#the eight corners of a box, as indices into (minx, miny, minz, maxx, maxy, maxz)
+_CORNERS = numpy.array(((0,1,2), (3,1,2), (0,4,2), (3,4,2),
+                        (0,1,5), (3,1,5), (0,4,5), (3,4,5)))
+
+def get_box_bounds(boxes):
+    """Return an (n,6) numpy array of the (minx, miny, minz, maxx, maxy, maxz) of every box in boxes
+       boxes must be a list of math3d.AABox objects"""
+    bounds = numpy.empty((len(boxes), 6), dtype=numpy.float64)
+    for i, box in enumerate(boxes):
+        sx, sy, sz = box.scale
+        w = box.width * sx * 0.5
+        h = box.height * sy * 0.5
+        d = box.depth * sz * 0.5
+        bounds[i] = (box.x-w, box.y-h, box.z-d, box.x+w, box.y+h, box.z+d)
+    return bounds
+
+class DepthBuffer(object):
+    """A low resolution depth buffer that lives in a numpy array, so it can be tested without touching OpenGL.
+       Occluder boxes are drawn into it (at their furthest depth, so they never hide more than they really do),
+       and then other boxes are tested against it to see if they are completely hidden."""
+    def __init__(self, size=(128, 96), near=0.1):
+        """Create the buffer
+           size is the (width, height) of the buffer - it covers the whole view, whatever the aspect
+           near is how close to the camera a box may come before it is ignored (as an occluder) or always visible"""
+        self.size = size
+        self.near = near
+
+        self.depth = numpy.empty((size[1], size[0]), dtype=numpy.float32)
+        self.depth.fill(numpy.inf)
+        self.matrix = None
+        self.num_occluders = 0
+
+        #pixel centers, used to find which pixels an occluder covers
+        self._px = numpy.arange(size[0], dtype=numpy.float64) + 0.5
+        self._py = numpy.arange(size[1], dtype=numpy.float64) + 0.5
+
+    def clear(self, matrix):
+        """Empty the buffer and set the view it renders
+           matrix must be the 4x4 numpy projection matrix multiplied by the camera (modelview) matrix,
+           like Scene.get_frustum uses"""
+        self.matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        self.depth.fill(numpy.inf)
+        self.num_occluders = 0
+
+    def _project(self, bounds):
+        """Return the (n,8,2) buffer positions and (n,8) view distances of the corners of every box in bounds
+           bounds must be an (n,6) array like get_box_bounds returns, in PYGGEL coordinates"""
+        corners = bounds[:,_CORNERS]
+        corners[:,:,2] *= -1 #objects at (x,y,z) are rendered at (x,y,-z)
+        m = self.matrix
+        clip = numpy.dot(corners, m[:,:3].T) + m[:,3]
+        w = clip[:,:,3]
+        safe = numpy.where(w > self.near, w, 1)
+        screen = numpy.empty(clip.shape[:2] + (2,), dtype=numpy.float64)
+        screen[:,:,0] = (clip[:,:,0] / safe * 0.5 + 0.5) * self.size[0]
+        screen[:,:,1] = (clip[:,:,1] / safe * 0.5 + 0.5) * self.size[1]
+        return screen, w
+
+    def add_occluders(self, boxes):
+        """Draw boxes into the buffer, each at its furthest depth
+           boxes must be a list of math3d.AABox objects that are completely solid
+           Boxes that reach behind the near distance are skipped."""
+        if not boxes:
+            return None
+        screen, w = self._project(get_box_bounds(boxes))
+        width, height = self.size
+        for i in xrange(len(boxes)):
+            if w[i].min() <= self.near:
+                continue
+            hull = _convex_hull(screen[i].tolist())
+            if len(hull) < 3:
+                continue
+            xs = [p[0] for p in hull]
+            ys = [p[1] for p in hull]
+            x0 = max(int(min(xs)), 0)
+            x1 = min(int(max(xs)) + 1, width)
+            y0 = max(int(min(ys)), 0)
+            y1 = min(int(max(ys)) + 1, height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            px = self._px[x0:x1]
+            py = self._py[y0:y1, numpy.newaxis]
+            inside = None
+            for j in xrange(len(hull)):
+                ax, ay = hull[j-1]
+                bx, by = hull[j]
+                #edge function, positive inside the (counter clockwise) hull
+                a = ay - by
+                b = bx - ax
+                c = ax*by - ay*bx
+                #only count pixels that are completely inside, not just their centers
+                edge = (a*px + c) + b*py >= (abs(a) + abs(b)) * 0.5
+                if inside is None:
+                    inside = edge
+                else:
+                    inside &= edge
+            region = self.depth[y0:y1, x0:x1]
+            numpy.minimum(region, numpy.where(inside, w[i].max(), numpy.inf), region)
+            self.num_occluders += 1
+
+    def test(self, boxes):
+        """Return a list of whether each box in boxes is completely hidden behind what is in the buffer
+           boxes must be a list of math3d.AABox objects"""
+        if not boxes:
+            return []
+        screen, w = self._project(get_box_bounds(boxes))
+        lo = numpy.floor(screen.min(1)).astype(numpy.int32)
+        hi = numpy.ceil(screen.max(1)).astype(numpy.int32)
+        nearest = w.min(1)
+        width, height = self.size
+        depth = self.depth
+        hidden = []
+        for i in xrange(len(boxes)):
+            if nearest[i] <= self.near:
+                hidden.append(False)
+                continue
+            x0 = max(lo[i][0], 0)
+            y0 = max(lo[i][1], 0)
+            x1 = min(hi[i][0], width)
+            y1 = min(hi[i][1], height)
+            if x0 >= x1 or y0 >= y1:
+                hidden.append(False) #off screen, that is for frustum culling to decide
+                continue
+            hidden.append(bool(depth[y0:y1, x0:x1].max() < nearest[i]))
+        return hidden
+
+    def is_hidden(self, box):
+        """Return whether math3d.AABox box is completely hidden behind what is in the buffer"""
+        return self.test([box])[0]
+
+def _convex_hull(points):
+    """Return the convex hull of a list of (x,y) points, counter clockwise"""
+    points = sorted(set(map(tuple, points)))
+    if len(points) < 3:
+        return points
+    def cross(o, a, b):
+        return (a[0]-o[0])*(b[1]-o[1]) - (a[1]-o[1])*(b[0]-o[0])
+    lower = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
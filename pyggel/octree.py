@@ -0,0 +1,299 @@
+"""
+pyggel.octree
+This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
+
+The octree module contains a loose octree used to spatially index scene objects by their bounds,
+so that rendering and picking only need to visit the parts of a scene that matter.
+"""
+
+import math
+
+class OctreeNode(object):
+    """A single cube of space in an Octree.
+       Holds the objects that fit inside it, but are too large to fit inside any of its children."""
+    def __init__(self, tree, parent, center, size, depth):
+        """Create the node
+           tree is the Octree this node belongs to
+           parent is the parent OctreeNode, or None if this is the root
+           center is the (x,y,z) center of the node
+           size is half the width of the node (before loosening)
+           depth is how many levels down the tree the node is"""
+        self.tree = tree
+        self.parent = parent
+        self.center = center
+        self.size = size
+        self.depth = depth
+
+        self.loose_size = size * tree.looseness
+        self.radius = self.loose_size * 1.7320508075688772 #sqrt(3)
+
+        self.children = [None]*8
+        self.objects = []
+        self.count = 0 #number of objects in this node and all children, so empty branches are skipped
+
+    def get_child(self, index, create=True):
+        """Return the child node at index (0-7), creating it if it does not exist and create is True"""
+        child = self.children[index]
+        if child is None and create:
+            child = OctreeNode(self.tree, self, self.get_child_center(index), self.size*0.5, self.depth+1)
+            self.children[index] = child
+        return child
+
+    def get_child_center(self, index):
+        """Return the (x,y,z) center of the child node at index (0-7), whether it exists or not"""
+        s = self.size * 0.5
+        x, y, z = self.center
+        if index & 1: x += s
+        else: x -= s
+        if index & 2: y += s
+        else: y -= s
+        if index & 4: z += s
+        else: z -= s
+        return x, y, z
+
+    def child_fits(self, index, pos, radius):
+        """Return whether a sphere at pos with radius is fully inside the loose bounds of the child node at index,
+           without creating the child"""
+        x, y, z = self.get_child_center(index)
+        s = self.size * 0.5 * self.tree.looseness - radius
+        return abs(pos[0]-x) <= s and abs(pos[1]-y) <= s and abs(pos[2]-z) <= s
+
+    def get_child_index(self, pos):
+        """Return the index of the child node pos falls into"""
+        x, y, z = self.center
+        i = 0
+        if pos[0] >= x: i |= 1
+        if pos[1] >= y: i |= 2
+        if pos[2] >= z: i |= 4
+        return i
+
+    def fits(self, pos, radius):
+        """Return whether a sphere at pos with radius is fully inside the loose bounds of this node"""
+        x, y, z = self.center
+        s = self.loose_size - radius
+        return abs(pos[0]-x) <= s and abs(pos[1]-y) <= s and abs(pos[2]-z) <= s
+
+    def _add_count(self, amount):
+        """Add amount to the object count of this node and all parents"""
+        node = self
+        while node:
+            node.count += amount
+            node = node.parent
+
+    def get_all(self, into):
+        """Add all objects in this node and all children to list into"""
+        into.extend(self.objects)
+        for i in self.children:
+            if i and i.count:
+                i.get_all(into)
+        return into
+
+class Octree(object):
+    """A loose octree that indexes objects by their bounding spheres.
+       Objects must provide a get_bounding_sphere method (see scene.BaseSceneObject),
+       and are automatically moved in the tree when their pos or scale are changed."""
+    def __init__(self, center=(0,0,0), size=512, max_depth=6, looseness=2.0):
+        """Create the Octree
+           center is the (x,y,z) center of the space the tree covers
+           size is the width of the space the tree covers - objects outside are still stored, just not sorted
+           max_depth is the maximum number of times the space will be subdivided
+           looseness is how much larger than its cell each node's bounds are - must be greater than 1"""
+        self.center = tuple(center)
+        self.size = size
+        self.max_depth = max_depth
+        self.looseness = looseness
+
+        self.root = OctreeNode(self, None, self.center, size*0.5, 0)
+        self._entries = {} #obj: [node, pos, radius]
+
+    def __len__(self):
+        """Return the number of objects in the tree"""
+        return len(self._entries)
+
+    def __nonzero__(self):
+        """Return True - a tree is true even when empty, so "if tree:" tests whether there is one (like the scene hooks do)"""
+        return True
+
+    def __iter__(self):
+        """Return an iterator over all objects in the tree"""
+        return iter(self._entries)
+
+    def __contains__(self, obj):
+        """Return whether obj is in the tree"""
+        return obj in self._entries
+
+    def _get_bounds(self, obj):
+        """Return the (x,y,z), radius bounding sphere of obj"""
+        sphere = obj.get_bounding_sphere()
+        return (sphere.x, sphere.y, sphere.z), sphere.radius
+
+    def _find_node(self, pos, radius):
+        """Return the deepest node a sphere at pos with radius fits in"""
+        node = self.root
+        if not node.fits(pos, radius):
+            return node
+        limit = self.looseness - 1
+        while node.depth < self.max_depth:
+            if radius > node.size * 0.5 * limit:
+                break
+            index = node.get_child_index(pos)
+            if not node.child_fits(index, pos, radius):
+                break #in the loose band around the tree, outside the cell the child covers
+            node = node.get_child(index)
+        return node
+
+    def add(self, obj):
+        """Add obj to the tree"""
+        if obj in self._entries:
+            return
+        pos, radius = self._get_bounds(obj)
+        node = self._find_node(pos, radius)
+        node.objects.append(obj)
+        node._add_count(1)
+        self._entries[obj] = [node, pos, radius]
+        obj.add_watcher(self)
+
+    def remove(self, obj):
+        """Remove obj from the tree"""
+        if not obj in self._entries:
+            return
+        node = self._entries.pop(obj)[0]
+        node.objects.remove(obj)
+        node._add_count(-1)
+        obj.remove_watcher(self)
+
+    def clear(self):
+        """Remove all objects from the tree"""
+        for i in list(self._entries):
+            self.remove(i)
+
+    def update(self, obj):
+        """Recalculate the bounds of obj and move it through the tree if needed.
+           This is called automatically when obj.pos or obj.scale are set,
+           but must be called manually if obj changes size any other way."""
+        entry = self._entries.get(obj)
+        if entry is None:
+            return
+        pos, radius = self._get_bounds(obj)
+        entry[1] = pos
+        entry[2] = radius
+        node = entry[0]
+        if node.fits(pos, radius) and\
+           (node.depth == self.max_depth or radius > node.size * 0.5 * (self.looseness-1)):
+            return #still the best fit, nothing to do...
+        new = self._find_node(pos, radius)
+        if new is node:
+            return
+        node.objects.remove(obj)
+        node._add_count(-1)
+        new.objects.append(obj)
+        new._add_count(1)
+        entry[0] = new
+
+    object_moved = update
+
+    def get_bounds(self, obj):
+        """Return the cached ((x,y,z), radius) bounding sphere of obj"""
+        entry = self._entries[obj]
+        return entry[1], entry[2]
+
+    def get_all(self):
+        """Return a list of all objects in the tree"""
+        return self.root.get_all([])
+
+    def get_in_frustum(self, frustum):
+        """Return a list of all objects whose bounding sphere is at least partially inside frustum
+           frustum must be a list of (a,b,c,d) planes with normals pointing inward"""
+        found = []
+        entries = self._entries
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            x, y, z = node.center
+            r = node.radius
+            is_root = node.parent is None #root also holds everything outside the tree
+            inside = not is_root
+            for a, b, c, d in frustum:
+                dist = a*x + b*y + c*z + d
+                if dist < -r and not is_root:
+                    break
+                if dist < r:
+                    inside = False
+            else:
+                if inside:
+                    node.get_all(found)
+                    continue
+                for obj in node.objects:
+                    (ox, oy, oz), orad = entries[obj][1:]
+                    for a, b, c, d in frustum:
+                        if a*ox + b*oy + c*oz + d < -orad:
+                            break
+                    else:
+                        found.append(obj)
+                for i in node.children:
+                    if i and i.count:
+                        stack.append(i)
+        return found
+
+    def get_colliding(self, pos, radius):
+        """Return a list of all objects whose bounding sphere touches the sphere at pos with radius"""
+        found = []
+        entries = self._entries
+        px, py, pz = pos
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            s = node.loose_size + radius
+            x, y, z = node.center
+            if abs(px-x) > s or abs(py-y) > s or abs(pz-z) > s:
+                if node.parent: #root also holds everything outside the tree
+                    continue
+            for obj in node.objects:
+                (ox, oy, oz), orad = entries[obj][1:]
+                r = orad + radius
+                if (ox-px)**2 + (oy-py)**2 + (oz-pz)**2 <= r*r:
+                    found.append(obj)
+            for i in node.children:
+                if i and i.count:
+                    stack.append(i)
+        return found
+
+    def get_on_ray(self, ray):
+        """Return a list of (distance, obj) for every object whose bounding sphere is hit by ray, closest first
+           ray must be a math3d.Ray"""
+        found = []
+        entries = self._entries
+        origin = ray.x, ray.y, ray.z
+        direction = ray.direction.x, ray.direction.y, ray.direction.z
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.parent and _ray_sphere(origin, direction, node.center, node.radius) is None:
+                continue
+            for obj in node.objects:
+                pos, radius = entries[obj][1:]
+                dist = _ray_sphere(origin, direction, pos, radius)
+                if not dist is None:
+                    found.append((dist, obj))
+            for i in node.children:
+                if i and i.count:
+                    stack.append(i)
+        found.sort(key=lambda x: x[0])
+        return found
+
+def _ray_sphere(origin, direction, pos, radius):
+    """Return the distance along a ray (from origin, along normalized direction) to a sphere,
+       0 if the ray starts inside the sphere, or None if it misses"""
+    lx = pos[0] - origin[0]
+    ly = pos[1] - origin[1]
+    lz = pos[2] - origin[2]
+    c = lx*lx + ly*ly + lz*lz - radius*radius
+    if c <= 0:
+        return 0
+    b = lx*direction[0] + ly*direction[1] + lz*direction[2]
+    if b < 0:
+        return None
+    disc = b*b - c
+    if disc < 0:
+        return None
+    return b - math.sqrt(disc)
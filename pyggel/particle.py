@@ -7,11 +7,12 @@ A simple fire effect is included.
 """
 
 from include import *
-import data, image, misc, data
+import data, image, misc, data, math3d
 from scene import BaseSceneObject
 
 import random
 import numpy
+import math
 
 from misc import randfloat
 
@@ -60,6 +61,9 @@ class Emitter3D(BaseSceneObject):
         self.particle_type = Particle3D
 
         self.pickable = False
+        self.auto_update = True #whether render updates the emitter and particles - set to False and call step
+                                #from a fixed rate update (see loop.FixedStepLoop) so they move at the same speed
+                                #whatever the frame rate
 
     def get_dimensions(self):
         """Return the maximum dimensions (width/height/depth) of the emitter and particles."""
@@ -73,16 +77,36 @@ class Emitter3D(BaseSceneObject):
         """Return the scale of the object."""
         return 1,1,1
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing the emitter and particles - the dimensions extend both ways from pos."""
+        w, h, d = self.get_dimensions()
+        return math3d.Sphere(self.get_pos(), math.sqrt(w**2 + h**2 + d**2))
+
+    def get_bounding_box(self):
+        """Return a math3d.AABox enclosing the emitter and particles."""
+        w, h, d = self.get_dimensions()
+        return math3d.AABox(self.get_pos(), (w*2, h*2, d*2))
+
     def update(self):
         """Update the emitter."""
         self.behavior.emitter_update()
 
+    def step(self):
+        """Update the emitter and all particles once - only needed if auto_update is False."""
+        self.update()
+        for i in self.particles[:]:
+            i.update()
+
     def render(self, camera):
-        """Render and update all particles.
+        """Render all particles, updating them first if auto_update is True.
            camera must be None of the camera the scene is using"""
-        self.update()
-        for i in self.particles:
-            i.render(camera)
+        if self.auto_update:
+            self.update()
+            for i in self.particles:
+                i.render(camera)
+        else:
+            for i in self.particles:
+                i.image.render(camera)
 
 
 class Behavior3D(object):
@@ -235,6 +259,7 @@ class EmitterPoint(BaseSceneObject):
 
         self.pickable = False
         self.particle_type = ParticlePoint
+        self.auto_update = True #whether render updates the emitter and particles, see Emitter3D.auto_update
 
     def get_dimensions(self):
         """Return the maximum dimensions (width/height/depth) of the emitter and particles."""
@@ -248,6 +273,16 @@ class EmitterPoint(BaseSceneObject):
         """Return the scale of the object."""
         return 1,1,1
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing the emitter and particles - the dimensions extend both ways from pos."""
+        w, h, d = self.get_dimensions()
+        return math3d.Sphere(self.get_pos(), math.sqrt(w**2 + h**2 + d**2))
+
+    def get_bounding_box(self):
+        """Return a math3d.AABox enclosing the emitter and particles."""
+        w, h, d = self.get_dimensions()
+        return math3d.AABox(self.get_pos(), (w*2, h*2, d*2))
+
     def add_particle(self, part):
         """Add the particle to the vertex array and assign it it's own index."""
         if self.empty_spaces:
@@ -271,14 +306,19 @@ class EmitterPoint(BaseSceneObject):
         """Update the emitter."""
         self.behavior.emitter_update()
 
-    def render(self, camera):
-        """Render and update all particles.
-           camera must be None of the camera the scene is using"""
+    def step(self):
+        """Update the emitter and all particles once - only needed if auto_update is False."""
         self.update()
-        glPointSize(self.behavior.point_size)
         for i in self.particles:
             if i:
                 i.update()
+
+    def render(self, camera):
+        """Render all particles, updating them first if auto_update is True.
+           camera must be None of the camera the scene is using"""
+        if self.auto_update:
+            self.step()
+        glPointSize(self.behavior.point_size)
         self.vertex_array.render()
 
 
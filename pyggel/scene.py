@@ -6,12 +6,20 @@ The scene module contains classes used to represent an entire group of renderabl
 """
 
 from include import *
-import camera, view, misc
-from light import all_lights
+import camera, view, misc, math3d, octree, data, light, occlusion, snapshot, image, scenefile
 from data import BlankTexture
 
+import math
+import numpy
+import time
+
 class BaseSceneObject(object):
     """A simple object that provides the basic functionality to be added to a scene."""
+    _watchers = ()
+    parent = None #the SceneNode the object is attached to, if any
+    _matrix_key = None
+    _world_key = None
+    occluder = False #whether Scene.occlude should hide objects behind this one - its bounding box must be solid
     def __init__(self):
         """Create the object."""
 
@@ -31,6 +39,43 @@ class BaseSceneObject(object):
 
         self.dead_remove_from_scene = False
 
+    def getpos(self):
+        """Return the pos of the object."""
+        return self._pos
+    def setpos(self, pos):
+        """Set the pos of the object - tells anything watching the object that it moved."""
+        self._pos = pos
+        if self._watchers:
+            self._moved()
+    def getscale(self):
+        """Return the scale of the object."""
+        return self._scale
+    def setscale(self, scale):
+        """Set the scale of the object - tells anything watching the object that it moved."""
+        self._scale = scale
+        if self._watchers:
+            self._moved()
+    pos = property(getpos, setpos)
+    scale = property(getscale, setscale)
+
+    def add_watcher(self, watcher):
+        """Add an object (like an octree.Octree) that is told when pos or scale are set.
+           watcher must have an object_moved(obj) method"""
+        if not self._watchers:
+            self._watchers = []
+        if not watcher in self._watchers:
+            self._watchers.append(watcher)
+
+    def remove_watcher(self, watcher):
+        """Remove a watcher from the object."""
+        if watcher in self._watchers:
+            self._watchers.remove(watcher)
+
+    def _moved(self):
+        """Tell all watchers the object has moved."""
+        for i in self._watchers:
+            i.object_moved(self)
+
     def get_dimensions(self):
         """Return the size of the object..."""
         return 1,1,1
@@ -39,6 +84,76 @@ class BaseSceneObject(object):
         """Return the pos of the object..."""
         return self.pos
 
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere that fully encloses the object - used by the octree and picking."""
+        w, h, d = self.get_dimensions()
+        sx, sy, sz = self.get_scale()
+        radius = math.sqrt((w*sx)**2 + (h*sy)**2 + (d*sz)**2) * 0.5
+        return math3d.Sphere(self.get_pos(), radius)
+
+    def _get_transform(self):
+        """Return the (pos, rotation, scale) tuples get_matrix is built from - pos is in OpenGL coords."""
+        x, y, z = self.pos
+        a, b, c = self.rotation
+        return (x, y, -z), (a, b, c), self.get_scale()
+
+    def get_matrix(self):
+        """Return the 4x4 numpy matrix that positions, rotates and scales the object relative to its parent.
+           This is cached, and only rebuilt when pos, rotation or scale change."""
+        key = self._get_transform()
+        if not key == self._matrix_key:
+            self._matrix = math3d.transform_matrix(*key)
+            self._gl_matrix = numpy.transpose(self._matrix).copy() #column major, for glMultMatrixd
+            self._matrix_key = key
+        return self._matrix
+
+    def get_gl_matrix(self):
+        """Return get_matrix in the column major order glMultMatrixd and glLoadMatrixd want."""
+        self.get_matrix()
+        return self._gl_matrix
+
+    def get_world_matrix(self):
+        """Return the 4x4 numpy matrix that places the object in the world - get_matrix multiplied by every parent's.
+           This is cached, and only rebuilt when the object or one of its parents changes."""
+        local = self.get_matrix()
+        if self.parent is None:
+            return local
+        parent = self.parent.get_world_matrix()
+        key = self._world_key
+        if key is None or not (key[0] is parent and key[1] is local):
+            self._world_key = parent, local, numpy.dot(parent, local)
+        return self._world_key[2]
+
+    def get_render_state(self):
+        """Return a key of the texture and color the object renders with - the scene sorts by this to change state less."""
+        texture = getattr(self, "texture", None)
+        colorize = getattr(self, "colorize", None)
+        if colorize:
+            colorize = tuple(colorize)
+        return getattr(texture, "gl_tex", None), colorize
+
+    def get_bounding_box(self):
+        """Return a math3d.AABox that fully encloses the object, or None if the object is rotated - used by picking."""
+        if self.rotation[0] or self.rotation[1] or self.rotation[2]:
+            return None
+        w, h, d = self.get_dimensions()
+        sx, sy, sz = self.get_scale()
+        return math3d.AABox(self.get_pos(), (w*abs(sx), h*abs(sy), d*abs(sz)))
+
+    def get_occluder_box(self):
+        """Return a math3d.AABox the object completely fills, used by Scene.occlude to hide what is behind it,
+           or None if it shouldn't hide anything - by default the bounding box if occluder is True."""
+        if self.occluder:
+            return self.get_bounding_box()
+        return None
+
+    def get_geometry(self):
+        """Return a list of (texture, color, vertices, normals, texcoords) - the triangles of the object,
+           before get_matrix is applied, as numpy float32 arrays of (n,3), (n,3) and (n,2)
+           (color is an RGBA tuple, or an (n,4) array of the color of each vertex) -
+           or None if the object can't be drawn that way. Used by misc.StaticObjectGroup to merge objects."""
+        return None
+
     def render(self, camera=None):
         """Called by the scene to render the object..."""
         pass
@@ -70,6 +185,65 @@ class BaseSceneObject(object):
         c += z
         self.pos = a,b,c
 
+class SceneNode(BaseSceneObject):
+    """An object that holds other objects (or nodes) as children, so they move, rotate and scale with it.
+       Children are positioned relative to the node - add the node to the scene, not the children."""
+    def __init__(self, children=[], pos=(0,0,0), rotation=(0,0,0), scale=1):
+        """Create the node
+           children must be a list of objects to attach to the node
+           pos/rotation/scale are the transform of the node, applied to all children"""
+        BaseSceneObject.__init__(self)
+        self.pos = pos
+        self.rotation = rotation
+        self.scale = scale
+        self.children = []
+        for i in children:
+            self.add_child(i)
+
+    def add_child(self, obj):
+        """Attach obj to the node, taking it from any node it was attached to."""
+        if obj.parent:
+            obj.parent.remove_child(obj)
+        obj.parent = self
+        self.children.append(obj)
+        if self._watchers:
+            self._moved()
+
+    def remove_child(self, obj):
+        """Detach obj from the node."""
+        if obj in self.children:
+            self.children.remove(obj)
+            obj.parent = None
+            if self._watchers:
+                self._moved()
+
+    def get_bounding_sphere(self):
+        """Return a math3d.Sphere enclosing all children.
+           NOTE: this is only sent to watchers (like the scene octree) when the node moves or children are added/removed,
+                 if children move on their own call Scene.update_object(node) afterwards"""
+        spheres = [i.get_bounding_sphere() for i in self.children]
+        if not spheres:
+            return math3d.Sphere(self.get_pos(), 0)
+        return math3d.transform_sphere(self.get_matrix(), misc.merge_spheres(spheres))
+
+    def get_bounding_box(self):
+        """Return None - the node is picked by its bounding sphere."""
+        return None
+
+    def render(self, camera=None):
+        """Render all visible children, relative to the node."""
+        glPushMatrix()
+        view.stats.matrix_pushes += 1
+        glMultMatrixd(self.get_gl_matrix())
+        for i in self.children:
+            if i.visible:
+                i.render(camera)
+        glPopMatrix()
+
+    def copy(self):
+        """Return a copy of the node, with copies of all children."""
+        return SceneNode([i.copy() for i in self.children], self.pos, self.rotation, self.scale)
+
 class Tree(object):
     """A simple class used to keep track of all objects in a scene."""
     def __init__(self):#, hs, ps):
@@ -81,6 +255,24 @@ class Tree(object):
         self.skybox = None
         self.lights = []
 
+        #octree.Octree's indexing the 3d lists, or None when the scene is not using octrees
+        self.octree_3d = None
+        self.octree_3d_blend = None
+        self.octree_3d_always = None
+
+        #objects removed from each list, they stop rendering right away
+        #but are only taken out of the lists once per frame, by Scene.flush_removed
+        self.removed_2d = set()
+        self.removed_3d = set()
+        self.removed_3d_blend = set()
+        self.removed_3d_always = set()
+
+        #objects in each list that aren't removed, so removing one that isn't in the scene can be caught
+        self.members_2d = set()
+        self.members_3d = set()
+        self.members_3d_blend = set()
+        self.members_3d_always = set()
+
 class Scene(object):
     """A simple scene class used to store, render, pick and manipulate objects."""
     def __init__(self):
@@ -92,18 +284,407 @@ class Scene(object):
 
         self.render_buffer = None
 
+        self.light_manager = light.LightManager() #shares the OpenGL lights between any number of scene lights
+
         self.pick = False #can be true or false
+        self.pick_mode = "depth" #"depth" reads the depth after each pickable object,
+                                 #"color" renders pickable objects once into an id buffer and reads that -
+                                 #a frame buffer of its own, or without those the pick_size area of the display,
+                                 #which is put back afterwards
+        self.pick_size = 1 #width/height of the area around the mouse "color" picking reads
+        self.picked = [] #all objects in the pick_size area from the last "color" pick, closest to the mouse first
+        self._pick_buffer = None
+
+        self.sort = False #render non-blended 3d objects sorted by texture and color, so state changes less often
+        self._sorted_3d = None
+        self.sort_blend = False #render blended 3d objects furthest from the camera first, so they blend correctly
+        self._blend_order = [] #last frame's sorted blend objects, the next sort starts from this
+
+        self.cull = False #skip rendering objects that are outside the camera's view
+        self.num_drawn = 0 #number of 3d objects rendered last frame
+        self.num_culled = 0 #number of 3d objects skipped last frame because they were out of view (or hidden, see num_occluded)
+
+        self.occlude = False #skip rendering 3d objects hidden behind occluders - objects with occluder set to True,
+                             #and the solid parts of misc.StaticObjectGroups (like the cubes of a level's walls)
+        self.occlusion_buffer = occlusion.DepthBuffer() #the software depth buffer occluders are drawn into
+        self.num_occluded = 0 #number of 3d objects skipped last frame because they were hidden
+
+        self.batch_2d = False #draw plain image.Images in render_2d through sprite_batch, a run of images that share a texture at once
+        self.sprite_batch = image.SpriteBatch()
+
+        self.snapshot = None #a snapshot.TransformSnapshot copied onto its objects at the start of every render,
+                             #so the objects can be moved from another thread
+
+    def enable_octree(self, center=(0,0,0), size=512, max_depth=6):
+        """Index all 3d objects in the scene with an octree.Octree, so rendering and picking only
+           need to visit the parts of the scene that matter - best for scenes with a lot of objects.
+           center is the (x,y,z) center of the level
+           size is the width of the level - objects outside still work, but are not sorted
+           max_depth is how many times the space will be subdivided
+           NOTE: objects are only moved in the tree when their pos or scale are set,
+                 so if you change them in place (ie, a list pos) call Scene.update_object afterwards"""
+        g = self.graph
+        g.octree_3d = octree.Octree(center, size, max_depth)
+        g.octree_3d_blend = octree.Octree(center, size, max_depth)
+        g.octree_3d_always = octree.Octree(center, size, max_depth)
+        for i in g.render_3d:
+            g.octree_3d.add(i)
+        for i in g.render_3d_blend:
+            g.octree_3d_blend.add(i)
+        for i in g.render_3d_always:
+            g.octree_3d_always.add(i)
+
+    def disable_octree(self):
+        """Stop indexing 3d objects with an octree."""
+        g = self.graph
+        for i in (g.octree_3d, g.octree_3d_blend, g.octree_3d_always):
+            if i is not None:
+                i.clear()
+        g.octree_3d = g.octree_3d_blend = g.octree_3d_always = None
+
+    def resort(self):
+        """Tell the scene to sort objects again next render (if Scene.sort is True)
+           Adding and removing objects does this already, call it after changing an object's texture or color."""
+        self._sorted_3d = None
+
+    def _get_sorted_3d(self):
+        """Return graph.render_3d sorted by get_render_state, cached until the list changes."""
+        objects = self.graph.render_3d
+        if self._sorted_3d is None or not len(self._sorted_3d) == len(objects):
+            self._sorted_3d = sorted(objects, key=lambda i: i.get_render_state())
+        return self._sorted_3d
+
+    def _sort_blend(self, objects, camera=None):
+        """Return objects sorted furthest from camera first.
+           Starts from last frame's order and insertion sorts it, so this is close to O(n) when little has moved."""
+        if len(objects) < 2:
+            return list(objects)
+        current = set(objects)
+        order = [i for i in self._blend_order if i in current]
+        if not len(order) == len(objects):
+            done = set(order)
+            order.extend([i for i in objects if not i in done])
+
+        pos = numpy.array([i.get_pos() for i in order], dtype=numpy.float64)
+        if camera:
+            m = camera.get_matrix()[2]
+        else:
+            m = (0, 0, 1, 0)
+        #view space z, objects are rendered at (x,y,-z) - the more negative, the further away
+        keys = pos[:,0]*m[0] + pos[:,1]*m[1] - pos[:,2]*m[2] + m[3]
+        if not (keys[1:] >= keys[:-1]).all():
+            keys = keys.tolist()
+            for j in xrange(1, len(keys)):
+                k = keys[j]
+                if k >= keys[j-1]:
+                    continue
+                obj = order[j]
+                n = j - 1
+                while n >= 0 and keys[n] > k:
+                    keys[n+1] = keys[n]
+                    order[n+1] = order[n]
+                    n -= 1
+                keys[n+1] = k
+                order[n+1] = obj
+        self._blend_order = order
+        return order
+
+    def update_object(self, obj):
+        """Update where obj is in the scene's octree - only needed if obj changes position/size without setting pos or scale."""
+        g = self.graph
+        for i in (g.octree_3d, g.octree_3d_blend, g.octree_3d_always):
+            if i is not None:
+                i.update(obj)
+
+    def _get_view_size(self):
+        """Return the (width, height) of the viewport the scene renders 3d objects into."""
+        if self.render_buffer:
+            return self.render_buffer.size
+        return view.screen.screen_size
+
+    def _get_view_matrix(self, camera=None):
+        """Return the 4x4 numpy projection matrix of the scene, multiplied by camera.get_matrix if camera is not None.
+           This is calculated from view.set3d's (or the render_buffer's) settings, without touching OpenGL."""
+        if self.render_buffer:
+            x, y = self.render_buffer.size
+            matrix = math3d.perspective_matrix(45, 1.0*x/y, 0.1, 100.0)
+        else:
+            matrix = view.get_projection_matrix()
+        if camera:
+            matrix = numpy.dot(matrix, camera.get_matrix())
+        return matrix
+
+    def get_frustum(self, camera=None):
+        """Return the six planes of what camera (None or the camera object) can see, like math3d.get_frustum returns.
+           This is calculated from view.set3d's (or the render_buffer's) settings and camera.get_matrix, without touching OpenGL."""
+        return math3d.get_frustum(self._get_view_matrix(camera))
+
+    def get_ray(self, camera=None, screen_pos=None):
+        """Return a math3d.Ray going from camera (None or the camera object) through screen_pos.
+           screen_pos must be None (use the mouse) or the (x,y) screen position, like the pick_pos argument of render
+           This is calculated on the CPU, so it can be used at any time, without touching OpenGL."""
+        if screen_pos is None:
+            screen_pos = view.screen.get_mouse_pos()
+        x, y = screen_pos
+        return self._get_pick_ray(camera, x, view.screen.screen_size[1] - y)
+
+    def pick_ray(self, camera=None, screen_pos=None):
+        """Return (obj, distance) of the closest pickable 3d object under screen_pos, or None if nothing is hit.
+           camera must be None or the camera object used to render the scene
+           screen_pos must be None (use the mouse) or the (x,y) screen position, like the pick_pos argument of render
+           Objects are tested by their bounding sphere, and bounding box if they aren't rotated,
+           all on the CPU - so unlike Scene.pick this never stalls the renderer,
+           and can be used any time, even while updating or from another thread.
+           Like render, objects in render_3d_always are picked before anything else."""
+        ray = self.get_ray(camera, screen_pos)
+        g = self.graph
+        hit = self._get_ray_hit(ray, g.render_3d_always, g.octree_3d_always, g.removed_3d_always)
+        if hit is None:
+            hit = self._get_ray_hit(ray, g.render_3d, g.octree_3d, g.removed_3d)
+            other = self._get_ray_hit(ray, g.render_3d_blend, g.octree_3d_blend, g.removed_3d_blend)
+            if hit is None or (other and other[0] < hit[0]):
+                hit = other
+        if hit:
+            return hit[1], hit[0]
+        return None
+
+    def _get_ray_hit(self, ray, objects, tree=None, removed=()):
+        """Return (distance, obj) of the closest pickable object ray hits from objects, or None.
+           tree is None or the octree.Octree indexing objects
+           removed is the set of objects removed from objects, that are not flushed yet"""
+        if tree is not None:
+            hits = tree.get_on_ray(ray)
+        else:
+            hits = []
+            for i in objects:
+                if removed and i in removed:
+                    continue
+                dist = ray.hit_distance(i.get_bounding_sphere())
+                if not dist is None:
+                    hits.append((dist, i))
+            hits.sort(key=lambda x: x[0])
+        best = None
+        for dist, obj in hits:
+            if best and dist >= best[0]:
+                break #hits are sorted by the sphere distance, which is never further than the real one
+            if not (obj.visible and obj.pickable) or obj.dead_remove_from_scene:
+                continue
+            box = obj.get_bounding_box()
+            if box:
+                d = ray.hit_distance(box)
+                if d is None:
+                    continue
+                dist = max(dist, d)
+            if best is None or dist < best[0]:
+                best = dist, obj
+        return best
+
+    def get_visible(self, objects, tree=None, frustum=None, keep_order=True):
+        """Return the objects that should be rendered from list objects.
+           tree is None or the octree.Octree indexing objects
+           frustum is None (render everything) or the planes the camera can see, from Scene.get_frustum
+           keep_order is whether the result must stay in the same order as objects"""
+        if frustum is None:
+            return objects
+        if tree is not None:
+            visible = tree.get_in_frustum(frustum)
+            if keep_order:
+                visible = set(visible)
+                visible = [i for i in objects if i in visible]
+        else:
+            visible = [i for i in objects if i.get_bounding_sphere().in_frustum(frustum)]
+        self.num_culled += len(objects) - len(visible)
+        return visible
+
+    def _get_occluders(self, objects):
+        """Return a list of the math3d.AABox of every occluder in objects."""
+        boxes = []
+        for i in objects:
+            if not i.visible:
+                continue
+            if i.occluder:
+                box = i.get_occluder_box()
+                if box:
+                    boxes.append(box)
+            elif hasattr(i, "get_occluders"):
+                boxes.extend(i.get_occluders())
+        return boxes
+
+    def update_occlusion(self, camera=None, objects=None):
+        """Redraw Scene.occlusion_buffer from camera's view.
+           objects is None (check all 3d objects) or a list of objects to find occluders in
+           This is called by render when Scene.occlude is True."""
+        if objects is None:
+            objects = self.graph.render_3d
+        self.occlusion_buffer.clear(self._get_view_matrix(camera))
+        self.occlusion_buffer.add_occluders(self._get_occluders(objects))
+
+    def get_unoccluded(self, objects):
+        """Return the objects from list objects that are not completely hidden in Scene.occlusion_buffer,
+           keeping them in the same order."""
+        boxes = []
+        for i in objects:
+            box = i.get_bounding_box()
+            if box is None:
+                sphere = i.get_bounding_sphere()
+                box = math3d.AABox(sphere.get_pos(), sphere.radius * 2)
+            boxes.append(box)
+        hidden = self.occlusion_buffer.test(boxes)
+        visible = [objects[i] for i in xrange(len(objects)) if not hidden[i]]
+        self.num_occluded += len(objects) - len(visible)
+        return visible
+
+    def _get_pick_ray(self, camera, mpx, mpy):
+        """Return a math3d.Ray going from camera through the center of screen pixel mpx, mpy (GL coords, 0,0 is the bottom left)"""
+        return math3d.unproject(self._get_view_matrix(camera), (mpx+0.5, mpy+0.5), self._get_view_size())
+
+    def _get_pick_candidates(self, tree, ray):
+        """Return None (test everything), or a set of the objects in tree that are under the mouse."""
+        if tree is None or ray is None:
+            return None
+        return set([i[1] for i in tree.get_on_ray(ray)])
+
+    def _get_pick_buffer(self):
+        """Return the data.FrameBuffer "color" picking renders into, or None if they are not available."""
+        size = self._get_view_size()
+        buf = self._pick_buffer
+        if buf is None or (buf and (buf.size[0] < size[0] or buf.size[1] < size[1])):
+            buf = False #False once frame buffers failed, so they aren't tried every frame
+            if FBO_AVAILABLE:
+                try:
+                    buf = data.FrameBuffer(size, (0,0,0,0))
+                    if not buf.worked:
+                        buf = False
+                except:
+                    buf = False
+            self._pick_buffer = buf
+        return buf or None
+
+    def _restore_area(self, x, y, w, h, color, depth):
+        """Draw the color (RGBA bytes) and depth (floats) read from the display area x, y, w, h back into it."""
+        glPushAttrib(GL_ALL_ATTRIB_BITS)
+        glDisable(GL_SCISSOR_TEST)
+        for i in (GL_TEXTURE_2D, GL_LIGHTING, GL_FOG, GL_BLEND, GL_ALPHA_TEST, GL_DEPTH_TEST):
+            glDisable(i)
+        glWindowPos2i(x, y)
+        glDrawPixels(w, h, GL_RGBA, GL_UNSIGNED_BYTE, color)
+        #depth is only written with the depth test on, so it passes always - and color is left alone
+        glEnable(GL_DEPTH_TEST)
+        glDepthFunc(GL_ALWAYS)
+        glDepthMask(GL_TRUE)
+        glColorMask(GL_FALSE, GL_FALSE, GL_FALSE, GL_FALSE)
+        glDrawPixels(w, h, GL_DEPTH_COMPONENT, GL_FLOAT, depth)
+        glPopAttrib()
+
+    def _pick_color(self, camera, frustum, mpx, mpy):
+        """Render every pickable object, each in a unique flat color, and read back the pick_size area around mpx, mpy.
+           Returns a list of the objects found, closest to the mouse first."""
+        size = max(1, int(self.pick_size))
+        sw, sh = self._get_view_size()
+        x = min(max(0, mpx - size / 2), sw - 1)
+        y = min(max(0, mpy - size / 2), sh - 1)
+        w = max(1, min(size, sw - x))
+        h = max(1, min(size, sh - y))
+
+        buf = self._get_pick_buffer()
+        if buf:
+            buf.enable()
+        else: #no frame buffers, so use the display - only the area read back, and put back what was there after
+            saved = (glReadPixels(x, y, w, h, GL_RGBA, GL_UNSIGNED_BYTE),
+                     glReadPixels(x, y, w, h, GL_DEPTH_COMPONENT, GL_FLOAT))
+            view.stats.read_pixels += 2
+            glPushAttrib(GL_SCISSOR_BIT)
+            glEnable(GL_SCISSOR_TEST)
+            glScissor(x, y, w, h)
+            glClearColor(0,0,0,0)
+            glClear(GL_DEPTH_BUFFER_BIT|GL_COLOR_BUFFER_BIT)
+            glClearColor(*view.screen.clear_color)
+        #use the same view as the scene, whether that is the display or the render_buffer
+        glMatrixMode(GL_PROJECTION)
+        glLoadMatrixd(numpy.transpose(self._get_view_matrix()))
+        glViewport(0, 0, *self._get_view_size())
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        glEnable(GL_DEPTH_TEST)
+
+        glPushAttrib(GL_ALL_ATTRIB_BITS)
+        #fog that is "fully thick" from the camera on replaces every fragment with the fog color,
+        #no matter how the object sets its color, textures or lighting
+        glEnable(GL_FOG)
+        glFogi(GL_FOG_MODE, GL_LINEAR)
+        glFogf(GL_FOG_START, -2)
+        glFogf(GL_FOG_END, -1)
+        glDisable(GL_BLEND)
+        glDisable(GL_DITHER)
+        glEnable(GL_ALPHA_TEST)
+        glAlphaFunc(GL_GREATER, 0)
+        glDepthMask(GL_TRUE)
+
+        if camera:
+            camera.push()
+        pick_ray = None
+        if self.graph.octree_3d is not None and self.pick_size <= 1:
+            pick_ray = self._get_pick_ray(camera, mpx, mpy)
+
+        g = self.graph
+        ids = []
+        for objects, tree, removed in ((g.render_3d, g.octree_3d, g.removed_3d),
+                                       (g.render_3d_blend, g.octree_3d_blend, g.removed_3d_blend),
+                                       (g.render_3d_always, g.octree_3d_always, g.removed_3d_always)):
+            if objects is g.render_3d_always:
+                glDisable(GL_DEPTH_TEST)
+            candidates = self._get_pick_candidates(tree, pick_ray)
+            if candidates is None:
+                candidates = objects
+            for i in candidates:
+                if removed and i in removed:
+                    continue
+                if i.visible and i.pickable and not i.dead_remove_from_scene:
+                    if frustum and not i.get_bounding_sphere().in_frustum(frustum):
+                        continue
+                    ids.append(i)
+                    n = len(ids)
+                    glFogfv(GL_FOG_COLOR, ((n >> 16 & 255) / 255.0,
+                                           (n >> 8 & 255) / 255.0,
+                                           (n & 255) / 255.0, 1))
+                    i.render(camera)
+        if camera:
+            camera.pop()
+
+        pixels = glReadPixels(x, y, w, h, GL_RGB, GL_UNSIGNED_BYTE)
+        view.stats.read_pixels += 1
+        glPopAttrib()
+
+        if buf:
+            buf.disable()
+        else:
+            self._restore_area(x, y, w, h, *saved)
+            glPopAttrib()
+
+        if isinstance(pixels, str):
+            pixels = numpy.fromstring(pixels, dtype=numpy.uint8)
+        pixels = numpy.asarray(pixels, dtype=numpy.uint32).reshape((h, w, 3))
+        found = (pixels[:,:,0] << 16) | (pixels[:,:,1] << 8) | pixels[:,:,2]
+        #sort by distance from the mouse, so the closest object comes first
+        yy, xx = numpy.indices((h, w))
+        order = numpy.argsort(((xx + x - mpx)**2 + (yy + y - mpy)**2).ravel(), kind="mergesort")
+        picked = []
+        for n in found.ravel()[order]:
+            if n and n <= len(ids) and not ids[n-1] in picked:
+                picked.append(ids[n-1])
+        return picked
 
     def render(self, camera=None, pick_pos=None):
         """Render all objects.
            camera must no or the camera object used to render the scene
            Returns None or picked object if Scene.pick is True and an object is actually touching the mouse."""
-        if self.render_buffer:
-            self.render_buffer.enable()
-        else:
-            view.set3d()
         pick = None
 
+        if self.snapshot is not None:
+            self.snapshot.apply()
+
+        self._remove_dead()
+
         if pick_pos == None:
             mpx, mpy = view.screen.get_mouse_pos()
             mpy = view.screen.screen_size[1] - mpy
@@ -112,126 +693,289 @@ class Scene(object):
             mpy = view.screen.screen_size[1] - mpy
         last_depth = 1
 
-        my_lights = list(all_lights)
+        self.num_drawn = self.num_culled = self.num_occluded = 0
+        frustum = None
+        if self.cull and self.render3d:
+            frustum = self.get_frustum(camera)
+
+        if view.screen.collect_stats:
+            stats = view.stats
+        else:
+            stats = None
+
+        depth_pick = self.pick and self.render3d and self.pick_mode == "depth"
+        if self.pick and self.render3d and self.pick_mode == "color":
+            start = time.time()
+            self.picked = self._pick_color(camera, frustum, mpx, mpy)
+            if self.picked:
+                pick = self.picked[0]
+            if stats:
+                stats.add_pass("pick", 0, 0, 0, time.time() - start)
+
+        if self.render_buffer:
+            self.render_buffer.enable()
+        else:
+            view.set3d()
+
         if self.graph.skybox and camera:
+            start = time.time()
             self.graph.skybox.render(camera)
+            if stats:
+                stats.add_pass("skybox", 1, 1, 0, time.time() - start)
         if self.render3d:
             if camera:
                 camera.push()
-            for i in self.graph.lights:
-                i.gl_light = my_lights.pop()
-                i.shine()
+            pick_ray = None
+            if depth_pick and self.graph.octree_3d is not None:
+                pick_ray = self._get_pick_ray(camera, mpx, mpy)
+            light_each = self.light_manager.begin(frustum)
             glEnable(GL_ALPHA_TEST)
-            for i in self.graph.render_3d:
-                if i.dead_remove_from_scene:
-                    self.graph.render_3d.remove(i)
+            start = time.time()
+            drawn, culled = self.num_drawn, self.num_culled
+            candidates = self._get_pick_candidates(self.graph.octree_3d, pick_ray)
+            removed = self.graph.removed_3d
+            if self.sort:
+                objects = self._get_sorted_3d()
+            else:
+                objects = self.graph.render_3d
+            objects = self.get_visible(objects, self.graph.octree_3d, frustum, self.sort)
+            if self.occlude:
+                occluded = self.num_occluded
+                self.update_occlusion(camera, objects)
+                objects = self.get_unoccluded(objects)
+                self.num_culled += self.num_occluded - occluded
+            for i in objects:
+                if removed and i in removed:
+                    continue
                 if i.visible:
+                    self.num_drawn += 1
+                    if light_each:
+                        self.light_manager.apply(i)
                     i.render(camera)
-                    if self.pick and i.pickable:
+                    if depth_pick and i.pickable and (candidates is None or i in candidates):
                         dep = glReadPixelsf(mpx, mpy, 1, 1, GL_DEPTH_COMPONENT)[0][0]
+                        view.stats.read_pixels += 1
                         if dep < last_depth:
                             last_depth = dep
                             pick = i
 
             glDisable(GL_ALPHA_TEST)
-            r, g, b, a = glReadPixelsf(mpx, mpy, 1, 1, GL_RGBA)[0][0]
-            last_color = r,g,b,a
+            if stats:
+                stats.add_pass("3d", len(self.graph.render_3d), self.num_drawn - drawn,
+                               self.num_culled - culled, time.time() - start)
+            if depth_pick:
+                r, g, b, a = glReadPixelsf(mpx, mpy, 1, 1, GL_RGBA)[0][0]
+                view.stats.read_pixels += 1
+                last_color = r,g,b,a
             glDepthMask(GL_FALSE)
-            for i in self.graph.render_3d_blend:
-                if i.dead_remove_from_scene:
-                    self.graph.render_3d_blend.remove(i)
+            start = time.time()
+            drawn, culled = self.num_drawn, self.num_culled
+            candidates = self._get_pick_candidates(self.graph.octree_3d_blend, pick_ray)
+            removed = self.graph.removed_3d_blend
+            objects = self.get_visible(self.graph.render_3d_blend, self.graph.octree_3d_blend, frustum)
+            if self.occlude:
+                occluded = self.num_occluded
+                objects = self.get_unoccluded(objects)
+                self.num_culled += self.num_occluded - occluded
+            if self.sort_blend:
+                objects = self._sort_blend(objects, camera)
+            for i in objects:
+                if removed and i in removed:
+                    continue
                 if i.visible:
+                    self.num_drawn += 1
+                    if light_each:
+                        self.light_manager.apply(i)
                     i.render(camera)
-                    if self.pick and i.pickable:
+                    if depth_pick and i.pickable and (candidates is None or i in candidates):
                         r, g, b, a = glReadPixelsf(mpx, mpy, 1, 1, GL_RGBA)[0][0]
+                        view.stats.read_pixels += 1
                         col = r,g,b,a
                         if col != last_color:
                             last_color = col
                             pick = i
             glDepthMask(GL_TRUE)
+            if stats:
+                stats.add_pass("3d_blend", len(self.graph.render_3d_blend), self.num_drawn - drawn,
+                               self.num_culled - culled, time.time() - start)
             glDisable(GL_DEPTH_TEST)
-            for i in self.graph.render_3d_always:
-                if i.dead_remove_from_scene:
-                    self.graph.render_3d_always.remove(i)
+            start = time.time()
+            drawn, culled = self.num_drawn, self.num_culled
+            candidates = self._get_pick_candidates(self.graph.octree_3d_always, pick_ray)
+            removed = self.graph.removed_3d_always
+            for i in self.get_visible(self.graph.render_3d_always, self.graph.octree_3d_always, frustum):
+                if removed and i in removed:
+                    continue
                 if i.visible:
+                    self.num_drawn += 1
+                    if light_each:
+                        self.light_manager.apply(i)
                     i.render(camera)
-                    if self.pick and i.pickable:
+                    if depth_pick and i.pickable and (candidates is None or i in candidates):
                         r, g, b, a = glReadPixelsf(mpx, mpy, 1, 1, GL_RGBA)[0][0]
+                        view.stats.read_pixels += 1
                         col = r,g,b,a
                         if col != last_color:
                             last_color = col
                             pick = i
             glEnable(GL_DEPTH_TEST)
+            if stats:
+                stats.add_pass("3d_always", len(self.graph.render_3d_always), self.num_drawn - drawn,
+                               self.num_culled - culled, time.time() - start)
 
-            for i in self.graph.lights:
-                i.hide()
+            self.light_manager.end()
             if camera:
                 camera.pop()
 
         if self.render2d:
+            start = time.time()
+            drawn = 0
             view.set2d()
             glPushMatrix()
+            view.stats.matrix_pushes += 1
             rx = 1.0 * view.screen.screen_size[0] / view.screen.screen_size_2d[0]
             ry = 1.0 * view.screen.screen_size[1] / view.screen.screen_size_2d[1]
             glScalef(rx, ry, 1)
             glDisable(GL_LIGHTING)
+            removed = self.graph.removed_2d
+            batch = None
+            if self.batch_2d:
+                batch = self.sprite_batch
             for i in self.graph.render_2d:
-                if i.dead_remove_from_scene:
-                    self.graph.render_2d.remove(i)
-                if i.visible: i.render()
+                if removed and i in removed:
+                    continue
+                if i.visible:
+                    drawn += 1
+                    if batch is None:
+                        i.render()
+                    elif batch.accepts(i):
+                        batch.add_image(i)
+                    else:
+                        batch.draw() #keep everything drawn in order
+                        i.render()
+            if batch is not None:
+                batch.draw()
             if view.screen.lighting:
                 glEnable(GL_LIGHTING)
             glPopMatrix()
+            if stats:
+                stats.add_pass("2d", len(self.graph.render_2d), drawn, 0, time.time() - start)
 
         if self.render_buffer:
             self.render_buffer.disable()
 
+        self.flush_removed()
+
         return pick
 
+    def _remove_dead(self):
+        """Remove every object that has dead_remove_from_scene set - from the whole lists,
+           so ones that are culled, occluded or in hidden cells go too."""
+        g = self.graph
+        for objects, members, remove in ((g.render_2d, g.members_2d, self.remove_2d),
+                                         (g.render_3d, g.members_3d, self.remove_3d),
+                                         (g.render_3d_blend, g.members_3d_blend, self.remove_3d_blend),
+                                         (g.render_3d_always, g.members_3d_always, self.remove_3d_always)):
+            for i in [i for i in objects if i.dead_remove_from_scene]:
+                if i in members: #not already removed
+                    remove(i)
+
+    def flush_removed(self):
+        """Take every removed object out of the scene's lists, all at once.
+           This is called at the end of every render, so it is only needed to see the lists change right away."""
+        g = self.graph
+        for objects, removed in ((g.render_2d, g.removed_2d),
+                                 (g.render_3d, g.removed_3d),
+                                 (g.render_3d_blend, g.removed_3d_blend),
+                                 (g.render_3d_always, g.removed_3d_always)):
+            if removed:
+                objects[:] = [i for i in objects if not i in removed]
+                removed.clear()
+                self._sorted_3d = None
+
+    def _add_to(self, objects, members, removed, obj):
+        """Add obj to the render list objects, with members/removed the Tree sets kept for it.
+           Returns whether obj was appended (False if it was only waiting to be flushed out of the list)."""
+        members.add(obj)
+        if obj in removed: #not flushed yet, so it is still in the list
+            removed.remove(obj)
+            return False
+        objects.append(obj)
+        return True
+
+    def _remove_from(self, members, removed, obj):
+        """Mark obj to be taken out of a render list at the next flush_removed, with members/removed the Tree sets kept for it.
+           Raises ValueError if obj isn't in the list."""
+        if not obj in members:
+            raise ValueError, "%r is not in the scene" % (obj,)
+        members.remove(obj)
+        removed.add(obj)
+
     def add_2d(self, ele):
         """Add a 2d object or list of objects to the scene."""
         if not hasattr(ele, "__iter__"):
             ele = [ele]
+        g = self.graph
         for i in ele:
-            self.graph.render_2d.append(i)
+            self._add_to(g.render_2d, g.members_2d, g.removed_2d, i)
             i.scene = self
 
     def remove_2d(self, ele):
-        """Remove a 2d object from the scene."""
-        self.graph.render_2d.remove(ele)
+        """Remove a 2d object from the scene - raises ValueError if it isn't in the scene.
+           It stops rendering right away, but stays in graph.render_2d until the end of the frame (see flush_removed)."""
+        self._remove_from(self.graph.members_2d, self.graph.removed_2d, ele)
 
     def add_3d(self, ele):
         """Add a 3d, non-blended, depth-tested object or list of objects to the scene."""
         if not hasattr(ele, "__iter__"):
             ele = [ele]
+        g = self.graph
         for i in ele:
-            self.graph.render_3d.append(i)
+            if self._add_to(g.render_3d, g.members_3d, g.removed_3d, i):
+                self._sorted_3d = None
+            if g.octree_3d is not None:
+                g.octree_3d.add(i)
 
     def remove_3d(self, ele):
-        """Remove a 3d object from the scene."""
-        self.graph.render_3d.remove(ele)
+        """Remove a 3d object from the scene - raises ValueError if it isn't in the scene.
+           It stops rendering right away, but stays in graph.render_3d until the end of the frame (see flush_removed)."""
+        self._remove_from(self.graph.members_3d, self.graph.removed_3d, ele)
+        if self.graph.octree_3d is not None:
+            self.graph.octree_3d.remove(ele)
 
     def add_3d_blend(self, ele):
         """Add a 3d, blended, depth-tested object or list of objects to the scene."""
         if not hasattr(ele, "__iter__"):
             ele = [ele]
+        g = self.graph
         for i in ele:
-            self.graph.render_3d_blend.append(i)
+            self._add_to(g.render_3d_blend, g.members_3d_blend, g.removed_3d_blend, i)
+            if g.octree_3d_blend is not None:
+                g.octree_3d_blend.add(i)
 
     def remove_3d_blend(self, ele):
-        """Remove a 3d blended object from the scene."""
-        self.graph.render_3d_blend.remove(ele)
+        """Remove a 3d blended object from the scene - raises ValueError if it isn't in the scene.
+           It stops rendering right away, but stays in graph.render_3d_blend until the end of the frame (see flush_removed)."""
+        self._remove_from(self.graph.members_3d_blend, self.graph.removed_3d_blend, ele)
+        if self.graph.octree_3d_blend is not None:
+            self.graph.octree_3d_blend.remove(ele)
 
     def add_3d_always(self, ele):
         """Add a 3d, blended, non-depth-tested (always visible) object or list of objects to the scene."""
         if not hasattr(ele, "__iter__"):
             ele = [ele]
+        g = self.graph
         for i in ele:
-            self.graph.render_3d_always.append(i)
+            self._add_to(g.render_3d_always, g.members_3d_always, g.removed_3d_always, i)
+            if g.octree_3d_always is not None:
+                g.octree_3d_always.add(i)
 
     def remove_3d_always(self, ele):
-        """Remove a 3d always visible obejct from the scene."""
-        self.graph.render_3d_always.remove(ele)
+        """Remove a 3d always visible obejct from the scene - raises ValueError if it isn't in the scene.
+           It stops rendering right away, but stays in graph.render_3d_always until the end of the frame (see flush_removed)."""
+        self._remove_from(self.graph.members_3d_always, self.graph.removed_3d_always, ele)
+        if self.graph.octree_3d_always is not None:
+            self.graph.octree_3d_always.remove(ele)
 
     def add_skybox(self, ele=None):
         """Add a Skybox or Skyball object to the scene.
@@ -239,13 +983,347 @@ class Scene(object):
         self.graph.skybox = ele
 
     def add_light(self, light):
-        """Add a light to the scene."""
-        if len(self.graph.lights) < 8:
+        """Add a light to the scene.
+           Any number of lights can be added - if more than OpenGL supports (8) can be seen,
+           each object is lit by the ones closest to it (see light.LightManager)."""
+        if not light in self.graph.lights:
             self.graph.lights.append(light)
-        else:
-            raise ValueError("Too many Lights - max 8")
+            self.light_manager.add(light)
 
     def remove_light(self, light):
         """Remove a light from the scene."""
         if light in self.graph.lights:
             self.graph.lights.remove(light)
+            self.light_manager.remove(light)
+
+    def save(self, filename):
+        """Save the 3d objects of the scene, built into triangles, to filename (see scenefile.save).
+           Returns a list of the objects that couldn't be saved."""
+        return scenefile.save(self, filename)
+
+    def load(self, filename, mmap=True):
+        """Add the objects saved to filename (with save) to the scene, as misc.BakedObject's, and return them.
+           mmap is whether to memory map the triangles from the file, instead of reading them into memory"""
+        return scenefile.load(filename, self, mmap)
+
+class Cell(object):
+    """An axis-aligned box of space in a CellScene, like a room or a stretch of corridor,
+       connected to other cells through Portals."""
+    def __init__(self, low, high):
+        """Create the cell
+           low and high are the (x,y,z) lowest and highest corners of the cell"""
+        self.low = tuple(low)
+        self.high = tuple(high)
+        self.portals = []
+
+    def contains(self, pos):
+        """Return whether (x,y,z) pos is inside the cell."""
+        for i in xrange(3):
+            if not self.low[i] <= pos[i] <= self.high[i]:
+                return False
+        return True
+
+    def overlaps(self, low, high):
+        """Return whether the box from low to high touches the cell."""
+        for i in xrange(3):
+            if high[i] < self.low[i] or low[i] > self.high[i]:
+                return False
+        return True
+
+class Portal(object):
+    """An opening between two Cells of a CellScene, that they can be seen through."""
+    def __init__(self, a, b, corners):
+        """Create the portal, and add it to both cells
+           a and b are the Cells the portal connects
+           corners is a list of the (x,y,z) corners of the opening"""
+        self.cells = a, b
+        self.corners = [tuple(i) for i in corners]
+        #as OpenGL coords, ready to be projected
+        self._points = numpy.array([(x, y, -z, 1) for x, y, z in self.corners], dtype=numpy.float64)
+        a.portals.append(self)
+        b.portals.append(self)
+
+    def other(self, cell):
+        """Return the cell on the other side of the portal from cell."""
+        if cell is self.cells[0]:
+            return self.cells[1]
+        return self.cells[0]
+
+    def get_screen_rect(self, matrix):
+        """Return the (left, bottom, right, top) -1 to 1 screen rect the portal covers, or None if it is behind the camera.
+           matrix must be the 4x4 numpy projection matrix multiplied by the camera (modelview) matrix"""
+        clip = numpy.dot(self._points, numpy.transpose(matrix))
+        w = clip[:,3]
+        if (w <= 0.0001).all():
+            return None
+        if (w <= 0.0001).any():
+            return -1, -1, 1, 1 #the camera is in the portal, it can see anything through it
+        x = clip[:,0] / w
+        y = clip[:,1] / w
+        return float(x.min()), float(y.min()), float(x.max()), float(y.max())
+
+class CellScene(Scene):
+    """A Scene split into Cells connected by Portals, like the rooms and corridors of a tile based level.
+       When rendering, only the 3d objects in cells that can be seen from the camera's cell,
+       through portals that are in view, are rendered - so a level costs per room in view, not per level.
+       Objects are put in every cell their bounding sphere touches, and moved when their pos or scale are set.
+       Objects outside all cells (and everything if the camera is outside all cells) are always rendered."""
+    def __init__(self):
+        """Create the scene."""
+        Scene.__init__(self)
+        self.cells = []
+        self.portals = []
+        self.use_cells = True #whether to skip objects in cells that can't be seen
+        self.visible_cells = None #set of the cells seen last render, or None if everything was rendered
+
+        self._object_cells = {} #obj: list of cells it touches
+        self._grid = None #(rows of cells, tile_size, origin) from build_from_grid
+
+    def add_cell(self, low, high):
+        """Create a Cell from low to high (see Cell), add it to the scene and return it."""
+        cell = Cell(low, high)
+        self.cells.append(cell)
+        self._grid = None
+        self._place_all()
+        return cell
+
+    def add_portal(self, a, b, corners):
+        """Create a Portal between cells a and b (see Portal), add it to the scene and return it."""
+        portal = Portal(a, b, corners)
+        self.portals.append(portal)
+        return portal
+
+    def build_from_grid(self, grid, tile_size=1, origin=(0,0), y_range=(-0.5,0.5), solid=(1,)):
+        """Replace all cells and portals with ones built from a 2d occupancy grid.
+           grid must be a list of rows, each a list of tile values - row n, column m is centered at
+               (origin[0] + m*tile_size, origin[1] + n*tile_size) on the x/z plane
+           tile_size is the width of each tile
+           y_range is the (bottom, top) of the cells
+           solid is a list of the tile values that are walls
+           Open tiles are merged into as few rectangular cells as possible, with portals where they meet."""
+        self.cells = []
+        self.portals = []
+        height = len(grid)
+        width = max([len(i) for i in grid] + [0])
+        def is_open(row, col):
+            return col < len(grid[row]) and not grid[row][col] in solid
+        rows = [[None]*width for i in xrange(height)]
+        ox = origin[0] - tile_size * 0.5
+        oz = origin[1] - tile_size * 0.5
+        bottom, top = y_range
+        #merge open tiles into rectangles, as wide as possible and then as tall as possible
+        rects = []
+        for row in xrange(height):
+            for col in xrange(width):
+                if rows[row][col] or not is_open(row, col):
+                    continue
+                w = 1
+                while col+w < width and is_open(row, col+w) and not rows[row][col+w]:
+                    w += 1
+                h = 1
+                while row+h < height:
+                    n = row+h
+                    if [i for i in xrange(col, col+w) if not is_open(n, i) or rows[n][i]]:
+                        break
+                    h += 1
+                cell = Cell((ox + col*tile_size, bottom, oz + row*tile_size),
+                            (ox + (col+w)*tile_size, top, oz + (row+h)*tile_size))
+                self.cells.append(cell)
+                rects.append((cell, row, col, w, h))
+                for n in xrange(row, row+h):
+                    for i in xrange(col, col+w):
+                        rows[n][i] = cell
+
+        def get(row, col):
+            if 0 <= row < height and 0 <= col < width:
+                return rows[row][col]
+            return None
+        #walk the right and bottom edge of each cell, adding a portal for each run of tiles of one neighbor
+        ids = dict([(rects[i][0], i) for i in xrange(len(rects))])
+        for cell, row, col, w, h in rects:
+            edges = (([(n, col+w) for n in xrange(row, row+h)], 0),
+                     ([(row+h, i) for i in xrange(col, col+w)], 1))
+            for tiles, axis in edges:
+                run = []
+                for tile in tiles + [None]:
+                    other = None
+                    if tile:
+                        other = get(*tile)
+                    if run and not (other and other is run[0]):
+                        self._add_grid_portal(cell, run[0], run[1], run[-1], axis,
+                                              tile_size, ox, oz, bottom, top)
+                        run = []
+                    if other and not run:
+                        run = [other, tile]
+                    elif other:
+                        run.append(tile)
+        self._grid = rows, tile_size, (ox, oz)
+        self._place_all()
+
+    def _add_grid_portal(self, a, b, first, last, axis, tile_size, ox, oz, bottom, top):
+        """Add a portal between grid cells a and b, covering the edge of tiles first to last of b
+           axis is 0 if b is to the right (+x) of a, or 1 if it is below (+z)"""
+        if axis == 0:
+            x = ox + first[1]*tile_size
+            z0 = oz + first[0]*tile_size
+            z1 = oz + (last[0]+1)*tile_size
+            corners = ((x, bottom, z0), (x, top, z0), (x, top, z1), (x, bottom, z1))
+        else:
+            z = oz + first[0]*tile_size
+            x0 = ox + first[1]*tile_size
+            x1 = ox + (last[1]+1)*tile_size
+            corners = ((x0, bottom, z), (x0, top, z), (x1, top, z), (x1, bottom, z))
+        self.add_portal(a, b, corners)
+
+    def get_cell(self, pos):
+        """Return the cell (x,y,z) pos is in, or None."""
+        if self._grid:
+            rows, tile_size, (ox, oz) = self._grid
+            row = int(math.floor((pos[2] - oz) / tile_size))
+            col = int(math.floor((pos[0] - ox) / tile_size))
+            if 0 <= row < len(rows) and 0 <= col < len(rows[0]):
+                cell = rows[row][col]
+                if cell and cell.low[1] <= pos[1] <= cell.high[1]:
+                    return cell
+            return None
+        for i in self.cells:
+            if i.contains(pos):
+                return i
+        return None
+
+    def get_cells_touching(self, low, high):
+        """Return a list of the cells the box from (x,y,z) low to high touches."""
+        if self._grid:
+            rows, tile_size, (ox, oz) = self._grid
+            r0 = max(int(math.floor((low[2] - oz) / tile_size)), 0)
+            r1 = min(int(math.floor((high[2] - oz) / tile_size)), len(rows)-1)
+            c0 = max(int(math.floor((low[0] - ox) / tile_size)), 0)
+            c1 = min(int(math.floor((high[0] - ox) / tile_size)), len(rows[0])-1)
+            found = []
+            for row in xrange(r0, r1+1):
+                for cell in rows[row][c0:c1+1]:
+                    if cell and not cell in found and cell.overlaps(low, high):
+                        found.append(cell)
+            return found
+        return [i for i in self.cells if i.overlaps(low, high)]
+
+    def _place(self, obj):
+        """Work out which cells obj is in, and start watching it for moves."""
+        sphere = obj.get_bounding_sphere()
+        r = sphere.radius
+        self._object_cells[obj] = self.get_cells_touching((sphere.x-r, sphere.y-r, sphere.z-r),
+                                                          (sphere.x+r, sphere.y+r, sphere.z+r))
+        obj.add_watcher(self)
+
+    def _place_all(self):
+        """Work out the cells of every object again, after the cells change."""
+        for i in list(self._object_cells):
+            self._place(i)
+
+    def _unplace(self, obj):
+        """Forget obj and stop watching it."""
+        if obj in self._object_cells:
+            del self._object_cells[obj]
+            obj.remove_watcher(self)
+
+    def object_moved(self, obj):
+        """Called when a watched object's pos or scale are set - moves it to the cells it is in now."""
+        if obj in self._object_cells:
+            self._place(obj)
+
+    def update_object(self, obj):
+        Scene.update_object(self, obj)
+        self.object_moved(obj)
+    update_object.__doc__ = Scene.update_object.__doc__
+
+    def get_visible_cells(self, camera=None):
+        """Return a set of the cells that can be seen from camera (None or the camera object),
+           flooding out from the camera's cell through every portal that is in view,
+           or None if the camera isn't in a cell."""
+        if camera:
+            eye = camera.get_eye_pos()
+        else:
+            eye = (0, 0, 0)
+        start = self.get_cell(eye)
+        if start is None:
+            return None
+        matrix = self._get_view_matrix(camera)
+        visible = set([start])
+        seen = {} #cell: screen rects it has been flooded through already
+        stack = [(start, (-1, -1, 1, 1), None)]
+        while stack:
+            cell, (l, b, r, t), came_from = stack.pop()
+            for portal in cell.portals:
+                if portal is came_from:
+                    continue
+                rect = portal.get_screen_rect(matrix)
+                if rect is None:
+                    continue
+                #narrow the view down to what can be seen through the portal
+                rect = max(rect[0], l), max(rect[1], b), min(rect[2], r), min(rect[3], t)
+                if rect[0] >= rect[2] or rect[1] >= rect[3]:
+                    continue
+                other = portal.other(cell)
+                done = seen.setdefault(other, [])
+                for i in done:
+                    if i[0] <= rect[0] and i[1] <= rect[1] and i[2] >= rect[2] and i[3] >= rect[3]:
+                        break
+                else:
+                    done.append(rect)
+                    visible.add(other)
+                    stack.append((other, rect, portal))
+        return visible
+
+    def get_visible(self, objects, tree=None, frustum=None, keep_order=True):
+        objects = Scene.get_visible(self, objects, tree, frustum, keep_order)
+        cells = self.visible_cells
+        if cells is None:
+            return objects
+        where = self._object_cells
+        visible = []
+        for i in objects:
+            found = where.get(i)
+            if found:
+                for c in found:
+                    if c in cells:
+                        visible.append(i)
+                        break
+            else:
+                visible.append(i)
+        self.num_culled += len(objects) - len(visible)
+        return visible
+    get_visible.__doc__ = Scene.get_visible.__doc__ + """
+           Objects in cells that can't be seen (see get_visible_cells) are skipped too."""
+
+    def render(self, camera=None, pick_pos=None):
+        self.visible_cells = None
+        if self.use_cells and self.render3d and self.cells:
+            self.visible_cells = self.get_visible_cells(camera)
+        return Scene.render(self, camera, pick_pos)
+    render.__doc__ = Scene.render.__doc__
+
+    def add_3d(self, ele):
+        Scene.add_3d(self, ele)
+        if not hasattr(ele, "__iter__"):
+            ele = [ele]
+        for i in ele:
+            self._place(i)
+    add_3d.__doc__ = Scene.add_3d.__doc__
+
+    def remove_3d(self, ele):
+        Scene.remove_3d(self, ele)
+        self._unplace(ele)
+    remove_3d.__doc__ = Scene.remove_3d.__doc__
+
+    def add_3d_blend(self, ele):
+        Scene.add_3d_blend(self, ele)
+        if not hasattr(ele, "__iter__"):
+            ele = [ele]
+        for i in ele:
+            self._place(i)
+    add_3d_blend.__doc__ = Scene.add_3d_blend.__doc__
+
+    def remove_3d_blend(self, ele):
+        Scene.remove_3d_blend(self, ele)
+        self._unplace(ele)
+    remove_3d_blend.__doc__ = Scene.remove_3d_blend.__doc__
@@ -0,0 +1,186 @@
+"""
+pyggel.scenefile
+This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
+
+The scenefile module saves the 3d objects of a scene, already built into triangles, to a binary file,
+so a level loads (memory mapped) without building every object or parsing every mesh again.
+"""
+
+from include import *
+import data, misc, math3d
+
+import numpy
+from numpy.lib import format
+import re, struct
+
+MAGIC = "PYGGEL-SCENE"
+VERSION = 1
+
+#the scene lists that are saved, the set of objects removed from each, and the Scene method that adds to it
+LISTS = (("render_3d", "removed_3d", "add_3d"),
+         ("render_3d_blend", "removed_3d_blend", "add_3d_blend"),
+         ("render_3d_always", "removed_3d_always", "add_3d_always"))
+
+#one row per object - which is the index in LISTS it was in, parts are rows first to first+num_parts of the part table
+object_dtype = numpy.dtype([("name", "S32"), ("which", "i4"),
+                            ("pos", "f8", 3), ("rotation", "f8", 3), ("scale", "f8", 3),
+                            ("size", "f8", 3), ("extents", "f8", 3),
+                            ("visible", "i1"), ("pickable", "i1"), ("occluder", "i1"),
+                            ("first", "i4"), ("num_parts", "i4")])
+#one row per texture of an object - texture is the index in the texture name table,
+#the triangles are vertices start to start+count of the vertex table
+part_dtype = numpy.dtype([("texture", "i4"), ("tiled", "i1"), ("start", "i4"), ("count", "i4")])
+
+def write_file(filename, magic, version, arrays):
+    """Write a file of a "magic version" line and then each numpy array in arrays, in the .npy format."""
+    f = open(filename, "wb")
+    try:
+        f.write("%s %d\n" % (magic, version))
+        for array in arrays:
+            format.write_array(f, array)
+    finally:
+        f.close()
+
+#the header numpy writes for a plain (not structured) array, which _read_header reads without numpy's (slow) parser
+_SIMPLE_HEADER = re.compile(r"\{'descr': '([^']+)', 'fortran_order': False, 'shape': \(([0-9, ]*)\), \}\s*$")
+
+def _read_header(f):
+    """Read the header of a .npy array at the current position of file f, and return its (shape, dtype)."""
+    start = f.tell()
+    if format.read_magic(f) == (1, 0):
+        length, = struct.unpack("<H", f.read(2))
+        match = _SIMPLE_HEADER.match(f.read(length))
+        if match:
+            shape = tuple([int(i) for i in match.group(2).split(",") if i.strip()])
+            return shape, numpy.dtype(match.group(1))
+    f.seek(start)
+    version = format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran, dtype = format.read_array_header_1_0(f)
+    else:
+        shape, fortran, dtype = format.read_array_header_2_0(f)
+    if fortran:
+        raise ValueError, "fortran ordered arrays can't be read"
+    return shape, dtype
+
+def read_file(filename, magic, version, count, mmap=True):
+    """Return a list of the count numpy arrays in a file written by write_file.
+       The last one is memory mapped from the file if mmap is True - the rest are read into memory.
+       Raises ValueError if the file doesn't start with magic and version."""
+    f = open(filename, "rb")
+    try:
+        head = f.readline().split()
+        if len(head) != 2 or head[0] != magic:
+            raise ValueError, "%s is not a %s file" % (filename, magic)
+        if head[1] != str(version):
+            raise ValueError, "%s is version %s, only version %d can be loaded" % (filename, head[1], version)
+        arrays = []
+        for i in xrange(count):
+            shape, dtype = _read_header(f)
+            size = int(numpy.prod(shape))
+            if mmap and i == count - 1 and size:
+                arrays.append(numpy.memmap(filename, dtype=dtype, mode="r", offset=f.tell(), shape=shape))
+            else:
+                array = numpy.fromfile(f, dtype=dtype, count=size)
+                if not len(array) == size:
+                    raise ValueError, "%s is cut short" % filename
+                arrays.append(array.reshape(shape))
+    finally:
+        f.close()
+    return arrays
+
+def _get_texture_name(texture):
+    """Return the filename texture was loaded from, "" for a plain white data.BlankTexture,
+       or None if it can't be loaded again."""
+    if isinstance(texture, data.BlankTexture):
+        if texture.filename == repr((1,1)) + repr((1,1,1,1)):
+            return ""
+        return None
+    if type(texture.filename) is type(""):
+        return texture.filename
+    return None
+
+def save(scene, filename):
+    """Save the 3d objects of scene to filename, as the triangles get_geometry returns.
+       Returns a list of the objects that couldn't be saved - ones with no get_geometry (like Image3D's),
+       or with a texture that wasn't loaded from a file.
+       Texture filenames are saved as they were given, so load from the same directory."""
+    g = scene.graph
+    objects = []
+    parts = []
+    names = []
+    arrays = []
+    skipped = []
+    start = 0
+    for which in xrange(len(LISTS)):
+        listname, removedname, addname = LISTS[which]
+        removed = getattr(g, removedname)
+        for obj in getattr(g, listname):
+            if obj in removed:
+                continue
+            geometry = obj.get_geometry()
+            if geometry is None or None in [_get_texture_name(i[0]) for i in geometry]:
+                skipped.append(obj)
+                continue
+            first = len(parts)
+            extents = numpy.zeros(3)
+            for texture, color, verts, norms, texcs in geometry:
+                if not len(verts):
+                    continue
+                name = _get_texture_name(texture)
+                if not name in names:
+                    names.append(name)
+                array = misc.interleave_geometry(color, verts, norms, texcs)
+                parts.append((names.index(name), misc.is_tiled(texcs), start, len(array)))
+                arrays.append(array)
+                start += len(array)
+                extents = numpy.maximum(extents, abs(verts).max(0))
+
+            pos, rotation, full_scale = obj._get_transform()
+            scale = obj.get_scale()
+            size = [math3d.safe_div(float(full_scale[i]), scale[i]) for i in xrange(3)]
+            x, y, z = pos
+            objects.append((type(obj).__name__, which, (x, y, -z), rotation, scale,
+                            size, tuple(extents * numpy.abs(size)),
+                            obj.visible, obj.pickable, obj.get_occluder_box() is not None,
+                            first, len(parts) - first))
+
+    if arrays:
+        vertices = numpy.concatenate(arrays)
+    else:
+        vertices = numpy.zeros((0, 12), dtype=numpy.float32)
+    names = numpy.array(names, dtype="S%d" % max([1] + [len(i) for i in names]))
+
+    write_file(filename, MAGIC, VERSION, (numpy.array(objects, dtype=object_dtype),
+                                          numpy.array(parts, dtype=part_dtype),
+                                          names, vertices))
+    return skipped
+
+def load(filename, scene=None, mmap=True):
+    """Load the objects saved in filename, and return them as a list of misc.BakedObject's.
+       scene is None or the Scene to add them to (to the lists they were saved from)
+       mmap is whether to memory map the triangles from the file instead of reading them into memory"""
+    objects, parts, names, vertices = read_file(filename, MAGIC, VERSION, 4, mmap)
+
+    textures = []
+    for name in names.tolist():
+        if name:
+            textures.append(data.Texture(name))
+        else:
+            textures.append(data.BlankTexture())
+    triangles = []
+    for texture, tiled, start, count in parts.tolist():
+        triangles.append((textures[texture], bool(tiled), vertices[start:start+count]))
+
+    new = []
+    for row in objects.tolist():
+        name, which, pos, rotation, scale, size, extents, visible, pickable, occluder, first, num_parts = row
+        obj = misc.BakedObject(triangles[first:first+num_parts], extents, size,
+                               pos, rotation, scale, name)
+        obj.visible = bool(visible)
+        obj.pickable = bool(pickable)
+        obj.occluder = bool(occluder)
+        if scene is not None:
+            getattr(scene, LISTS[which][2])(obj)
+        new.append(obj)
+    return new
@@ -0,0 +1,156 @@
+"""
+pyggel.snapshot
+This library (PYGGEL) is licensed under the LGPL by Matthew Roe and PYGGEL contributors.
+
+The snapshot module contains a buffered store of object transforms,
+so game logic can run on another thread while the scene renders.
+"""
+
+import threading
+import numpy
+
+class TransformSnapshot(object):
+    """Buffered pos/rotation/scale of a set of scene objects, indexed by a handle (an int) per object.
+       The update thread writes into the back buffer (the pos, rotation and scale arrays, or write),
+       and calls publish when a whole update is done.
+       The render thread calls apply at the start of each frame (Scene.render does this if the scene has a snapshot),
+       which swaps in the newest published buffer and copies what changed onto the objects.
+       So the objects themselves are only ever touched by the render thread."""
+    def __init__(self, capacity=256):
+        """Create the snapshot
+           capacity is how many objects to make room for - it grows as needed"""
+        self.lock = threading.Lock()
+        self.objects = [] #handle: object, or None if the handle is free
+        self._free = []
+        self._fresh = False #whether a buffer has been published since the last apply
+        self.version = 0 #how many times publish has been called
+        self._alloc(max(capacity, 1))
+
+    def _alloc(self, capacity):
+        """(Re)create the buffers with room for capacity objects, keeping what is in them."""
+        old = getattr(self, "_back", None)
+        buffers = []
+        for i in xrange(4):
+            b = numpy.zeros((capacity, 9), dtype=numpy.float64)
+            b[:,6:9] = 1
+            buffers.append(b)
+        if old is not None:
+            n = len(old)
+            for new, prev in zip(buffers, (self._back, self._ready, self._front, self._applied)):
+                new[:n] = prev
+        self._back, self._ready, self._front, self._applied = buffers
+        self.capacity = capacity
+        #views into the back buffer, for the update thread to write to
+        self.pos = self._back[:,0:3]
+        self.rotation = self._back[:,3:6]
+        self.scale = self._back[:,6:9]
+
+    def _get_transform(self, obj):
+        """Return the 9 floats of pos, rotation and scale of obj."""
+        scale = obj.scale
+        try: scale = tuple(scale)
+        except: scale = scale, scale, scale
+        return tuple(obj.pos) + tuple(obj.rotation) + scale
+
+    def add(self, obj):
+        """Add obj, and return its handle - the row of the buffers it uses.
+           If the snapshot has to grow, the pos/rotation/scale arrays are replaced,
+           so add objects before the update thread starts, or have it fetch them again."""
+        self.lock.acquire()
+        try:
+            if self._free:
+                handle = self._free.pop()
+                self.objects[handle] = obj
+            else:
+                handle = len(self.objects)
+                if handle >= self.capacity:
+                    self._alloc(self.capacity * 2)
+                self.objects.append(obj)
+            row = self._get_transform(obj)
+            for i in (self._back, self._ready, self._front, self._applied):
+                i[handle] = row
+        finally:
+            self.lock.release()
+        return handle
+
+    def remove(self, handle):
+        """Stop updating the object with handle, and free the handle for reuse."""
+        self.lock.acquire()
+        try:
+            self.objects[handle] = None
+            self._free.append(handle)
+        finally:
+            self.lock.release()
+
+    def get_handle(self, obj):
+        """Return the handle of obj, or None if it isn't in the snapshot."""
+        for i in xrange(len(self.objects)):
+            if self.objects[i] is obj:
+                return i
+        return None
+
+    def write(self, handle, pos=None, rotation=None, scale=None):
+        """Set the pos, rotation and/or scale of the object with handle in the back buffer - for the update thread."""
+        if pos is not None:
+            self.pos[handle] = pos
+        if rotation is not None:
+            self.rotation[handle] = rotation
+        if scale is not None:
+            self.scale[handle] = scale
+
+    def read(self, handle):
+        """Return the (pos, rotation, scale) of the object with handle in the back buffer."""
+        b = self._back[handle]
+        return tuple(b[0:3]), tuple(b[3:6]), tuple(b[6:9])
+
+    def publish(self):
+        """Make everything written to the back buffer available to the renderer, all at once - for the update thread."""
+        self.lock.acquire()
+        try:
+            self._ready[:] = self._back
+            self._fresh = True
+            self.version += 1
+        finally:
+            self.lock.release()
+
+    def swap(self):
+        """Swap in the newest published buffer, if there is one, and return whether there was - for the render thread."""
+        self.lock.acquire()
+        try:
+            if not self._fresh:
+                return False
+            self._front, self._ready = self._ready, self._front
+            self._fresh = False
+            return True
+        finally:
+            self.lock.release()
+
+    def apply(self):
+        """Swap in the newest published buffer and copy every transform that changed onto its object.
+           Returns the number of objects changed - this must only be called from the render thread."""
+        if not self.swap():
+            return 0
+        n = len(self.objects)
+        front = self._front[:n]
+        applied = self._applied[:n]
+        diff = front != applied
+        moved = diff[:,0:3].any(1)
+        turned = diff[:,3:6].any(1)
+        scaled = diff[:,6:9].any(1)
+        changed = numpy.flatnonzero(moved | turned | scaled)
+        objects = self.objects
+        count = 0
+        for i in changed:
+            obj = objects[i]
+            if obj is None:
+                continue
+            row = front[i].tolist()
+            if moved[i]:
+                obj.pos = tuple(row[0:3])
+            if turned[i]:
+                obj.rotation = tuple(row[3:6])
+            if scaled[i]:
+                obj.scale = tuple(row[6:9])
+            count += 1
+        applied[:] = front
+        return count
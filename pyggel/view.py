@@ -10,6 +10,8 @@ from OpenGL import error
 oglError = error
 
 from include import *
+import math3d
+import time
 
 class _Screen(object):
     """A simple object to store screen settings."""
@@ -37,6 +39,7 @@ class _Screen(object):
         self.cursor_center = False
 
         self.debug = True
+        self.collect_stats = True
 
         self.have_init = False
 
@@ -111,6 +114,61 @@ class _Screen(object):
 
 screen = _Screen()
 
+class RenderStats(object):
+    """Counts of what was rendered, and how long it took, over one frame.
+       All scenes rendered in a frame add to the same stats, see get_stats."""
+    passes = ("skybox", "pick", "3d", "3d_blend", "3d_always", "2d")
+    def __init__(self):
+        """Create the stats."""
+        self.reset()
+
+    def reset(self):
+        """Clear all counts."""
+        self.visited = {} #pass name: objects looked at
+        self.drawn = {} #pass name: objects rendered
+        self.culled = {} #pass name: objects skipped because they were out of view
+        self.times = {} #pass name: seconds spent
+        for i in self.passes:
+            self.visited[i] = self.drawn[i] = self.culled[i] = 0
+            self.times[i] = 0.0
+
+        self.texture_binds = 0
+        self.display_lists = 0
+        self.draw_arrays = 0 #glDrawArrays/glDrawElements calls
+        self.read_pixels = 0
+        self.matrix_pushes = 0
+        self.lod_levels = {} #level: number of misc.LODGroups rendered at that level of detail
+        self.frame_time = 0.0
+
+    def add_pass(self, name, visited, drawn, culled, seconds):
+        """Add the counts and time of one render pass."""
+        self.visited[name] += visited
+        self.drawn[name] += drawn
+        self.culled[name] += culled
+        self.times[name] += seconds
+
+    def __str__(self):
+        """Return a short summary of the stats."""
+        drawn = 0
+        culled = 0
+        for i in self.passes:
+            drawn += self.drawn[i]
+            culled += self.culled[i]
+        text = "drawn: %s culled: %s binds: %s lists: %s arrays: %s reads: %s pushes: %s frame: %.2fms"%(
+            drawn, culled, self.texture_binds, self.display_lists, self.draw_arrays,
+            self.read_pixels, self.matrix_pushes, self.frame_time*1000)
+        if self.lod_levels:
+            text += " lod: %s"%" ".join(["%s:%s"%i for i in sorted(self.lod_levels.items())])
+        return text
+
+stats = RenderStats() #the frame being rendered
+last_stats = RenderStats() #the last finished frame
+_last_refresh = None
+
+def get_stats():
+    """Return the RenderStats of the last frame (counted between the last two refresh_screen calls)."""
+    return last_stats
+
 def init(screen_size=None, screen_size_2d=None,
          use_psyco=True, icon_image=None,
          fullscreen=False, hwrender=True,
@@ -270,6 +328,14 @@ def toggle_debug():
     """Toggle OpenGL debugging."""
     set_debug(not screen.debug)
 
+def set_stats(boolean):
+    """Enable/Disable timing and per pass counts of scene rendering - see get_stats."""
+    screen.collect_stats = boolean
+
+def toggle_stats():
+    """Toggle timing and per pass counts of scene rendering."""
+    set_stats(not screen.collect_stats)
+
 def build_screen():
     """Create the display window using the current set of screen parameters."""
     pygame.display.set_mode(screen.screen_size, screen.get_params())
@@ -293,6 +359,13 @@ def set_near_far_view(near=0.1, far=100.0):
 def set_view_angle(angle=45):
     screen.view_angle = angle
 
+def get_projection_matrix():
+    """Return the 4x4 numpy matrix of the projection set3d uses - so it can be used without touching OpenGL."""
+    screen_size = screen.screen_size
+    return math3d.perspective_matrix(screen.view_angle,
+                                     1.0*screen_size[0]/screen_size[1],
+                                     screen.close_view, screen.far_view)
+
 def set3d():
     """Enable 3d rendering."""
     screen_size = screen.screen_size
@@ -308,8 +381,10 @@ def set3d():
 
 def refresh_screen():
     """Flip the screen buffer, displaying any changes since the last clear."""
+    global stats, last_stats, _last_refresh
     if screen.cursor and screen.cursor_visible and pygame.mouse.get_focused():
         glPushMatrix()
+        stats.matrix_pushes += 1
         glDisable(GL_LIGHTING)
         screen.cursor.pos = screen.get_mouse_pos2d()
         rx = 1.0 * screen.screen_size[0] / screen.screen_size_2d[0]
@@ -326,6 +401,13 @@ def refresh_screen():
         glPopMatrix()
     pygame.display.flip()
 
+    now = time.time()
+    if _last_refresh:
+        stats.frame_time = now - _last_refresh
+    _last_refresh = now
+    stats, last_stats = last_stats, stats
+    stats.reset()
+
 def clear_screen(scene=None):
     """Clear buffers."""
     glDisable(GL_SCISSOR_TEST)
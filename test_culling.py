@@ -0,0 +1,49 @@
+import pyggel
+from pyggel import *
+
+import random
+
+def main():
+    pyggel.init()
+
+    camera = pyggel.camera.LookFromCamera((0,0,0))
+
+    my_light = pyggel.light.Light((0,100,0), (0.5,0.5,0.5,1),
+                                  (1,1,1,1), (50,50,50,10),
+                                  (0,0,0), True)
+
+    scene = pyggel.scene.Scene()
+    scene.add_light(my_light)
+    scene.enable_octree((0,0,0), 200, 6)
+    scene.cull = True
+
+    tex = pyggel.data.Texture("data/tile_example.png")
+    base = pyggel.geometry.Cube(1, texture=tex)
+    for i in xrange(2000):
+        c = base.copy()
+        c.pos = (random.randint(-100, 100), random.randint(-5, 5), random.randint(-100, 100))
+        scene.add_3d(c)
+
+    eh = event.Handler()
+
+    clock = pygame.time.Clock()
+
+    while 1:
+        clock.tick(999)
+        pyggel.view.set_title("FPS: %s - drawn: %s culled: %s"%(int(clock.get_fps()),
+                                                              scene.num_drawn, scene.num_culled))
+
+        eh.update()
+        if eh.quit:
+            pyggel.quit()
+            return None
+        if " " in eh.keyboard.hit:
+            scene.cull = not scene.cull
+
+        camera.roty += 0.5
+
+        view.clear_screen()
+        scene.render(camera)
+        view.refresh_screen()
+
+main()
@@ -0,0 +1,53 @@
+import pyggel
+from pyggel import *
+
+import random
+
+def main():
+    pyggel.init()
+
+    camera = pyggel.camera.LookAtCamera((0,0,0), distance=30)
+    camera.rotx = 30
+
+    scene = pyggel.scene.Scene()
+    scene.cull = True
+
+    #a dim sun, plus a lot more torches than OpenGL has lights - each cube gets the closest ones
+    sun = pyggel.light.Light((0,100,0), (0.1,0.1,0.1,1),
+                             (0.2,0.2,0.2,1), (0,0,0,1),
+                             (0,0,0), True)
+    scene.add_light(sun)
+    for i in xrange(32):
+        color = (random.random(), random.random(), random.random(), 1)
+        torch = pyggel.light.Light((random.randint(-40, 40), 1, random.randint(-40, 40)), (0,0,0,1),
+                                   color, (0,0,0,1), (0,0,0), False,
+                                   range=10, attenuation=(0.5,0,0.05))
+        scene.add_light(torch)
+
+    base = pyggel.geometry.Cube(1)
+    for x in xrange(-40, 41, 2):
+        for z in xrange(-40, 41, 2):
+            c = base.copy()
+            c.pos = (x, 0, z)
+            scene.add_3d(c)
+
+    eh = event.Handler()
+
+    clock = pygame.time.Clock()
+
+    while 1:
+        clock.tick(999)
+        pyggel.view.set_title("FPS: %s - lights: %s"%(int(clock.get_fps()), len(scene.graph.lights)))
+
+        eh.update()
+        if eh.quit:
+            pyggel.quit()
+            return None
+
+        camera.roty += 0.25
+
+        view.clear_screen()
+        scene.render(camera)
+        view.refresh_screen()
+
+main()
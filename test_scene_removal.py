@@ -0,0 +1,46 @@
+import pyggel
+from pyggel import *
+
+def main():
+    pyggel.init()
+
+    camera = pyggel.camera.LookFromCamera((0,0,0))
+    scene = pyggel.scene.Scene()
+
+    #removed, then flagged dead in the same frame - must not raise from render
+    adds = (scene.add_2d, scene.add_3d, scene.add_3d_blend, scene.add_3d_always)
+    removes = (scene.remove_2d, scene.remove_3d, scene.remove_3d_blend, scene.remove_3d_always)
+    objs = []
+    for add, remove in zip(adds, removes):
+        if add is scene.add_2d:
+            obj = pyggel.image.Image("data/tile_example.png")
+        else:
+            obj = pyggel.geometry.Cube(1, pos=(0,0,5))
+        add(obj)
+        remove(obj)
+        obj.dead_remove_from_scene = True
+        objs.append(obj)
+    scene.render(camera)
+    g = scene.graph
+    for i in (g.render_2d, g.render_3d, g.render_3d_blend, g.render_3d_always):
+        assert not [obj for obj in objs if obj in i]
+    print "removed then dead: ok"
+
+    #dead while out of view - culled objects must still be removed, from the octree as well
+    scene.enable_octree()
+    scene.cull = True
+    seen = pyggel.geometry.Cube(1, pos=(0,0,5))
+    hidden = pyggel.geometry.Cube(1, pos=(0,0,-1000))
+    scene.add_3d([seen, hidden])
+    scene.render(camera)
+    assert scene.num_culled == 1
+    hidden.dead_remove_from_scene = True
+    scene.render(camera)
+    assert not hidden in g.render_3d and not hidden in g.octree_3d
+    assert seen in g.render_3d
+    print "dead while culled: ok"
+
+    pyggel.quit()
+
+if __name__ == "__main__":
+    main()